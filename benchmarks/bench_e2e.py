@@ -0,0 +1,133 @@
+"""
+Сквозной бенчмарк всего процесса: main.py (бот + поток Flask) против локального Bot API.
+
+Поднимает benchmarks/fake_bot_api.py в этом процессе, запускает main.py отдельным
+процессом с TELEGRAM_API_URL на локальный сервер и ждет, пока синтетические
+пользователи пройдут все сценарии. Параллельно опрашивает /health Flask-приложения.
+
+Результат - JSON: сквозная пропускная способность, перцентили задержки
+от выдачи апдейта в getUpdates до последнего ответа бота, вызовы API, 429,
+задержка /health.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_e2e [--users 50] [--rounds 20] [--latency-ms 20] [--error-429 0.01] [--output e2e.json]
+    python -m benchmarks.bench_e2e --workers 4   # диспетчер и 4 воркера (bot/cluster.py)
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from .bench_replay import _git_commit, _latency_summary
+from .fake_bot_api import add_arguments, from_arguments
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _probe_health(url: str, stop: threading.Event, latencies: list, failures: list):
+    while not stop.wait(0.2):
+        begin = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=2) as response:
+                response.read()
+            latencies.append((time.perf_counter() - begin) * 1000)
+        except OSError:
+            failures.append(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Воркеров-процессов за диспетчером (WORKERS в main.py); 0 - один процесс")
+    parser.add_argument('--timeout', type=float, default=600.0, help="Предел времени прогона, сек")
+    parser.add_argument('--output', help="Файл для JSON-результата (по умолчанию - stdout)")
+    parser.add_argument('--keep', action='store_true', help="Не удалять рабочую папку с логом бота")
+    args = parser.parse_args()
+
+    api = from_arguments(args)
+    server = api.make_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}/bot{{0}}/{{1}}"
+
+    flask_port = _free_port()
+    workdir = tempfile.mkdtemp(prefix='bench_e2e_')
+    env = dict(os.environ, BOT_TOKEN='0:bench', TELEGRAM_API_URL=api_url, PORT=str(flask_port),
+               PYTHONUNBUFFERED='1', WORKERS=str(args.workers))
+
+    health_latencies, health_failures = [], []
+    stop_probe = threading.Event()
+    with open(os.path.join(workdir, 'bot.log'), 'w', encoding='utf-8') as log:
+        process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, 'main.py')],
+                                   cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        probe = threading.Thread(target=_probe_health, daemon=True, args=(
+            f"http://127.0.0.1:{flask_port}/health", stop_probe, health_latencies, health_failures))
+        probe.start()
+
+        completed = api.done.wait(args.timeout)
+
+        stop_probe.set()
+        # SIGINT -> KeyboardInterrupt в polling -> штатное сохранение данных
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    server.shutdown()
+
+    summary = api.summary()
+    result = {
+        'benchmark': 'e2e',
+        'commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'params': {
+            'users': args.users, 'rounds': args.rounds, 'seed': args.seed, 'latency_ms': args.latency_ms,
+            'error_429': args.error_429, 'retry_after': args.retry_after, 'settle_ms': args.settle_ms,
+            'workers': args.workers,
+        },
+        'completed': completed,
+        'updates': summary['updates'],
+        'elapsed_sec': summary['elapsed_sec'],
+        'updates_per_sec': summary['updates_per_sec'],
+        'latency_ms': _latency_summary(summary['latencies_ms']),
+        'latency_ms_by_flow': {flow: dict(_latency_summary(values), updates=len(values))
+                               for flow, values in sorted(summary['latencies_ms_by_flow'].items())},
+        'no_reply': summary['no_reply'],
+        'api_calls': summary['api_calls'],
+        'api_calls_per_update': round(sum(summary['api_calls'].values()) / summary['updates'], 3)
+        if summary['updates'] else 0.0,
+        'errors_429': summary['errors_429'],
+        'inbound_bytes': summary['inbound_bytes'],
+        'health_ms': dict(_latency_summary(health_latencies), failures=len(health_failures)),
+        'bot_exit_code': process.returncode,
+    }
+
+    if args.keep:
+        result['workdir'] = workdir
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
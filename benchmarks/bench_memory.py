@@ -0,0 +1,104 @@
+"""
+Бенчмарк памяти моделей: байт на запись до (__dict__, datetime/date, строки
+без интернирования) и после (__slots__, компактные даты, sys.intern).
+
+Строки для каждой записи создаются заново - так же, как их создает json.load
+при загрузке файла пользователя.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_memory [--attendance 1000000] [--expenses 500000]
+"""
+import argparse
+import gc
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from bot.models.timesheet import AttendanceRecord
+from bot.models.user_data import Expense
+
+EMPLOYEE_IDS = [str(1763078698.698767 + i) for i in range(40)]
+CATEGORIES = ['Питание', 'Проезд', 'Образование', 'Расходники', 'Оборудование', 'Связь', 'Другое']
+TYPES = ['personal', 'work']
+
+
+class LegacyAttendanceRecord:
+    """Запись посещаемости в прежнем виде"""
+
+    def __init__(self, employee_id: str, work_date: date, is_present: bool = False):
+        self.employee_id = employee_id
+        self.work_date = work_date
+        self.is_present = is_present
+        self.is_locked = False
+
+
+class LegacyExpense:
+    """Расход в прежнем виде"""
+
+    def __init__(self, category, amount, description, expense_type, date=None):
+        self.category = category
+        self.amount = amount
+        self.description = description
+        self.type = expense_type
+        self.date = date or datetime.now()
+
+
+def _fresh(text: str) -> str:
+    # Новый объект строки с тем же содержимым, как после json.load
+    return (text + ".")[:-1]
+
+
+def _legacy_attendance_args(count):
+    start = date(2020, 1, 1)
+    for i in range(count):
+        yield _fresh(EMPLOYEE_IDS[i % len(EMPLOYEE_IDS)]), start + timedelta(days=i // len(EMPLOYEE_IDS)), i % 3 != 0
+
+
+def _attendance_args(count):
+    # Сейчас id сотрудников - маленькие int из IdSequence пользователя
+    start = date(2020, 1, 1)
+    for i in range(count):
+        yield i % len(EMPLOYEE_IDS) + 1, start + timedelta(days=i // len(EMPLOYEE_IDS)), i % 3 != 0
+
+
+def _expense_args(count):
+    start = datetime(2020, 1, 1, 9, 30)
+    for i in range(count):
+        yield (_fresh(CATEGORIES[i % len(CATEGORIES)]), float(100 + i % 5000), f"покупка {i % 1000}",
+               _fresh(TYPES[i % 2]), start + timedelta(minutes=17 * i))
+
+
+def _measure(factory, args_iter, count):
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    records = [factory(*args) for args in args_iter(count)]
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    # Сам список хранит по указателю на запись - это не часть записи
+    used -= len(records) * 8
+    del records
+    gc.collect()
+    return used / count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--attendance', type=int, default=1_000_000)
+    parser.add_argument('--expenses', type=int, default=500_000)
+    args = parser.parse_args()
+
+    rows = [
+        ('AttendanceRecord', args.attendance, LegacyAttendanceRecord, _legacy_attendance_args,
+         AttendanceRecord, _attendance_args),
+        ('Expense', args.expenses, LegacyExpense, _expense_args, Expense, _expense_args),
+    ]
+
+    print(f"{'модель':<18} {'записей':>10} {'до, Б/зап':>11} {'после, Б/зап':>13} {'экономия':>9}")
+    for name, count, legacy, legacy_args, current, current_args in rows:
+        before = _measure(legacy, legacy_args, count)
+        after = _measure(current, current_args, count)
+        print(f"{name:<18} {count:>10} {before:>11.1f} {after:>13.1f} {1 - after / before:>8.0%}")
+
+
+if __name__ == '__main__':
+    main()
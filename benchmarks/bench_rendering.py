@@ -0,0 +1,62 @@
+"""
+Микробенчмарк рендеринга: конкатенация `response += ...` против MessageBuilder.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_rendering
+"""
+import timeit
+
+from bot.services.message_renderer import MessageBuilder, split_message
+
+LINE_COUNTS = [1_000, 5_000, 10_000, 50_000]
+REPEATS = 5
+# Квадратичный вариант дальше этого размера считается минутами
+SHARED_LIMIT = 10_000
+
+
+def _lines(count):
+    return [f"{i}. Задача номер {i}: проверить узел крепления" for i in range(1, count + 1)]
+
+
+def render_concat(lines):
+    # Так собирались ответы в обработчиках до появления MessageBuilder
+    response = "📋 АКТИВНЫЕ ЗАДАЧИ\n\n"
+    for line in lines:
+        response += f"{line}\n"
+    return split_message(response)
+
+
+def render_concat_shared(lines):
+    # Вариант, когда на строку есть вторая ссылка: оптимизация CPython для += не срабатывает
+    response = "📋 АКТИВНЫЕ ЗАДАЧИ\n\n"
+    alias = response
+    for line in lines:
+        response += f"{line}\n"
+        alias = response
+    return split_message(alias)
+
+
+def render_builder(lines):
+    response = MessageBuilder("📋 АКТИВНЫЕ ЗАДАЧИ")
+    for line in lines:
+        response.line(line)
+    return response.chunks()
+
+
+def main():
+    print(f"{'строк':>8} {'+= (мс)':>10} {'+= alias (мс)':>14} {'builder (мс)':>13} {'сообщений':>10}")
+    for count in LINE_COUNTS:
+        lines = _lines(count)
+        concat = min(timeit.repeat(lambda: render_concat(lines), number=1, repeat=REPEATS))
+        if count <= SHARED_LIMIT:
+            shared = min(timeit.repeat(lambda: render_concat_shared(lines), number=1, repeat=REPEATS))
+            shared_text = f"{shared * 1000:>14.2f}"
+        else:
+            shared_text = f"{'—':>14}"
+        builder = min(timeit.repeat(lambda: render_builder(lines), number=1, repeat=REPEATS))
+        chunks = len(render_builder(lines))
+        print(f"{count:>8} {concat * 1000:>10.2f} {shared_text} {builder * 1000:>13.2f} {chunks:>10}")
+
+
+if __name__ == '__main__':
+    main()
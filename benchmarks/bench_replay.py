@@ -0,0 +1,281 @@
+"""
+Бенчмарк обработки апдейтов: FinanceBot с записывающей заглушкой вместо TeleBot.
+
+Синтетические пользователи (benchmarks/workload.py) проходят сценарии меню:
+расходы, отметка посещаемости и сохранение, расчет зарплаты, стройобъекты,
+Running List. Апдейты подаются напрямую в _handle_text_message / _handle_callback,
+сеть не используется. Хранилище пишет во временную папку. Часы планировщика - время
+пользователей: между апдейтами проходит THINK_SECONDS, таймеры (окна нажатий,
+табель, сроки задач) срабатывают в цикле замера, а не в своем потоке.
+
+Результат - JSON (пропускная способность, перцентили задержки обработчиков,
+вызовы API и байты записи на апдейт) для сравнения между коммитами.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_replay [--users 50] [--rounds 20] [--seed 1] [--output results.json]
+"""
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+from typing import Dict, List
+
+from telebot import types
+
+from bot.bot import FinanceBot
+from bot.services.scheduler_service import Scheduler
+from bot.services.storage_service import JSONStorageService
+from bot.services.tracing_service import TRACER
+from .workload import Workload
+
+# Пауза пользователя между действиями (сек): дольше окна склейки нажатий (callback_service.DEBOUNCE_SECONDS)
+THINK_SECONDS = 1.0
+
+
+class RecordingBot:
+    """Заглушка TeleBot: запоминает исходящие вызовы API вместо отправки в Telegram"""
+
+    def __init__(self):
+        self.calls: List[Dict] = []
+        self._message_id = 10 ** 6
+
+    # Регистрация обработчиков FinanceBot: декораторы возвращают функцию без изменений
+    def message_handler(self, *args, **kwargs):
+        return lambda handler: handler
+
+    def callback_query_handler(self, *args, **kwargs):
+        return lambda handler: handler
+
+    def inline_handler(self, *args, **kwargs):
+        return lambda handler: handler
+
+    def _record(self, method: str, chat_id, message_id=None, **payload) -> SimpleNamespace:
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        payload.update(method=method, chat_id=chat_id, message_id=message_id)
+        self.calls.append(payload)
+        return SimpleNamespace(message_id=message_id, chat=SimpleNamespace(id=chat_id))
+
+    def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        return self._record('sendMessage', chat_id, text=text, reply_markup=reply_markup)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, reply_markup=None, **kwargs):
+        return self._record('editMessageText', chat_id, message_id, text=text, reply_markup=reply_markup)
+
+    def edit_message_reply_markup(self, chat_id=None, message_id=None, reply_markup=None, **kwargs):
+        return self._record('editMessageReplyMarkup', chat_id, message_id, reply_markup=reply_markup)
+
+    def delete_message(self, chat_id, message_id, **kwargs):
+        return self._record('deleteMessage', chat_id, message_id)
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        return self._record('answerCallbackQuery', None, 0, text=text)
+
+    def answer_inline_query(self, inline_query_id, results, **kwargs):
+        return self._record('answerInlineQuery', None, 0, results=len(results))
+
+    def send_document(self, chat_id, document, caption=None, **kwargs):
+        return self._record('sendDocument', chat_id, caption=caption, document_size=len(document.read()))
+
+
+class CountingStorageService(JSONStorageService):
+    """Хранилище, которое считает сохранения и записанные байты"""
+
+    def __init__(self, storage_dir: str):
+        super().__init__(storage_dir)
+        self.saves = 0
+        self.bytes_written = 0
+
+    def save_user_data(self, user_data):
+        super().save_user_data(user_data)
+        self.saves += 1
+
+    def _write_file(self, path: str, payload: bytes) -> int:
+        # Заголовок и измененные разделы
+        written = super()._write_file(path, payload)
+        self.bytes_written += written
+        return written
+
+    def _save_comment_log(self, chat_id: int, obj):
+        path = self._comment_log_path(chat_id, obj.id)
+        before = os.path.getsize(path) if os.path.exists(path) else 0
+        rewrite = obj.comment_log.needs_rewrite
+        super()._save_comment_log(chat_id, obj)
+        after = os.path.getsize(path) if os.path.exists(path) else 0
+        self.bytes_written += after if rewrite else after - before
+
+
+def _markup_dict(markup) -> Dict:
+    # У ReplyKeyboardMarkup в pyTelegramBotAPI есть только to_json
+    return json.loads(markup.to_json())
+
+
+def _payload_size(call: Dict) -> int:
+    """Примерный размер запроса к Bot API в байтах (JSON-тело)"""
+    body = {key: value for key, value in call.items() if key not in ('method', 'document_size')}
+    if body.get('reply_markup') is not None:
+        body['reply_markup'] = _markup_dict(body['reply_markup'])
+    return len(json.dumps(body, ensure_ascii=False).encode('utf-8')) + call.get('document_size', 0)
+
+
+def _observed(call: Dict) -> Dict:
+    markup = call.get('reply_markup')
+    if markup is None:
+        return call
+    return dict(call, reply_markup=_markup_dict(markup))
+
+
+def dispatch(finance_bot: FinanceBot, update: Dict):
+    """Маршрутизация апдейта так же, как это делают обработчики, зарегистрированные в TeleBot"""
+    with finance_bot.outbox.collect():
+        _route(finance_bot, update)
+
+
+def _route(finance_bot: FinanceBot, update: Dict):
+    if 'callback_query' in update:
+        finance_bot._handle_callback(types.CallbackQuery.de_json(update['callback_query']))
+        return
+
+    message = types.Message.de_json(update['message'])
+    command = message.text.split(' ', 1)[0] if message.text.startswith('/') else None
+    if command == '/start':
+        finance_bot._handle_start(message)
+    elif command == '/help':
+        finance_bot._handle_help(message)
+    elif command == '/cancel':
+        finance_bot._handle_cancel(message)
+    else:
+        finance_bot._handle_text_message(message)
+
+
+def _percentile(sorted_values: List[float], percent: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(percent / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _latency_summary(latencies: List[float]) -> Dict:
+    values = sorted(latencies)
+    return {
+        'p50': round(_percentile(values, 50), 4),
+        'p95': round(_percentile(values, 95), 4),
+        'p99': round(_percentile(values, 99), 4),
+        'max': round(values[-1], 4) if values else 0.0,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run(users: int, rounds: int, seed: int, trace_sample: float = 0.0) -> Dict:
+    workdir = tempfile.mkdtemp(prefix='bench_replay_')
+    previous_cwd = os.getcwd()
+    # Отчеты по расходам создаются в текущей папке, как при run()
+    os.chdir(workdir)
+    TRACER.configure(sample_rate=trace_sample, directory=os.path.join(workdir, 'traces'))
+
+    recorder = RecordingBot()
+    storage = CountingStorageService(os.path.join(workdir, 'data'))
+    workload = Workload(users, seed)
+
+    latencies: List[float] = []
+    by_flow: Dict[str, List[float]] = defaultdict(list)
+    methods: Counter = Counter()
+    outbound_bytes = 0
+
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            clock = [time.time()]
+            scheduler = Scheduler(clock=lambda: clock[0])
+            finance_bot = FinanceBot("0:bench", bot=recorder, storage_service=storage, scheduler=scheduler)
+            # Итоговое сохранение при выходе не относится к замеру и писало бы в удаленную папку
+            atexit.unregister(finance_bot._save_all_data)
+            # Поток планировщика не нужен: срабатывания вызываются ниже, после каждого апдейта
+            scheduler.stop()
+
+            started = time.perf_counter()
+            handler_time = 0.0
+            for flow, user, updates in workload.sessions(rounds):
+                for update in updates:
+                    first_call = len(recorder.calls)
+                    begin = time.perf_counter()
+                    dispatch(finance_bot, update)
+                    elapsed = time.perf_counter() - begin
+                    # Фоновые задачи (отчеты, зарплата) в задержку апдейта не входят, но их сообщения - его ответ
+                    finance_bot.jobs.join()
+                    # Следующее действие пользователя - через THINK_SECONDS: окно нажатий закрывается
+                    clock[0] += THINK_SECONDS
+                    scheduler.run_pending()
+
+                    handler_time += elapsed
+                    latencies.append(elapsed * 1000)
+                    by_flow[flow].append(elapsed * 1000)
+
+                    for call in recorder.calls[first_call:]:
+                        methods[call['method']] += 1
+                        outbound_bytes += _payload_size(call)
+                        if call['chat_id'] == user.chat_id:
+                            user.observe(_observed(call))
+                    del recorder.calls[:]
+            wall_time = time.perf_counter() - started
+    finally:
+        os.chdir(previous_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    count = len(latencies)
+    return {
+        'benchmark': 'replay',
+        'commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'params': {'users': users, 'rounds': rounds, 'seed': seed, 'trace_sample': trace_sample},
+        'updates': count,
+        'updates_per_sec': round(count / handler_time, 1) if handler_time else 0.0,
+        'wall_time_sec': round(wall_time, 3),
+        'latency_ms': _latency_summary(latencies),
+        'latency_ms_by_flow': {flow: dict(_latency_summary(values), updates=len(values))
+                               for flow, values in sorted(by_flow.items())},
+        'api_calls_per_update': round(sum(methods.values()) / count, 3) if count else 0.0,
+        'api_calls': dict(sorted(methods.items())),
+        'outbound_bytes_per_update': round(outbound_bytes / count, 1) if count else 0.0,
+        'storage': {
+            'saves': storage.saves,
+            'bytes_written': storage.bytes_written,
+            'bytes_per_update': round(storage.bytes_written / count, 1) if count else 0.0,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--trace-sample', type=float, default=0.0, help="Доля апдейтов с записью спанов")
+    parser.add_argument('--output', help="Файл для JSON-результата (по умолчанию - stdout)")
+    args = parser.parse_args()
+
+    result = run(args.users, args.rounds, args.seed, args.trace_sample)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Бенчмарк планировщика (bot/services/scheduler_service.py): таймеры табеля у десятков тысяч
+пользователей - по два таймера на пользователя, как у TimesheetTimers.
+
+Замеряются постановка всех таймеров (как restore при запуске), перенос каждого таймера
+(как после срабатывания) и срабатывание всех с подмененными часами, без потока планировщика.
+Затем - напоминания о сроках задач (TaskReminders): учет срока каждой задачи и срабатывания
+до последнего срока, каждое перебирает задачи одного пользователя.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_scheduler [--users 50000] [--tasks 200000]
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+
+from bot.models.running_list import TaskPriority
+from bot.models.user_data import UserData
+from bot.services.scheduler_service import Scheduler
+from bot.services.task_reminders import TaskReminders
+
+DAY = 86400.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50_000)
+    parser.add_argument('--tasks', type=int, default=200_000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    now = [0.0]
+    scheduler = Scheduler(clock=lambda: now[0])
+    fired = []
+
+    def callback(key, when):
+        fired.append(key)
+
+    deadlines = [rng.uniform(0, DAY) for _ in range(args.users)]
+    start = time.perf_counter()
+    for chat_id, when in enumerate(deadlines):
+        scheduler.schedule(('lock_attendance', chat_id), when, callback)
+        scheduler.schedule(('close_period', chat_id), when + 15 * DAY, callback)
+    schedule_s = time.perf_counter() - start
+    timers = len(scheduler)
+
+    start = time.perf_counter()
+    for chat_id, when in enumerate(deadlines):
+        scheduler.schedule(('lock_attendance', chat_id), when + DAY, callback)
+    reschedule_s = time.perf_counter() - start
+
+    now[0] = 20 * DAY
+    start = time.perf_counter()
+    scheduler.run_pending()
+    fire_s = time.perf_counter() - start
+    assert len(fired) == timers, (len(fired), timers)
+
+    print(f"таймеров: {timers}")
+    print(f"{'операция':<12} {'всего, мс':>10} {'на таймер, мкс':>16}")
+    for name, seconds, count in (('постановка', schedule_s, timers), ('перенос', reschedule_s, args.users),
+                                 ('срабатывание', fire_s, timers)):
+        print(f"{name:<12} {seconds * 1000:>10.0f} {seconds / count * 1e6:>16.2f}")
+
+    bench_task_reminders(args.users, args.tasks, rng)
+
+
+class _NoStorage:
+    def save_user_data(self, user_data):
+        pass
+
+
+def bench_task_reminders(users: int, tasks: int, rng: random.Random):
+    now = [0.0]
+    scheduler = Scheduler(clock=lambda: now[0])
+    users_data = {chat_id: UserData(chat_id) for chat_id in range(users)}
+    reminded = []
+    reminders = TaskReminders(scheduler, users_data, _NoStorage(), lambda chat_id, due: reminded.extend(due))
+
+    # Сроки - в ближайшие 30 дней; часть задач выполняется до срока
+    added = []
+    for _ in range(tasks):
+        user_data = users_data[rng.randrange(users)]
+        task = user_data.running_list.add_task("задача", TaskPriority.MEDIUM,
+                                               datetime.fromtimestamp(rng.uniform(DAY, 31 * DAY)))
+        added.append((user_data, task))
+    completed = 0
+    start = time.perf_counter()
+    for user_data, task in added:
+        reminders.add(user_data, task)
+    add_s = time.perf_counter() - start
+    for user_data, task in added:
+        if rng.random() < 0.2:
+            user_data.running_list.complete_task(task)
+            completed += 1
+
+    now[0] = 40 * DAY
+    start = time.perf_counter()
+    fired = scheduler.run_pending()
+    fire_s = time.perf_counter() - start
+    assert len(reminded) == tasks - completed, (len(reminded), tasks - completed)
+
+    print(f"\nзадач со сроком: {tasks}, пользователей: {users}, таймеров в куче: до {users}")
+    print(f"{'операция':<12} {'всего, мс':>10} {'на единицу, мкс':>16}")
+    print(f"{'учет срока':<12} {add_s * 1000:>10.0f} {add_s / tasks * 1e6:>16.2f}")
+    print(f"{'срабатывание':<12} {fire_s * 1000:>10.0f} {fire_s / fired * 1e6:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
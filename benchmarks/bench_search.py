@@ -0,0 +1,113 @@
+"""
+Бенчмарк поиска: пользователь со 100k проиндексированных записей
+(задачи, расходы, объекты с контактами и комментариями).
+
+Сравнивается инвертированный индекс SearchService и прямой перебор
+всех записей с поиском подстроки. Цель - запросы в единицах миллисекунд.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_search [--items 100000] [--queries 200]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from bot.models.construction import ConstructionStage, ResponsiblePerson
+from bot.models.running_list import TaskPriority
+from bot.models.user_data import Expense, UserData
+from bot.services.search_service import SearchService, normalize_text
+
+WORDS = [
+    'цемент', 'арматура', 'бетон', 'кирпич', 'плитка', 'штукатурка', 'фундамент', 'кровля', 'окна', 'двери',
+    'монтаж', 'демонтаж', 'доставка', 'оплата', 'замер', 'трещина', 'протечка', 'утепление', 'лестница',
+    'электрика', 'сантехника', 'вентиляция', 'подъезд', 'мусоропровод', 'лифт', 'фасад', 'подвал', 'чердак',
+]
+STREETS = ['Садовая', 'Лесная', 'Ёлочная', 'Центральная', 'Заречная', 'Победы', 'Мира', 'Школьная']
+NAMES = ['Петров', 'Иванов', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев']
+QUERIES = ['цемент', 'трещины фундамент', 'доставку', 'елочная', 'петров', '7902', 'монтаж окон', 'лестниц',
+           'цем', 'цемент фундамент']
+
+
+def _phrase(rng, words=5):
+    return " ".join(rng.choice(WORDS) + rng.choice(['', 'а', 'у', 'ы', 'ой']) for _ in range(words))
+
+
+def build_user(items: int, seed: int = 1) -> UserData:
+    rng = random.Random(seed)
+    user = UserData(1)
+    share = items // 3
+
+    for _ in range(share):
+        user.running_list.add_task(_phrase(rng), rng.choice(list(TaskPriority)))
+    for i in range(share):
+        user.add_expense(Expense('Расходники', float(i % 5000), _phrase(rng, 4), 'work'))
+
+    # Объекты по 48 комментариев и 2 контакта: всего около share записей
+    stages = list(ConstructionStage)
+    objects = share // 51
+    for i in range(objects):
+        obj = user.construction_manager.add_object(f"ЖК {rng.choice(WORDS)} {i}",
+                                                   f"{rng.choice(STREETS)} {i % 200}")
+        for _ in range(2):
+            obj.add_responsible_person(ResponsiblePerson(
+                rng.choice(NAMES), 'прораб', f"+7 (9{rng.randint(10, 99)}) {rng.randint(100, 999)}-00-00"))
+        for _ in range(48):
+            obj.add_comment(rng.choice(stages), _phrase(rng, 8), 1)
+    return user
+
+
+def _scan(user: UserData, query: str) -> int:
+    """Прямой перебор: подстрока в нормализованном тексте каждой записи"""
+    needle = normalize_text(query)
+    found = 0
+    for task in user.running_list.tasks:
+        found += needle in normalize_text(task.description)
+    for expense in user.expenses:
+        found += needle in normalize_text(expense.description)
+    for obj in user.construction_manager.objects.values():
+        found += needle in normalize_text(f"{obj.name} {obj.address}")
+        for person in obj.responsible_persons:
+            found += needle in normalize_text(f"{person.name} {person.phone}")
+        for comment in obj.comment_log:
+            found += needle in normalize_text(comment.text)
+    return found
+
+
+def _timings(func, queries):
+    result = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        result.append((time.perf_counter() - start) * 1000)
+    result.sort()
+    return result
+
+
+def _row(name, timings):
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{name:<14} {statistics.median(timings):>10.2f} {p95:>10.2f} {timings[-1]:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=100_000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    user = build_user(args.items)
+    service = SearchService({1: user})
+
+    start = time.perf_counter()
+    index = service.get_index(1)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f"записей в индексе: {len(index)}, построение: {build_ms:.0f} мс")
+
+    queries = [QUERIES[i % len(QUERIES)] for i in range(args.queries)]
+    print(f"{'способ':<14} {'p50, мс':>10} {'p95, мс':>10} {'max, мс':>10}")
+    _row('индекс', _timings(lambda q: service.search(1, q), queries))
+    _row('перебор', _timings(lambda q: _scan(user, q), queries[:len(QUERIES)]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Бенчмарк форматов файла пользователя (bot/services/storage_codecs.py):
+время кодирования и декодирования и размер на диске.
+
+Данные - как у настоящих пользователей: задачи, расходы и объекты с контактами
+(как в bench_search) и отдельно пользователь с табелем на 100k отметок.
+Строка "json indent=2" - прежний формат, с ним сравниваются остальные.
+Разделы пользователя кодируются вместе, одним документом (на диске каждый - своим файлом).
+Последний профиль - тот же табель после переноса закрытых периодов в архив (bot/models/archive.py):
+столько пишется при сохранении, изменившем табель.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_storage [--attendance 100000] [--items 6000] [--repeat 5]
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import date
+
+from bot.models.timesheet import AttendanceRecord
+from bot.models.user_data import Expense, UserData
+from bot.services.storage_codecs import CODECS, decode
+from bot.services.storage_schema import encode_user
+
+from .bench_search import build_user
+
+CATEGORIES = ['Питание', 'Проезд', 'Расходники', 'Оборудование', 'Связь', 'Другое']
+NAMES = ['Петров', 'Иванов', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев']
+
+
+def build_timesheet_user(attendance: int, seed: int = 1) -> UserData:
+    """Бригада из 40 человек: отметки за attendance / 40 дней подряд и немного расходов"""
+    rng = random.Random(seed)
+    user = UserData(2)
+    timesheet = user.timesheet
+    employees = [timesheet.add_employee(f"{rng.choice(NAMES)} {i}", float(rng.randint(20, 60) * 100))
+                 for i in range(40)]
+    start = date(2020, 1, 1).toordinal()
+    for i in range(attendance):
+        record = AttendanceRecord(employees[i % 40].id, date.fromordinal(start + i // 40), rng.random() < 0.8)
+        record.is_locked = True
+        timesheet.attendance_records.append(record)
+    for i in range(500):
+        user.add_expense(Expense(rng.choice(CATEGORIES), float(rng.randint(1, 500) * 10), f"чек {i}", 'work'))
+    return user
+
+
+def _median_ms(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def run_profile(title: str, data: dict, repeat: int):
+    print(f"\n{title}")
+    print(f"{'формат':<16} {'кодирование, мс':>16} {'чтение, мс':>12} {'размер, КБ':>12} {'от прежнего':>12}")
+
+    legacy = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    rows = [('json indent=2', lambda: json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'), legacy)]
+    for codec in CODECS.values():
+        raw = codec.encode(data)
+        assert decode(raw) == data, f"{codec.name}: данные после чтения отличаются"
+        rows.append((codec.name, lambda codec=codec: codec.encode(data), raw))
+
+    for name, encode, raw in rows:
+        encode_ms = _median_ms(encode, repeat)
+        decode_ms = _median_ms(lambda: decode(raw), repeat)
+        print(f"{name:<16} {encode_ms:>16.1f} {decode_ms:>12.1f} {len(raw) / 1024:>12.1f} "
+              f"{len(raw) / len(legacy):>11.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--attendance', type=int, default=100_000)
+    parser.add_argument('--items', type=int, default=6000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    run_profile(f"задачи, расходы, объекты: {args.items} записей", encode_user(build_user(args.items), inline=True), args.repeat)
+    run_profile(f"табель: {args.attendance} отметок", encode_user(build_timesheet_user(args.attendance), inline=True), args.repeat)
+
+    user = build_timesheet_user(args.attendance)
+    archived = user.archive_cold()
+    run_profile(f"табель после переноса в архив: {archived} записей в архиве", encode_user(user, inline=True), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""
+Локальная замена Telegram Bot API для нагрузочных прогонов.
+
+Эмулирует методы, которые использует бот: getUpdates (long polling), sendMessage,
+sendDocument, deleteMessage, editMessageText, editMessageReplyMarkup,
+answerCallbackQuery, answerInlineQuery и getMe.
+
+Апдейты берутся из benchmarks/workload.py. Каждый пользователь действует по
+замкнутому циклу: следующий апдейт появляется в getUpdates только после того,
+как бот ответил на предыдущий и ответы затихли на settle_ms (или прошел reply_timeout).
+Время от выдачи апдейта до последнего ответа бота - сквозная задержка.
+
+Поддерживаются задержка ответа каждого метода и случайные ответы 429.
+
+Самостоятельный запуск (бот подключается через TELEGRAM_API_URL):
+    python -m benchmarks.fake_bot_api [--port 8081] [--users 50] [--rounds 20] [--latency-ms 0] [--error-429 0.0]
+    TELEGRAM_API_URL="http://127.0.0.1:8081/bot{0}/{1}" BOT_TOKEN=0:bench python main.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from .workload import SimulatedUser, Workload
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'BenchBot', 'username': 'bench_bot'}
+
+
+class _UserLoop:
+    """Состояние замкнутого цикла одного пользователя"""
+
+    def __init__(self, user: SimulatedUser, sessions):
+        self.user = user
+        self.sessions = sessions
+        self.flow = None
+        self.flow_name: Optional[str] = None
+        self.outstanding = False
+        self.delivered_at: Optional[float] = None
+        self.last_reply_at: Optional[float] = None
+        self.replies = 0
+        self.finished = False
+
+
+class FakeBotApi:
+    def __init__(self, users: int = 50, rounds: int = 20, seed: int = 1, latency_ms: float = 0.0,
+                 error_429_rate: float = 0.0, retry_after: int = 1, settle_ms: float = 30.0,
+                 reply_timeout: float = 2.0):
+        self.workload = Workload(users, seed)
+        self.latency = latency_ms / 1000
+        self.error_429_rate = error_429_rate
+        self.retry_after = retry_after
+        self.settle = settle_ms / 1000
+        self.reply_timeout = reply_timeout
+        self._rng = random.Random(seed)
+
+        self._cond = threading.Condition()
+        self._loops = {user.chat_id: _UserLoop(user, self.workload.user_sessions(user, rounds))
+                       for user in self.workload.users}
+        self._queue: List[Dict] = []
+        self._update_chat: Dict[int, int] = {}
+        self._message_id = 0
+
+        self.done = threading.Event()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.latencies: List[float] = []
+        self.latencies_by_flow: Dict[str, List[float]] = {}
+        self.no_reply = 0
+        self.calls: Dict[str, int] = {}
+        self.errors_429 = 0
+        self.inbound_bytes = 0
+
+    # Замкнутый цикл пользователей (вызывается под self._cond)
+
+    def _complete(self, loop: _UserLoop, now: float):
+        if loop.replies:
+            latency = (loop.last_reply_at - loop.delivered_at) * 1000
+            self.latencies.append(latency)
+            self.latencies_by_flow.setdefault(loop.flow_name, []).append(latency)
+        else:
+            self.no_reply += 1
+        loop.outstanding = False
+
+    def _next_update(self, loop: _UserLoop) -> Optional[Dict]:
+        while True:
+            if loop.flow is None:
+                session = next(loop.sessions, None)
+                if session is None:
+                    loop.finished = True
+                    return None
+                loop.flow_name, loop.flow = session
+            update = next(loop.flow, None)
+            if update is not None:
+                return update
+            loop.flow = None
+
+    def _refill(self, now: float):
+        for loop in self._loops.values():
+            if loop.finished:
+                continue
+            if loop.outstanding:
+                if loop.delivered_at is None:
+                    continue
+                settled = loop.replies and now - loop.last_reply_at >= self.settle
+                if not settled and now - loop.delivered_at < self.reply_timeout:
+                    continue
+                self._complete(loop, now)
+
+            update = self._next_update(loop)
+            if update is None:
+                continue
+            loop.outstanding = True
+            loop.delivered_at = None
+            loop.last_reply_at = None
+            loop.replies = 0
+            self._update_chat[update['update_id']] = loop.user.chat_id
+            self._queue.append(update)
+
+        if not self._queue and all(loop.finished for loop in self._loops.values()):
+            if not self.done.is_set():
+                self.finished_at = now
+                self.done.set()
+
+    def _reply(self, chat_id: Optional[int], payload: Optional[Dict] = None):
+        loop = self._loops.get(chat_id)
+        if loop is None or not loop.outstanding:
+            return
+        loop.replies += 1
+        loop.last_reply_at = time.perf_counter()
+        if payload is not None:
+            loop.user.observe(payload)
+        self._cond.notify_all()
+
+    # Методы Bot API
+
+    def get_updates(self, params: Dict) -> List[Dict]:
+        offset = int(params.get('offset', 0) or 0)
+        limit = int(params.get('limit', 100) or 100)
+        deadline = time.perf_counter() + float(params.get('timeout', 0) or 0)
+
+        with self._cond:
+            if self.started_at is None:
+                self.started_at = time.perf_counter()
+            while True:
+                now = time.perf_counter()
+                self._queue = [update for update in self._queue if update['update_id'] >= offset]
+                self._refill(now)
+                if self._queue or now >= deadline or self.done.is_set():
+                    break
+                self._cond.wait(min(deadline - now, max(self.settle / 2, 0.005)))
+
+            updates = self._queue[:limit]
+            for update in updates:
+                loop = self._loops[self._update_chat[update['update_id']]]
+                if loop.delivered_at is None:
+                    loop.delivered_at = now
+            return updates
+
+    def _message(self, chat_id: int, message_id: Optional[int] = None, **fields) -> Dict:
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        message = {'message_id': message_id, 'date': int(time.time()), 'from': BOT_USER,
+                   'chat': {'id': chat_id, 'type': 'private'}}
+        message.update(fields)
+        return message
+
+    def call(self, method: str, params: Dict):
+        """Обрабатывает вызов метода; возвращает (ok, result или описание ошибки, retry_after)"""
+        if method == 'getUpdates':
+            return True, self.get_updates(params), None
+        if method == 'getMe':
+            return True, BOT_USER, None
+
+        with self._cond:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if self.error_429_rate and self._rng.random() < self.error_429_rate:
+                self.errors_429 += 1
+                return False, f"Too Many Requests: retry after {self.retry_after}", self.retry_after
+
+            chat_id = int(params['chat_id']) if params.get('chat_id') else None
+            markup = json.loads(params['reply_markup']) if params.get('reply_markup') else None
+
+            if method == 'sendMessage':
+                message = self._message(chat_id, text=params.get('text', ''))
+                self._reply(chat_id, {'message_id': message['message_id'], 'reply_markup': markup})
+                return True, message, None
+            if method == 'sendDocument':
+                message = self._message(chat_id, caption=params.get('caption', ''),
+                                        document={'file_id': 'bench', 'file_unique_id': 'bench'})
+                self._reply(chat_id)
+                return True, message, None
+            if method in ('editMessageText', 'editMessageReplyMarkup'):
+                message_id = int(params.get('message_id', 0))
+                message = self._message(chat_id, message_id, text=params.get('text', ''))
+                self._reply(chat_id, {'message_id': message_id, 'reply_markup': markup})
+                return True, message, None
+            if method == 'deleteMessage':
+                self._reply(chat_id)
+                return True, True, None
+            if method == 'answerCallbackQuery':
+                self._reply(self._update_chat.get(int(params.get('callback_query_id', 0))))
+                return True, True, None
+            if method == 'answerInlineQuery':
+                return True, True, None
+
+        return False, f"Not Found: method {method} not found", None
+
+    def summary(self) -> Dict:
+        with self._cond:
+            finished = self.finished_at or time.perf_counter()
+            elapsed = finished - self.started_at if self.started_at else 0.0
+            completed = len(self.latencies) + self.no_reply
+            return {
+                'updates': completed,
+                'elapsed_sec': round(elapsed, 3),
+                'updates_per_sec': round(completed / elapsed, 1) if elapsed else 0.0,
+                'latencies_ms': list(self.latencies),
+                'latencies_ms_by_flow': {flow: list(values) for flow, values in self.latencies_by_flow.items()},
+                'no_reply': self.no_reply,
+                'api_calls': dict(sorted(self.calls.items())),
+                'errors_429': self.errors_429,
+                'inbound_bytes': self.inbound_bytes,
+            }
+
+    # HTTP
+
+    def make_server(self, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Заголовки и тело уходят отдельными write - без этого Nagle добавляет ~40 мс на вызов
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _handle(self):
+                parts = urlsplit(self.path)
+                segments = parts.path.strip('/').split('/')
+                params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b""
+                if body and self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                    params.update({key: values[-1] for key, values in parse_qs(body.decode('utf-8')).items()})
+
+                with api._cond:
+                    api.inbound_bytes += len(parts.query) + len(body)
+
+                if len(segments) != 2 or not segments[0].startswith('bot'):
+                    self._send(404, {'ok': False, 'error_code': 404, 'description': "Not Found"})
+                    return
+
+                if api.latency and segments[1] != 'getUpdates':
+                    time.sleep(api.latency)
+
+                ok, result, retry_after = api.call(segments[1], params)
+                if ok:
+                    self._send(200, {'ok': True, 'result': result})
+                elif retry_after is not None:
+                    self._send(429, {'ok': False, 'error_code': 429, 'description': result,
+                                     'parameters': {'retry_after': retry_after}})
+                else:
+                    self._send(404, {'ok': False, 'error_code': 404, 'description': result})
+
+            def _send(self, status: int, payload: Dict):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _handle
+            do_POST = _handle
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        return server
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Задержка ответа каждого метода API")
+    parser.add_argument('--error-429', type=float, default=0.0, help="Доля вызовов, получающих 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--settle-ms', type=float, default=30.0,
+                        help="Сколько ответы должны молчать, чтобы пользователь сделал следующий шаг")
+
+
+def from_arguments(args) -> FakeBotApi:
+    return FakeBotApi(args.users, args.rounds, args.seed, args.latency_ms, args.error_429,
+                      args.retry_after, args.settle_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8081)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    api = from_arguments(args)
+    server = api.make_server(port=args.port)
+    print(f"Bot API: http://127.0.0.1:{server.server_address[1]}/bot{{0}}/{{1}}")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        api.done.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+    summary = api.summary()
+    summary.pop('latencies_ms')
+    summary.pop('latencies_ms_by_flow')
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Синтетическая нагрузка: пользователи, которые проходят реальные сценарии меню бота.
+
+Апдейты генерируются в формате Bot API (словари как в ответе getUpdates).
+Пользователь "видит" ответы бота через observe() и нажимает кнопки из
+последней полученной клавиатуры - так же, как живой клиент, без доступа к данным бота.
+"""
+import random
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from bot.services.callback_codec import CallbackDecodeError, decode_callback
+
+# Сценарии и их относительная частота
+FLOW_WEIGHTS = {
+    'expense': 4,
+    'attendance': 2,
+    'payroll': 1,
+    'construction': 2,
+    'running_list': 3,
+}
+
+NAMES = ['Иванов Иван', 'Петров Петр', 'Сидоров Олег', 'Кузнецов Илья', 'Смирнов Антон', 'Попов Денис']
+WORDS = ['цемент', 'арматура', 'доставка', 'монтаж', 'замер', 'кровля', 'фасад', 'лестница', 'окна', 'подвал']
+STREETS = ['Садовая', 'Лесная', 'Центральная', 'Заречная', 'Мира']
+
+MAX_EMPLOYEES = 8
+MAX_OBJECTS = 6
+
+
+class SimulatedUser:
+    def __init__(self, chat_id: int, rng: random.Random):
+        self.chat_id = chat_id
+        self.rng = rng
+        self.reply_buttons: List[str] = []
+        # Последнее сообщение с inline-клавиатурой: message_id и кнопки (действие, аргументы, callback_data)
+        self.keyboard_message_id: Optional[int] = None
+        self.inline_buttons: List[Tuple[str, tuple, str]] = []
+        self.employees = 0
+        self.objects = 0
+
+    def observe(self, payload: Dict):
+        """Принимает исходящий вызов API (sendMessage, editMessageText, ...) в виде словаря"""
+        markup = payload.get('reply_markup')
+        if not markup:
+            return
+        if 'keyboard' in markup:
+            self.reply_buttons = [button['text'] for row in markup['keyboard'] for button in row]
+        elif 'inline_keyboard' in markup:
+            self.keyboard_message_id = payload.get('message_id')
+            self.inline_buttons = []
+            for row in markup['inline_keyboard']:
+                for button in row:
+                    data = button.get('callback_data')
+                    if not data:
+                        continue
+                    try:
+                        action, args = decode_callback(data)
+                    except CallbackDecodeError:
+                        continue
+                    self.inline_buttons.append((action, args, data))
+
+    def buttons(self, action: str) -> List[str]:
+        return [data for button_action, _, data in self.inline_buttons if button_action == action]
+
+    def pick(self, action: str) -> Optional[str]:
+        found = self.buttons(action)
+        return self.rng.choice(found) if found else None
+
+    def menu_choice(self, exclude=('назад',)) -> Optional[str]:
+        options = [text for text in self.reply_buttons if text not in exclude]
+        return self.rng.choice(options) if options else None
+
+
+class Workload:
+    """Генератор апдейтов для N пользователей"""
+
+    def __init__(self, users: int, seed: int = 1, first_chat_id: int = 100_000):
+        self.rng = random.Random(seed)
+        self.users = [SimulatedUser(first_chat_id + i, random.Random(seed * 7919 + i)) for i in range(users)]
+        self._update_id = 0
+        self._message_id = 0
+
+    # Апдейты в формате Bot API
+
+    def _from(self, user: SimulatedUser) -> Dict:
+        return {'id': user.chat_id, 'is_bot': False, 'first_name': f"User{user.chat_id}"}
+
+    def _chat(self, user: SimulatedUser) -> Dict:
+        return {'id': user.chat_id, 'type': 'private', 'first_name': f"User{user.chat_id}"}
+
+    def message(self, user: SimulatedUser, text: str) -> Dict:
+        self._update_id += 1
+        self._message_id += 1
+        message = {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': self._chat(user),
+            'from': self._from(user),
+            'text': text,
+        }
+        if text.startswith('/'):
+            command = text.split(' ', 1)[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return {'update_id': self._update_id, 'message': message}
+
+    def callback(self, user: SimulatedUser, data: str) -> Dict:
+        self._update_id += 1
+        return {
+            'update_id': self._update_id,
+            'callback_query': {
+                'id': str(self._update_id),
+                'from': self._from(user),
+                'chat_instance': str(user.chat_id),
+                'data': data,
+                'message': {
+                    'message_id': user.keyboard_message_id or 0,
+                    'date': int(time.time()),
+                    'chat': self._chat(user),
+                    'text': "",
+                },
+            },
+        }
+
+    # Сценарии. Генератор отдает апдейт, ждет его обработки и смотрит на ответ бота.
+
+    def sessions(self, rounds: int) -> Iterator[Tuple[str, SimulatedUser, Iterator[Dict]]]:
+        """Сценарии всех пользователей по кругу - для последовательного прогона"""
+        flows = list(FLOW_WEIGHTS)
+        weights = [FLOW_WEIGHTS[flow] for flow in flows]
+        for _ in range(rounds):
+            for user in self.users:
+                flow = self.rng.choices(flows, weights)[0]
+                yield flow, user, getattr(self, f"_flow_{flow}")(user)
+
+    def user_sessions(self, user: SimulatedUser, rounds: int) -> Iterator[Tuple[str, Iterator[Dict]]]:
+        """Сценарии одного пользователя - когда пользователи действуют независимо друг от друга"""
+        flows = list(FLOW_WEIGHTS)
+        weights = [FLOW_WEIGHTS[flow] for flow in flows]
+        for _ in range(rounds):
+            flow = user.rng.choices(flows, weights)[0]
+            yield flow, getattr(self, f"_flow_{flow}")(user)
+
+    def _flow_expense(self, user: SimulatedUser):
+        yield self.message(user, 'расходы')
+        yield self.message(user, user.rng.choice(['личные расходы', 'рабочие расходы']))
+        category = user.menu_choice()
+        if category is None:
+            return
+        yield self.message(user, category)
+        amount = user.rng.randint(100, 20000)
+        yield self.message(user, f"{amount} {user.rng.choice(WORDS)} {user.rng.choice(WORDS)}")
+        yield self.message(user, 'назад')
+        yield self.message(user, 'назад')
+
+    def _flow_attendance(self, user: SimulatedUser):
+        yield self.message(user, 'табель')
+        if user.employees == 0 or (user.employees < MAX_EMPLOYEES and user.rng.random() < 0.1):
+            yield self.message(user, '➕ Добавить работника')
+            yield self.message(user, user.rng.choice(NAMES))
+            yield self.message(user, str(user.rng.randint(15, 40) * 100))
+            user.employees += 1
+
+        yield self.message(user, '📝 Учет присутствия')
+        for _ in range(user.rng.randint(1, 4)):
+            data = user.pick('toggle_attendance')
+            if data is None:
+                return
+            yield self.callback(user, data)
+
+        if user.rng.random() < 0.3:
+            data = user.pick('save_attendance')
+            if data is not None:
+                yield self.callback(user, data)
+
+    def _flow_payroll(self, user: SimulatedUser):
+        yield self.message(user, 'табель')
+        yield self.message(user, '💰 Расчет зарплаты')
+        yield self.message(user, 'назад')
+
+    def _flow_construction(self, user: SimulatedUser):
+        yield self.message(user, '🏗 Стройобъекты')
+        if user.objects == 0 or (user.objects < MAX_OBJECTS and user.rng.random() < 0.15):
+            yield self.message(user, '🏗 Добавить объект')
+            yield self.message(user, f"ЖК {user.rng.choice(WORDS).capitalize()} {user.objects + 1}")
+            yield self.message(user, f"{user.rng.choice(STREETS)} {user.rng.randint(1, 120)}")
+            user.objects += 1
+
+        yield self.message(user, '⚙️ Управление объектом')
+        data = user.pick('select_object')
+        if data is None:
+            return
+        yield self.callback(user, data)
+
+        branch = user.rng.random()
+        if branch < 0.5:
+            data = user.pick('obj_comments')
+            if data is None:
+                return
+            yield self.callback(user, data)
+            data = user.pick('add_comment')
+            if data is None:
+                return
+            yield self.callback(user, data)
+            yield self.message(user, " ".join(user.rng.choice(WORDS) for _ in range(user.rng.randint(3, 12))))
+        elif branch < 0.7:
+            data = user.pick('obj_responsible')
+            if data is None:
+                return
+            yield self.callback(user, data)
+            data = user.pick('add_resp')
+            if data is None:
+                return
+            yield self.callback(user, data)
+            yield self.message(user, user.rng.choice(NAMES))
+            yield self.message(user, user.rng.choice(['прораб', 'мастер', 'инженер']))
+            yield self.message(user, f"+7 (9{user.rng.randint(10, 99)}) {user.rng.randint(100, 999)}-"
+                                     f"{user.rng.randint(10, 99)}-{user.rng.randint(10, 99)}")
+        else:
+            data = user.pick('obj_comments')
+            if data is None:
+                return
+            yield self.callback(user, data)
+            data = user.pick('view_comments')
+            if data is not None:
+                yield self.callback(user, data)
+
+        yield self.message(user, '📋 Список объектов')
+        yield self.message(user, 'назад')
+
+    def _flow_running_list(self, user: SimulatedUser):
+        yield self.message(user, '📋 Running List')
+        yield self.message(user, '➕ Добавить задачу')
+        yield self.message(user, " ".join(user.rng.choice(WORDS) for _ in range(user.rng.randint(2, 6))))
+        data = user.pick('priority')
+        if data is None:
+            return
+        yield self.callback(user, data)
+        # Срок: у половины задач - дата в ближайший год, в нагрузке ставятся таймеры напоминаний
+        if user.rng.random() < 0.5:
+            yield self.message(user, 'без срока')
+        else:
+            yield self.message(user, f"{user.rng.randint(1, 28):02d}.{user.rng.randint(1, 12):02d} 18:00")
+        yield self.message(user, '📋 Список задач')
+        if user.rng.random() < 0.3:
+            yield self.message(user, '/done 1')
+        yield self.message(user, 'назад')
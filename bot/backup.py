@@ -0,0 +1,62 @@
+"""
+Резервные копии папки данных из командной строки.
+
+    python -m bot.backup list [--backup-dir backups]
+    python -m bot.backup restore <id> [--to data] [--force]
+    python -m bot.backup create [--data-dir data]
+
+Работающий бот делает копии сам (BACKUP_INTERVAL в main.py): снимок согласован,
+потому что бот перехватывает запись файлов на время снимка. create отсюда - только
+для остановленного бота. restore разворачивает копию в папку данных и строит манифест заново.
+"""
+import argparse
+import os
+import sys
+
+from .services.backup_service import BackupService
+from .services.logging_service import setup_logging
+from .services.storage_service import JSONStorageService
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m bot.backup')
+    parser.add_argument('--backup-dir', default=os.getenv('BACKUP_DIR', 'backups'))
+    parser.add_argument('--data-dir', default=os.getenv('DATA_DIR', 'data'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list')
+    commands.add_parser('create')
+    restore = commands.add_parser('restore')
+    restore.add_argument('backup_id', nargs='?', help="по умолчанию - последняя копия")
+    restore.add_argument('--to', help="папка данных (по умолчанию --data-dir)")
+    restore.add_argument('--force', action='store_true', help="заменить существующие данные пользователей")
+    args = parser.parse_args(argv)
+    setup_logging(stream=sys.stderr)
+
+    if args.command == 'create':
+        backups = BackupService(JSONStorageService(args.data_dir), args.backup_dir)
+        print(backups.create())
+        return 0
+
+    backups = BackupService(None, args.backup_dir)
+    if args.command == 'list':
+        for backup_id in backups.list_backups():
+            index = backups.load_index(backup_id)
+            print(f"{backup_id}  пользователей: {len(index['users'])}  создана: {index['created']}")
+        return 0
+
+    available = backups.list_backups()
+    backup_id = args.backup_id or (available[-1] if available else None)
+    if backup_id not in available:
+        print(f"Копия {backup_id} не найдена в {args.backup_dir}", file=sys.stderr)
+        return 1
+    try:
+        users = backups.restore(backup_id, args.to or args.data_dir, force=args.force)
+    except FileExistsError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"Восстановлено пользователей: {users}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,66 +1,214 @@
-import os
 import atexit
-from telebot import TeleBot, types
-from typing import Dict
+from telebot import TeleBot, apihelper, types
+from typing import Callable, Dict, Optional
 
 from .models.user_data import UserData
+from .models.conversation import SelectedObject
 from .handlers.expenses_handler import ExpensesHandler
 from .handlers.report_handler import ReportHandler
 from .handlers.timesheet_handler import TimesheetHandler
 from .handlers.construction_handler import ConstructionHandler
 from .services.storage_service import JSONStorageService
 from .handlers.running_list_handler import RunningListHandler
+from .handlers.search_handler import SearchHandler
+from .services.search_service import SearchService
+from .services.memory_service import MemoryService
+from .services.conversation_service import ConversationStore
+from .services.update_service import ALLOWED_UPDATES, UpdateFilter, UserLocks
+from .services.callback_service import DEBOUNCE_SECONDS, CallbackPipeline, answer_callback
+from .services.outbox_service import Outbox
+from .services.job_service import JOB_WORKERS, JobService
+from .services.scheduler_service import Scheduler
+from .services.task_reminders import TaskReminders
+from .services.timesheet_timers import LOCK_TIME, TimesheetTimers
+from .services.callback_codec import CallbackDecodeError, decode_callback
+from .services.metrics_service import UPDATE_DURATION, UPDATES, install_api_metrics, instrument_handler
+from .services.tracing_service import traced_update
+from .services.logging_service import get_logger
+
+logger = get_logger('finance_bot')
+
+RUNNING_LIST_ACTIONS = frozenset({"priority"})
+ATTENDANCE_ACTIONS = frozenset({"toggle_attendance", "save_attendance"})
+CONSTRUCTION_ACTIONS = frozenset({
+    "select_object", "obj_responsible", "obj_comments", "view_comments", "add_comment", "obj_next_stage",
+    "obj_complete", "confirm_complete", "resp_stage", "add_resp", "remove_resp", "back_to_object",
+    "back_to_construction", "back_to_objects",
+})
+# Действия, обработчики которых сами отвечают на нажатие всплывающим текстом
+TOAST_ACTIONS = frozenset({"remove_resp", "obj_next_stage", "confirm_complete", "find_page"})
 
 
 class FinanceBot:
-    def __init__(self, token: str):
-        self.bot = TeleBot(token)
+    def __init__(self, token: str, bot=None, storage_service=None, api_url: Optional[str] = None,
+                 owns_chat: Optional[Callable[[int], bool]] = None, conversations=None,
+                 job_workers: int = JOB_WORKERS, scheduler: Optional[Scheduler] = None, lock_time=LOCK_TIME,
+                 callback_debounce: float = DEBOUNCE_SECONDS):
+        if api_url:
+            # Другой сервер Bot API (локальный стенд benchmarks/fake_bot_api.py), формат "http://host:port/bot{0}/{1}"
+            apihelper.API_URL = api_url
+
+        # bot и storage_service можно подменить (бенчмарки, локальный запуск)
+        if bot is None:
+            install_api_metrics()
+            bot = TeleBot(token)
+        self.bot = bot
 
         # Инициализируем сервис хранения
-        self.storage_service = JSONStorageService()
+        self.storage_service = storage_service if storage_service is not None else JSONStorageService()
 
-        # Загружаем данные при запуске
-        self.users_data: Dict[int, UserData] = self.storage_service.load_all_data()
+        # Загружаем данные при запуске; воркер шарда (bot/cluster.py) - только своих чатов
+        self.owns_chat = owns_chat
+        self.users_data: Dict[int, UserData] = self.storage_service.load_all_data(owned=owns_chat)
 
         # ПЕРЕДАЕМ STORAGE_SERVICE В BOT ОБЪЕКТ (важно!)
         self.bot.storage_service = self.storage_service
 
+        # Экраны и начатые диалоги - отдельное небольшое хранилище с периодическим сбросом на диск
+        self.conversations = conversations if conversations is not None else ConversationStore(
+            self.storage_service, owns_chat=owns_chat)
+        for user_data in self.users_data.values():
+            self.conversations.adopt(user_data)
+        self.bot.conversations = self.conversations
+        self.conversations.start()
+
+        # Поисковые индексы строятся лениво, обработчики обновляют их через bot.search_service
+        self.search_service = SearchService(self.users_data)
+        self.bot.search_service = self.search_service
+
+        # Учет памяти по пользователям и подсистемам (маршрут /debug/memory в main.py)
+        self.memory_service = MemoryService(self.users_data, self.search_service)
+
+        # Апдейт пользователя и таймеры планировщика изменяют его данные по очереди
+        self.user_locks = UserLocks()
+
+        # Повторные апдейты (после перезапуска, повторная доставка, двойное нажатие) отсеиваются до обработки.
+        # Последний принятый update_id хранится рядом с данными: после перезапуска polling продолжает с него
+        self.update_filter = UpdateFilter(self.storage_service.load_bot_state().get('last_update_id', 0))
+        self._saved_update_id = self.update_filter.last_update_id
+        if hasattr(self.bot, 'process_new_updates'):
+            self.bot.last_update_id = max(self.bot.last_update_id, self.update_filter.last_update_id)
+            self._process_updates = self.bot.process_new_updates
+            self.bot.process_new_updates = self._process_new_updates
+
+        # Таймеры процесса: блокировка отметок в конце дня, закрытие периодов зарплаты, сроки задач, окна нажатий.
+        # scheduler можно подменить (свои часы в тестах); поток запускается, когда все таймеры восстановлены
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+
+        # Нажатия inline-кнопок: мгновенный ответ, отсев устаревших клавиатур, склейка быстрых нажатий.
+        # Клавиатуры одного раздела вытесняют друг друга: нажатие на более старую считается устаревшим.
+        # "Назад" в табель есть и на клавиатуре отметок, и на клавиатуре удаления работников - он вне разделов
+        self.callback_pipeline = CallbackPipeline(self.bot, {
+            'running_list': RUNNING_LIST_ACTIONS,
+            'attendance': ATTENDANCE_ACTIONS,
+            'employees': {"remove_employee"},
+            'construction': CONSTRUCTION_ACTIONS,
+            'search': {"find_page"},
+        }, TOAST_ACTIONS, scheduler=self.scheduler, debounce=callback_debounce)
+        self.callback_pipeline.install()
+
+        # Сообщения одного апдейта копятся и уходят в конце; соседние тексты одному чату склеиваются
+        self.outbox = Outbox(self.bot)
+        self.outbox.install()
+
+        # Отчеты и расчет зарплаты идут в пуле фоновых задач, не задерживая апдейты
+        self.jobs = JobService(self.bot, send_message=self.outbox.send_now, workers=job_workers)
+        self.bot.jobs = self.jobs
+
         # Инициализируем обработчики
         self.expenses_handler = ExpensesHandler(self.bot, self.users_data)
         self.report_handler = ReportHandler(self.bot, self.users_data)
         self.timesheet_handler = TimesheetHandler(self.bot, self.users_data)
         self.construction_handler = ConstructionHandler(self.bot, self.users_data)
         self.running_list_handler = RunningListHandler(self.bot, self.users_data)
+        self.search_handler = SearchHandler(self.bot, self.users_data)
+
+        # Метрики: каждый экран замеряется с метками handler/state/action (см. /metrics)
+        for handler in (self.expenses_handler, self.report_handler, self.timesheet_handler,
+                        self.construction_handler, self.running_list_handler, self.search_handler):
+            instrument_handler(handler, self.users_data)
+        instrument_handler(self, self.users_data, prefix='_handle_',
+                           exclude=('_handle_text_message', '_handle_callback'))
+
+        # Таймеры табеля и сроков задач - на общем планировщике, восстанавливаются по заголовкам пользователей
+        self.timesheet_timers = TimesheetTimers(self.scheduler, self.users_data, self.storage_service,
+                                                self.timesheet_handler.send_period_summary, lock_time=lock_time,
+                                                user_locks=self.user_locks)
+        self.bot.timesheet_timers = self.timesheet_timers
+        self.timesheet_timers.restore(self.users_data.values())
+        self.task_reminders = TaskReminders(self.scheduler, self.users_data, self.storage_service,
+                                            self.running_list_handler.send_due_reminders, user_locks=self.user_locks)
+        self.bot.task_reminders = self.task_reminders
+        self.task_reminders.restore(self.users_data.values())
+        self.scheduler.start()
 
         self._register_handlers()
         atexit.register(self._save_all_data)
 
     def _save_all_data(self):
         """Сохраняет все данные при завершении работы"""
-        print("Сохранение данных...")
+        logger.info("Сохранение данных...")
+        self.jobs.stop()
+        self.scheduler.stop()
+        # Нажатия, ждущие окна склейки, обрабатываются до сохранения
+        self.callback_pipeline.flush()
         self.storage_service.save_all_data(self.users_data)
-        print("Данные сохранены!")
+        self.conversations.stop()
+        self._save_update_checkpoint()
+        logger.info("Данные сохранены!")
+
+    def _save_update_checkpoint(self):
+        # У воркера шарда апдейты получает диспетчер, он и хранит update_id
+        if self.owns_chat is not None:
+            return
+        last_update_id = self.update_filter.last_update_id
+        if last_update_id != self._saved_update_id:
+            self.storage_service.save_bot_state({'last_update_id': last_update_id})
+            self._saved_update_id = last_update_id
+
+    def _process_new_updates(self, updates):
+        """Обертка TeleBot.process_new_updates: отсев повторов и сохранение update_id после раздачи пачки"""
+        fresh = self.update_filter.filter(updates, on_double_tap=lambda call: answer_callback(self.bot, call))
+        # TeleBot берет offset из last_update_id - сдвигаем его и за отброшенными, иначе они придут снова
+        self.bot.last_update_id = max(self.bot.last_update_id, self.update_filter.last_update_id)
+        if fresh:
+            self._process_updates(fresh)
+        self._save_update_checkpoint()
 
     def _register_handlers(self):
         @self.bot.message_handler(commands=['start'])
         def send_welcome(message):
-            self._handle_start(message)
+            with self.user_locks(message.chat.id), self.outbox.collect():
+                self._handle_start(message)
 
         @self.bot.message_handler(commands=['help'])
         def send_help(message):
-            self._handle_help(message)
+            with self.user_locks(message.chat.id), self.outbox.collect():
+                self._handle_help(message)
 
         @self.bot.message_handler(commands=['cancel'])
         def cancel_action(message):
-            self._handle_cancel(message)
+            with self.user_locks(message.chat.id), self.outbox.collect():
+                self._handle_cancel(message)
 
         @self.bot.message_handler(content_types=['text'])
         def handle_all_messages(message):
-            self._handle_text_message(message)
+            UPDATES.inc(type='message')
+            with UPDATE_DURATION.time(type='message'), self.user_locks(message.chat.id), self.outbox.collect():
+                self._handle_text_message(message)
 
         @self.bot.callback_query_handler(func=lambda call: True)
         def handle_callback(call):
-            self._handle_callback(call)
+            UPDATES.inc(type='callback_query')
+            # Блокировку пользователя берет _route_callbacks: нажатия, пришедшие во время обработки, копятся в пачку
+            with UPDATE_DURATION.time(type='callback_query'), self.outbox.collect():
+                self._handle_callback(call)
+
+        @self.bot.inline_handler(func=lambda query: True)
+        def handle_inline_query(inline_query):
+            UPDATES.inc(type='inline_query')
+            with UPDATE_DURATION.time(type='inline_query'):
+                self.search_handler.handle_inline_query(inline_query)
 
     def _handle_start(self, message):
         user_data = self._get_user_data(message.chat.id)
@@ -82,7 +230,8 @@ class FinanceBot:
 Доступные команды:
 /start - Начать работу с кнопками
 /help - Помощь
-/cancel - Отменить текущее действие
+/cancel - Отменить текущее действие и фоновые задачи (отчеты, расчеты)
+/find <текст> - Поиск по задачам, расходам, объектам, контактам и комментариям
 
 Основные разделы:
 • расходы - Управление финансами
@@ -96,42 +245,52 @@ class FinanceBot:
     def _handle_cancel(self, message):
         user_data = self._get_user_data(message.chat.id)
         user_data.state = 'main_menu'
-        self.bot.send_message(message.chat.id, "Действие отменено. Возврат в главное меню.")
+        response = "Действие отменено. Возврат в главное меню."
+        cancelled = self.jobs.cancel(message.chat.id)
+        if cancelled:
+            response += f"\nОстанавливаем фоновые задачи: {cancelled}"
+        self.bot.send_message(message.chat.id, response)
         self._handle_start(message)
 
+    @traced_update('message')
     def _handle_text_message(self, message):
         chat_id = message.chat.id
         text = message.text
         user_data = self._get_user_data(chat_id)
 
-        print(f"Получено сообщение: '{text}' от пользователя {chat_id}, состояние: {user_data.state}")
+        logger.debug("Получено сообщение: '%s' от пользователя %s, состояние: %s", text, chat_id, user_data.state,
+                     extra={'chat_id': chat_id})
 
         # Обработка команд Running List
         if text.startswith('/done'):
             task_number = text.split(' ', 1)[1] if ' ' in text else ""
-            print(f"DEBUG: Обработка команды /done с номером: '{task_number}'")
+            logger.debug("Обработка команды /done с номером: '%s'", task_number, extra={'chat_id': chat_id})
             self.running_list_handler.handle_complete_task(message, task_number)
             return
 
         if text.startswith('/delete'):
             task_number = text.split(' ', 1)[1] if ' ' in text else ""
-            print(f"DEBUG: Обработка команды /delete с номером: '{task_number}'")
+            logger.debug("Обработка команды /delete с номером: '%s'", task_number, extra={'chat_id': chat_id})
             self.running_list_handler.handle_delete_task(message, task_number)
             return
 
         if text.startswith('/reopen'):
             task_number = text.split(' ', 1)[1] if ' ' in text else ""
-            print(f"DEBUG: Обработка команды /reopen с номером: '{task_number}'")
+            logger.debug("Обработка команды /reopen с номером: '%s'", task_number, extra={'chat_id': chat_id})
             self.running_list_handler.handle_reopen_task(message, task_number)
             return
 
+        if text.startswith('/find'):
+            query = text.split(' ', 1)[1] if ' ' in text else ""
+            self.search_handler.handle_find(message, query)
+            return
+
         # Обработка команды /del для удаления ответственных лиц
         if text.startswith('/del'):
             # Проверяем, находится ли пользователь в режиме управления объектом
-            if (hasattr(user_data, 'temp_object_id') and
-                    user_data.state == 'construction_main'):
-                object_id = getattr(user_data, 'temp_object_id')
-                self.construction_handler.handle_delete_responsible(message, object_id)
+            selected = user_data.conversation.get(SelectedObject)
+            if selected and user_data.state == 'construction_main':
+                self.construction_handler.handle_delete_responsible(message, selected.object_id)
                 return
             else:
                 self.bot.send_message(chat_id, "❌ Сначала выберите объект в разделе 'Управление объектом'")
@@ -139,10 +298,15 @@ class FinanceBot:
 
         # Обработка состояний Running List (ПЕРЕМЕЩАЕМ В НАЧАЛО, ПЕРЕД другими состояниями)
         if user_data.state == 'waiting_task_description':
-            print(f"DEBUG: Обнаружено состояние 'waiting_task_description', передаем в running_list_handler")
+            logger.debug("Состояние 'waiting_task_description', передаем в running_list_handler",
+                         extra={'chat_id': chat_id})
             self.running_list_handler.handle_task_description_input(message)
             return
 
+        if user_data.state == 'waiting_task_due_date':
+            self.running_list_handler.handle_task_due_date_input(message)
+            return
+
         # Обработка состояний строительных объектов
         if user_data.state == 'waiting_object_name':
             self.construction_handler.handle_object_name_input(message)
@@ -234,57 +398,88 @@ class FinanceBot:
         elif text == '⚙️ Управление объектом':
             self.construction_handler.handle_manage_object_menu(message)
         elif text == '📋 Running List':
-            print(f"DEBUG: Нажата кнопка '📋 Running List'")
+            logger.debug("Нажата кнопка '📋 Running List'", extra={'chat_id': chat_id})
             self.running_list_handler.handle_running_list_main(message)
         elif text == '➕ Добавить задачу':
-            print(f"DEBUG: Нажата кнопка '➕ Добавить задачу'")
+            logger.debug("Нажата кнопка '➕ Добавить задачу'", extra={'chat_id': chat_id})
             self.running_list_handler.handle_add_task(message)
         elif text == '📋 Список задач':
-            print(f"DEBUG: Нажата кнопка '📋 Список задач'")
+            logger.debug("Нажата кнопка '📋 Список задач'", extra={'chat_id': chat_id})
             self.running_list_handler.handle_view_tasks(message)
         elif text == '✅ Выполненные':
-            print(f"DEBUG: Нажата кнопка '✅ Выполненные'")
+            logger.debug("Нажата кнопка '✅ Выполненные'", extra={'chat_id': chat_id})
             self.running_list_handler.handle_completed_tasks(message)
         elif text == 'назад':
             self._handle_start(message)
         else:
             self.bot.send_message(chat_id, "Используйте кнопки меню или команду /help")
 
+    @traced_update('callback_query')
     def _handle_callback(self, call):
         """Обработка callback запросов от inline кнопок"""
         chat_id = call.message.chat.id
-        user_data = self._get_user_data(chat_id)
+
+        try:
+            callback = decode_callback(call.data)
+        except CallbackDecodeError as e:
+            logger.warning("Некорректный callback от пользователя %s: %s", chat_id, e, extra={'chat_id': chat_id})
+            answer_callback(self.bot, call)
+            return
+
+        # Ответ Telegram, отсев устаревших клавиатур и склейка быстрых нажатий - в CallbackPipeline
+        self.callback_pipeline.dispatch(call, callback, self._route_callbacks)
+
+    def _route_callbacks(self, batch):
+        """Пачка нажатий в разделе чата: подряд идущие отметки присутствия - одним изменением"""
+        # Пачка после окна приходит из потока планировщика - ей нужна своя область Outbox
+        with self.user_locks(batch[0][0].message.chat.id), self.outbox.collect():
+            self._route_batch(batch)
+
+    def _route_batch(self, batch):
+        toggles = []
+        for call, callback in batch:
+            if callback.action == "toggle_attendance" and callback.args:
+                toggles.append((call, callback.args[0]))
+                continue
+            if toggles:
+                self.timesheet_handler.handle_attendance_toggles(toggles[-1][0], [employee for _, employee in toggles])
+                toggles = []
+            self._route_callback(call, callback)
+        if toggles:
+            self.timesheet_handler.handle_attendance_toggles(toggles[-1][0], [employee for _, employee in toggles])
+
+    def _route_callback(self, call, callback):
+        chat_id = call.message.chat.id
+        self._get_user_data(chat_id)
+        action = callback.action
 
         # Обработка callback для running list (ПЕРВЫМ ДЕЛОМ!)
-        if call.data.startswith("priority:"):
-            self.running_list_handler.handle_running_list_callback(call)
+        if action in RUNNING_LIST_ACTIONS:
+            self.running_list_handler.handle_running_list_callback(call, callback)
             return
 
         # Обработка callback для табеля
-        if call.data.startswith(("toggle_attendance:", "save_attendance")):
-            self.timesheet_handler.handle_attendance_callback(call)
-        elif call.data.startswith("remove_employee:"):
-            self.timesheet_handler.handle_remove_employee_callback(call)
-        elif call.data == "back_to_timesheet":
+        if action in ATTENDANCE_ACTIONS:
+            self.timesheet_handler.handle_attendance_callback(call, callback)
+        elif action == "remove_employee":
+            self.timesheet_handler.handle_remove_employee_callback(call, callback)
+        elif action == "back_to_timesheet":
             self.timesheet_handler.handle_timesheet_main(call.message)
 
         # Обработка callback для строительных объектов
-        elif call.data.startswith(("select_object:", "obj_responsible:", "obj_comments:", "view_comments:",
-                                   "add_comment:", "obj_next_stage:", "obj_complete:", "confirm_complete:",
-                                   "resp_stage:", "add_resp:", "remove_resp:", "back_to_object:",
-                                   "back_to_construction", "back_to_objects")):
-            self.construction_handler.handle_construction_callback(call)
-
-        # Обработка callback для Running List (ДОБАВЛЯЕМ)
-        elif call.data.startswith("priority:"):
-            self.running_list_handler.handle_running_list_callback(call)
+        elif action in CONSTRUCTION_ACTIONS:
+            self.construction_handler.handle_construction_callback(call, callback)
+
+        # Листание результатов поиска
+        elif action == "find_page":
+            self.search_handler.handle_find_page_callback(call, callback)
+
     def _handle_clear_confirmation(self, message):
         chat_id = message.chat.id
         text = message.text
 
         if text == 'ДА, очистить всё':
-            deleted_count = self.report_handler.execute_clear_data(chat_id)
-            self.bot.send_message(chat_id, f"✅ Все данные по расходам удалены!\nУдалено записей: {deleted_count}")
+            self.report_handler.handle_execute_clear_data(message)
             self._handle_start(message)
         elif text == 'НЕТ, отменить':
             self.bot.send_message(chat_id, "❌ Очистка данных отменена.")
@@ -298,13 +493,7 @@ class FinanceBot:
 
         period_map = {'неделя': 7, 'месяц': 30, '3 месяца': 90}
         if text in period_map:
-            filename, report_text = self.report_handler.create_expense_report(chat_id, period_map[text])
-            if filename:
-                with open(filename, 'rb') as f:
-                    self.bot.send_document(chat_id, f, caption=report_text)
-                os.remove(filename)
-            else:
-                self.bot.send_message(chat_id, report_text)
+            self.report_handler.handle_expense_report(message, period_map[text])
             self._handle_start(message)
         elif text == 'назад':
             self._handle_start(message)
@@ -321,20 +510,16 @@ class FinanceBot:
 
     def _get_user_data(self, chat_id: int) -> UserData:
         if chat_id not in self.users_data:
-            self.users_data[chat_id] = UserData(chat_id)
+            self.users_data[chat_id] = self.conversations.adopt(UserData(chat_id))
         return self.users_data[chat_id]
 
     def run(self):
-        if not os.path.exists('temp'):
-            os.makedirs('temp')
-        os.chdir('temp')
-
-        print("Бот запущен...")
+        logger.info("Бот запущен...")
         try:
-            self.bot.polling(none_stop=True)
+            self.bot.polling(none_stop=True, allowed_updates=ALLOWED_UPDATES)
         except KeyboardInterrupt:
-            print("Бот остановлен пользователем")
+            logger.info("Бот остановлен пользователем")
         except Exception as e:
-            print(f"Ошибка: {e}")
+            logger.exception("Ошибка: %s", e)
         finally:
             self._save_all_data()
\ No newline at end of file
@@ -0,0 +1,322 @@
+"""
+Несколько процессов бота на одной папке данных.
+
+Диспетчер (лидер опроса) получает апдейты из Telegram и передает апдейты чата воркеру,
+который держит аренду шарда shard_of(chat_id). Данные пользователя меняет только этот воркер.
+Аренда - flock на файле в data/shards: упал воркер - ядро сняло блокировку, и его шарды
+через LEASE_INTERVAL подхватывают остальные; перезапущенный воркер забирает свои домашние шарды обратно.
+
+Запуск (см. main.py): WORKERS=4 python main.py - диспетчер и 4 воркера отдельными процессами.
+"""
+import os
+import queue
+import signal
+import subprocess
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import requests
+from telebot import ExceptionHandler, TeleBot, apihelper, types
+
+from .bot import FinanceBot
+from .services.callback_service import answer_callback
+from .services.conversation_service import ConversationStore
+from .services.job_service import JOB_WORKERS
+from .services.timesheet_timers import LOCK_TIME
+from .services.logging_service import get_logger
+from .services.metrics_service import SHARD_DELIVERIES, install_api_metrics
+from .services.shard_service import ShardLeases, shard_of, shard_owner, update_chat_id
+from .services.update_service import ALLOWED_UPDATES, UpdateFilter
+
+logger = get_logger('cluster')
+
+# Как часто воркер проверяет аренды (подхват шардов упавшего воркера, возврат домашних)
+LEASE_INTERVAL = 1.0
+# Сколько апдейтов одного шарда передается воркеру одним запросом
+MAX_BATCH = 100
+# Таймаут одного запроса к воркеру и сколько всего пытаться доставить пачку
+DELIVERY_TIMEOUT = 30.0
+DELIVERY_GIVE_UP = 120.0
+RETRY_DELAY = 0.2
+# Long polling getUpdates
+POLL_TIMEOUT = 20
+# Пауза перед перезапуском упавшего воркера
+RESTART_DELAY = 1.0
+# Сколько диспетчер ждет воркеров при старте, прежде чем начать опрос
+STARTUP_TIMEOUT = 30.0
+
+
+def lease_dir(data_dir: str) -> str:
+    return os.path.join(data_dir, 'shards')
+
+
+class _LogExceptions(ExceptionHandler):
+    # Без пула потоков исключение обработчика прервало бы всю пачку - пишем в лог и идем дальше, как пул
+    def handle(self, exception):
+        logger.error("Ошибка обработки апдейта: %s", exception, exc_info=exception)
+        return True
+
+
+class ShardWorker:
+    """Воркер: обрабатывает апдейты своих шардов, данные остальных чатов в памяти не держит"""
+
+    def __init__(self, token: str, leases: ShardLeases, storage_service, api_url: Optional[str] = None,
+                 job_workers: int = JOB_WORKERS, lock_time=LOCK_TIME):
+        self.leases = leases
+        self.storage_service = storage_service
+        self._cond = threading.Condition()
+        self._inflight: Counter = Counter()
+        self._stop = threading.Event()
+
+        # Аренды берутся до загрузки: в память попадают только чаты своих шардов
+        leases.rebalance()
+        install_api_metrics()
+        # Апдейт обрабатывается прямо в потоке HTTP-запроса диспетчера: так диспетчер знает, когда он обработан
+        bot = TeleBot(token, threaded=False, exception_handler=_LogExceptions())
+        # Состояния диалогов - свой файл на шард: его пишет только текущий владелец шарда
+        conversations = ConversationStore(
+            storage_service, partition=lambda chat_id: f"conversations_shard_{shard_of(chat_id, leases.shards)}",
+            owns_chat=leases.owns_chat)
+        self.finance_bot = FinanceBot(token, bot=bot, storage_service=storage_service, api_url=api_url,
+                                      owns_chat=leases.owns_chat, conversations=conversations,
+                                      job_workers=job_workers, lock_time=lock_time)
+        # Шарды, по которым принимаются апдейты: данные загружены и шард не передается другому воркеру
+        self._ready = set(leases.held)
+
+    def start(self):
+        threading.Thread(target=self._lease_loop, name='shard-leases', daemon=True).start()
+
+    def stop(self):
+        # Данные сохраняет atexit FinanceBot; блокировки снимутся с завершением процесса, уже после сохранения
+        self._stop.set()
+
+    def handle(self, shard: int, raw_updates: List[dict]) -> bool:
+        """Обрабатывает пачку апдейтов шарда; False - шард не принадлежит этому воркеру"""
+        with self._cond:
+            if shard not in self._ready:
+                return False
+            self._inflight[shard] += 1
+        try:
+            self.finance_bot.bot.process_new_updates([types.Update.de_json(update) for update in raw_updates])
+        finally:
+            with self._cond:
+                self._inflight[shard] -= 1
+                self._cond.notify_all()
+        return True
+
+    def _lease_loop(self):
+        while not self._stop.wait(LEASE_INTERVAL):
+            try:
+                self.rebalance()
+            except Exception as e:
+                logger.exception("Ошибка перераспределения шардов: %s", e)
+
+    def rebalance(self):
+        acquired, surplus = self.leases.rebalance()
+        for shard in acquired:
+            self._load_shard(shard)
+        for shard in surplus:
+            self._hand_over(shard)
+
+    def _in_shard(self, shard: int):
+        return lambda chat_id: shard_of(chat_id, self.leases.shards) == shard
+
+    def _load_shard(self, shard: int):
+        # Прежний владелец сохранял данные после каждого изменения (обработчики, таймеры) - читаем их с диска.
+        # Если он упал, теряются только экраны и черновики диалогов за последние DUMP_INTERVAL секунд
+        # (conversation_service.py)
+        users_data = self.storage_service.load_all_data(owned=self._in_shard(shard))
+        conversations = self.finance_bot.conversations
+        conversations.load(owned=self._in_shard(shard))
+        for user_data in users_data.values():
+            conversations.adopt(user_data)
+        self.finance_bot.users_data.update(users_data)
+        self.finance_bot.timesheet_timers.restore(users_data.values())
+        self.finance_bot.task_reminders.restore(users_data.values())
+        with self._cond:
+            self._ready.add(shard)
+
+    def _hand_over(self, shard: int):
+        with self._cond:
+            self._ready.discard(shard)
+            while self._inflight[shard]:
+                self._cond.wait()
+        # Нажатия, ждущие окна склейки, - апдейты этого воркера: обрабатываем до передачи шарда
+        self.finance_bot.callback_pipeline.flush(self._in_shard(shard))
+
+        users_data = self.finance_bot.users_data
+        for chat_id in [chat_id for chat_id in users_data if self._in_shard(shard)(chat_id)]:
+            # Таймер этого пользователя мог как раз сработать: сохраняем после него, и он не тронет ушедшего
+            with self.finance_bot.user_locks(chat_id):
+                self.storage_service.save_user_data(users_data[chat_id])
+                del users_data[chat_id]
+            self.finance_bot.search_service.drop_user(chat_id)
+        self.finance_bot.conversations.forget(self._in_shard(shard))
+        self.leases.release(shard)
+
+
+class _ShardSender:
+    """Очередь апдейтов одного шарда: по порядку, пачками, с повтором до доставки владельцу"""
+
+    def __init__(self, dispatcher: 'UpdateDispatcher', shard: int):
+        self.dispatcher = dispatcher
+        self.shard = shard
+        self.queue: 'queue.Queue[dict]' = queue.Queue()
+        self._session = requests.Session()
+        self._address: Optional[str] = None
+        threading.Thread(target=self._run, name=f'shard-sender-{shard}', daemon=True).start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._deliver(batch)
+            self.dispatcher.delivered(batch)
+
+    def _deliver(self, batch: List[dict]):
+        give_up = time.monotonic() + DELIVERY_GIVE_UP
+        while True:
+            if self._post(batch):
+                SHARD_DELIVERIES.inc(outcome='delivered')
+                return
+            if time.monotonic() > give_up:
+                SHARD_DELIVERIES.inc(outcome='failed')
+                logger.error("Апдейты шарда %s не доставлены: %s шт.", self.shard, len(batch),
+                             extra={'shard': self.shard})
+                return
+            SHARD_DELIVERIES.inc(outcome='retry')
+            self._address = None
+            time.sleep(RETRY_DELAY)
+
+    def _post(self, batch: List[dict]) -> bool:
+        if self._address is None:
+            self._address = shard_owner(self.dispatcher.lease_dir, self.shard)
+            if self._address is None:
+                return False
+        try:
+            response = self._session.post(f"{self._address}/shard/updates", timeout=DELIVERY_TIMEOUT,
+                                          json={'shard': self.shard, 'updates': batch})
+        except requests.RequestException as e:
+            logger.warning("Воркер %s недоступен: %s", self._address, e, extra={'shard': self.shard})
+            return False
+        # 409 - шард уже у другого воркера
+        return response.status_code == 200
+
+
+class UpdateDispatcher:
+    """Лидер опроса: получает апдейты из Telegram и раскладывает их по очередям шардов"""
+
+    def __init__(self, token: str, storage_service, lease_dir: str, shards: int, api_url: Optional[str] = None):
+        if api_url:
+            apihelper.API_URL = api_url
+        self.token = token
+        self.storage_service = storage_service
+        self.lease_dir = lease_dir
+        self.shards = shards
+        install_api_metrics()
+        # Только для ответов на отброшенные двойные нажатия; апдейты обрабатывают воркеры
+        self.bot = TeleBot(token, threaded=False)
+
+        self.update_filter = UpdateFilter(storage_service.load_bot_state().get('last_update_id', 0))
+        self._saved_update_id = self.update_filter.last_update_id
+        self._pending: set = set()
+        self._lock = threading.Lock()
+        self._senders = [_ShardSender(self, shard) for shard in range(shards)]
+
+    def wait_for_owners(self, stop: threading.Event, timeout: float = STARTUP_TIMEOUT) -> bool:
+        """Ждет, пока у каждого шарда появится владелец: иначе первые апдейты ждали бы запуска воркеров"""
+        deadline = time.monotonic() + timeout
+        while not stop.is_set() and time.monotonic() < deadline:
+            if all(shard_owner(self.lease_dir, shard) is not None for shard in range(self.shards)):
+                return True
+            stop.wait(RETRY_DELAY)
+        return False
+
+    def poll(self, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                raw_updates = apihelper.get_updates(
+                    self.token, offset=self.update_filter.last_update_id + 1, timeout=POLL_TIMEOUT,
+                    allowed_updates=ALLOWED_UPDATES, long_polling_timeout=POLL_TIMEOUT)
+            except Exception as e:
+                logger.warning("Ошибка getUpdates: %s", e)
+                stop.wait(RETRY_DELAY * 5)
+                continue
+            self.dispatch(raw_updates)
+
+    def dispatch(self, raw_updates: List[dict]):
+        by_id: Dict[int, dict] = {update['update_id']: update for update in raw_updates}
+        fresh = self.update_filter.filter([types.Update.de_json(update) for update in raw_updates],
+                                          on_double_tap=lambda call: answer_callback(self.bot, call))
+        with self._lock:
+            self._pending.update(update.update_id for update in fresh)
+        for update in fresh:
+            raw = by_id[update.update_id]
+            chat_id = update_chat_id(raw)
+            self._senders[shard_of(chat_id, self.shards) if chat_id is not None else 0].queue.put(raw)
+        self._save_checkpoint()
+
+    def delivered(self, batch: List[dict]):
+        with self._lock:
+            self._pending.difference_update(update['update_id'] for update in batch)
+        self._save_checkpoint()
+
+    def _save_checkpoint(self):
+        # После перезапуска опрос продолжится с первого недоставленного апдейта
+        with self._lock:
+            if self._pending:
+                checkpoint = min(self._pending) - 1
+            else:
+                checkpoint = self.update_filter.last_update_id
+            if checkpoint <= self._saved_update_id:
+                return
+            self._saved_update_id = checkpoint
+            self.storage_service.save_bot_state({'last_update_id': checkpoint})
+
+
+class WorkerSupervisor:
+    """Запускает воркеры отдельными процессами и перезапускает упавшие"""
+
+    def __init__(self, command: List[str], workers: int, base_port: int, env: Optional[Dict[str, str]] = None):
+        self.command = command
+        self.workers = workers
+        self.base_port = base_port
+        self.env = dict(os.environ if env is None else env)
+        self._processes: Dict[int, subprocess.Popen] = {}
+
+    def _spawn(self, worker_id: int):
+        env = dict(self.env, BOT_ROLE='worker', WORKER_ID=str(worker_id), PORT=str(self.base_port + worker_id))
+        self._processes[worker_id] = subprocess.Popen(self.command, env=env)
+        logger.info("Воркер %s запущен: pid %s", worker_id, self._processes[worker_id].pid,
+                    extra={'worker': worker_id})
+
+    def start(self):
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+
+    def watch(self, stop: threading.Event):
+        while not stop.wait(RESTART_DELAY):
+            for worker_id, process in list(self._processes.items()):
+                if process.poll() is not None and not stop.is_set():
+                    logger.warning("Воркер %s завершился с кодом %s, перезапуск", worker_id, process.returncode,
+                                   extra={'worker': worker_id})
+                    self._spawn(worker_id)
+
+    def stop(self, timeout: float = 30.0):
+        # SIGINT - воркеры сохраняют данные штатно
+        for process in self._processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        deadline = time.monotonic() + timeout
+        for process in self._processes.values():
+            try:
+                process.wait(max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
@@ -1,6 +1,9 @@
 from telebot import TeleBot
 from typing import Dict
 from ..models.user_data import UserData
+from ..services.message_renderer import MessageBuilder, split_message
+from ..services.tracing_service import TRACER
+from ..services.callback_service import answer_callback
 
 
 class BaseHandler:
@@ -10,7 +13,7 @@ class BaseHandler:
 
     def get_user_data(self, chat_id: int) -> UserData:
         if chat_id not in self.users_data:
-            self.users_data[chat_id] = UserData(chat_id)
+            self.users_data[chat_id] = self.bot.conversations.adopt(UserData(chat_id))
         return self.users_data[chat_id]
 
     def set_user_state(self, chat_id: int, state: str):
@@ -19,4 +22,22 @@ class BaseHandler:
 
     def get_user_state(self, chat_id: int) -> str:
         user_data = self.get_user_data(chat_id)
-        return user_data.state
\ No newline at end of file
+        return user_data.state
+
+    def answer_callback(self, call, text: str = None, show_alert: bool = False) -> bool:
+        """Всплывающий ответ на нажатие кнопки; если на нажатие уже ответили, ничего не делает"""
+        return answer_callback(self.bot, call, text, show_alert)
+
+    def send_text(self, chat_id: int, text, reply_markup=None):
+        """
+        Единая точка отправки длинных текстов: режет по строкам на сообщения
+        в пределах лимита Telegram и отправляет по порядку.
+        Клавиатура прикрепляется к последнему сообщению.
+        """
+        with TRACER.span('render', 'render'):
+            chunks = text.chunks() if isinstance(text, MessageBuilder) else split_message(text)
+        last_message = None
+        for i, chunk in enumerate(chunks):
+            markup = reply_markup if i == len(chunks) - 1 else None
+            last_message = self.bot.send_message(chat_id, chunk, reply_markup=markup)
+        return last_message
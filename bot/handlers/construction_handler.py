@@ -1,19 +1,53 @@
+from typing import Optional
 from telebot import types
 from .base_handler import BaseHandler
 from ..models.construction import ConstructionStage, ResponsiblePerson, ConstructionObject
+from ..models.conversation import ObjectDraft, ResponsibleDraft, SelectedObject, StageCommentDraft
+from ..services.callback_codec import CallbackData, encode_callback, stage_index, stage_from_index
+from ..services.message_renderer import MessageBuilder, SectionTemplate, fit_message
+from ..services.logging_service import get_logger
+
+logger = get_logger('construction')
+
+
+def _format_responsible_person(i, person):
+    line = f"{i}. {person.position}, {person.name}, {person.phone}"
+    if person.email:
+        line += f", {person.email}"
+    return line
+
+
+def _format_completed_object(obj):
+    completion_date = obj.completion_date.strftime('%d.%m.%Y') if obj.completion_date else "неизвестно"
+    return f"• {obj.name} ({obj.address}) - {completion_date}"
+
+
+ACTIVE_OBJECTS_SECTION = SectionTemplate(
+    "{stage}:", lambda obj: f"• {obj.name} ({obj.address}) - {len(obj.responsible_persons)} ответственных")
+COMPLETED_OBJECTS_SECTION = SectionTemplate("✅ ЗАВЕРШЕННЫЕ ОБЪЕКТЫ:", _format_completed_object)
+RESPONSIBLE_SECTION = SectionTemplate(None, _format_responsible_person, numbered=True)
+
+COMMENTS_VIEW_LIMIT = 200
 
 
 class ConstructionHandler(BaseHandler):
     def __init__(self, bot, users_data):
         super().__init__(bot, users_data)
 
+    def _auto_save_user_data(self, chat_id: int):
+        """Автосохранение данных пользователя"""
+        try:
+            user_data = self.get_user_data(chat_id)
+            self.bot.storage_service.save_user_data(user_data)
+        except Exception as e:
+            logger.exception("Ошибка автосохранения: %s", e, extra={'chat_id': chat_id})
+
     def handle_construction_main(self, message):
         chat_id = message.chat.id
         user_data = self.get_user_data(chat_id)
 
         # Очищаем временные данные
-        if hasattr(user_data, 'temp_object_id'):
-            delattr(user_data, 'temp_object_id')
+        user_data.conversation.drop(SelectedObject, ResponsibleDraft, StageCommentDraft)
 
         self.set_user_state(chat_id, 'construction_main')
 
@@ -29,7 +63,7 @@ class ConstructionHandler(BaseHandler):
 
         user_data = self.get_user_data(message.chat.id)
         active_count = len(user_data.construction_manager.get_active_objects())
-        completed_count = len(user_data.construction_manager.get_completed_objects())
+        completed_count = user_data.construction_manager.completed_count()
 
         response = f"""
 🏗️ Раздел: СТРОИТЕЛЬНЫЕ ОБЪЕКТЫ
@@ -66,7 +100,7 @@ class ConstructionHandler(BaseHandler):
             return
 
         user_data = self.get_user_data(chat_id)
-        user_data.temp_object_name = object_name
+        user_data.conversation.put(ObjectDraft(object_name))
         self.set_user_state(chat_id, 'waiting_object_address')
 
         response = f"🏗️ Объект: {object_name}\n\nВведите адрес объекта:"
@@ -81,7 +115,8 @@ class ConstructionHandler(BaseHandler):
             return
 
         user_data = self.get_user_data(chat_id)
-        object_name = getattr(user_data, 'temp_object_name', '')
+        draft = user_data.conversation.get(ObjectDraft)
+        object_name = draft.name if draft else ''
 
         if not object_name:
             self.bot.send_message(chat_id, "❌ Ошибка: данные объекта не найдены.")
@@ -90,10 +125,13 @@ class ConstructionHandler(BaseHandler):
 
         # Добавляем объект
         obj = user_data.construction_manager.add_object(object_name, address)
+        self.bot.search_service.index_entity(chat_id, 'object', obj)
+
+        # АВТОСОХРАНЕНИЕ после добавления объекта
+        self._auto_save_user_data(chat_id)
 
         # Очищаем временные данные
-        if hasattr(user_data, 'temp_object_name'):
-            delattr(user_data, 'temp_object_name')
+        user_data.conversation.drop(ObjectDraft)
 
         self.bot.send_message(chat_id,
                               f"✅ Объект добавлен!\nНазвание: {obj.name}\nАдрес: {obj.address}\nТекущий этап: {obj.current_stage.value}")
@@ -104,31 +142,27 @@ class ConstructionHandler(BaseHandler):
         user_data = self.get_user_data(chat_id)
         manager = user_data.construction_manager
 
-        if not manager.objects:
+        if not manager.objects and not manager.archive:
             self.bot.send_message(chat_id, "❌ Нет добавленных объектов.")
             self.handle_construction_main(message)
             return
 
-        response = "📋 СПИСОК ОБЪЕКТОВ\n\n"
+        response = MessageBuilder("📋 СПИСОК ОБЪЕКТОВ")
 
         # Активные объекты по этапам
         for stage in ConstructionStage:
             objects_in_stage = manager.get_objects_by_stage(stage)
             if objects_in_stage:
-                response += f"\n{stage.value}:\n"
-                for obj in objects_in_stage:
-                    resp_count = len(obj.responsible_persons)
-                    response += f"• {obj.name} ({obj.address}) - {resp_count} ответственных\n"
+                response.blank()
+                response.section(ACTIVE_OBJECTS_SECTION, objects_in_stage, stage=stage.value)
 
         # Завершенные объекты
         completed_objects = manager.get_completed_objects()
         if completed_objects:
-            response += f"\n✅ ЗАВЕРШЕННЫЕ ОБЪЕКТЫ:\n"
-            for obj in completed_objects:
-                completion_date = obj.completion_date.strftime('%d.%m.%Y') if obj.completion_date else "неизвестно"
-                response += f"• {obj.name} ({obj.address}) - {completion_date}\n"
+            response.blank()
+            response.section(COMPLETED_OBJECTS_SECTION, completed_objects)
 
-        self.bot.send_message(chat_id, response)
+        self.send_text(chat_id, response)
         self.handle_construction_main(message)
 
     def handle_manage_object_menu(self, message):
@@ -136,7 +170,7 @@ class ConstructionHandler(BaseHandler):
         user_data = self.get_user_data(chat_id)
         manager = user_data.construction_manager
 
-        if not manager.objects:
+        if not manager.objects and not manager.archive:
             self.bot.send_message(chat_id, "❌ Нет добавленных объектов.")
             self.handle_construction_main(message)
             return
@@ -146,15 +180,15 @@ class ConstructionHandler(BaseHandler):
         for obj in manager.get_active_objects():
             resp_count = len(obj.responsible_persons)
             button_text = f"🏗 {obj.name} - {obj.current_stage.value} ({resp_count} ответ.)"
-            callback_data = f"select_object:{obj.id}"
+            callback_data = encode_callback("select_object", obj.id)
             markup.add(types.InlineKeyboardButton(button_text, callback_data=callback_data))
 
-        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data="back_to_construction"))
+        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data=encode_callback("back_to_construction")))
 
         response = "⚙️ УПРАВЛЕНИЕ ОБЪЕКТОМ\n\nВыберите объект для управления:"
         self.bot.send_message(chat_id, response, reply_markup=markup)
 
-    def handle_object_management(self, call, object_id: str):
+    def handle_object_management(self, call, object_id: int):
         chat_id = call.message.chat.id
         user_data = self.get_user_data(chat_id)
         obj = user_data.construction_manager.get_object(object_id)
@@ -165,24 +199,24 @@ class ConstructionHandler(BaseHandler):
             return
 
         # Сохраняем object_id для команды /del
-        user_data.temp_object_id = object_id
+        user_data.conversation.put(SelectedObject(object_id))
 
         markup = types.InlineKeyboardMarkup(row_width=2)
 
         # Кнопки управления
         markup.add(
-            types.InlineKeyboardButton("👥 Ответственные лица", callback_data=f"obj_responsible:{object_id}"),
-            types.InlineKeyboardButton("💬 Комментарии", callback_data=f"obj_comments:{object_id}")
+            types.InlineKeyboardButton("👥 Ответственные лица", callback_data=encode_callback("obj_responsible", object_id)),
+            types.InlineKeyboardButton("💬 Комментарии", callback_data=encode_callback("obj_comments", object_id))
         )
         markup.add(
-            types.InlineKeyboardButton("➡️ Следующий этап", callback_data=f"obj_next_stage:{object_id}"),
-            types.InlineKeyboardButton("✅ Завершить", callback_data=f"obj_complete:{object_id}")
+            types.InlineKeyboardButton("➡️ Следующий этап", callback_data=encode_callback("obj_next_stage", object_id)),
+            types.InlineKeyboardButton("✅ Завершить", callback_data=encode_callback("obj_complete", object_id))
         )
-        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data="back_to_objects"))
+        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data=encode_callback("back_to_objects")))
 
         # Формируем информацию об объекте
         responsible_count = len(obj.responsible_persons)
-        comments_count = sum(len(comments) for comments in obj.comments.values())
+        comments_count = len(obj.comment_log)
 
         response = f"""
     🏗️ УПРАВЛЕНИЕ ОБЪЕКТОМ
@@ -202,7 +236,7 @@ class ConstructionHandler(BaseHandler):
             reply_markup=markup
         )
 
-    def handle_responsible_persons(self, call, object_id: str):
+    def handle_responsible_persons(self, call, object_id: int):
         chat_id = call.message.chat.id
         user_data = self.get_user_data(chat_id)
         obj = user_data.construction_manager.get_object(object_id)
@@ -211,28 +245,25 @@ class ConstructionHandler(BaseHandler):
             return
 
         # Формируем текстовый список ответственных лиц
+        header = ["👥 ОТВЕТСТВЕННЫЕ ЛИЦА", "", f"Объект: {obj.name}", ""]
         if obj.responsible_persons:
-            response = f"👥 ОТВЕТСТВЕННЫЕ ЛИЦА\n\nОбъект: {obj.name}\n\n"
-
-            for i, person in enumerate(obj.responsible_persons, 1):
-                response += f"{i}. {person.position}, {person.name}, {person.phone}"
-                if person.email:
-                    response += f", {person.email}"
-                response += "\n"
-
-            response += f"\n🗑️ Для удаления контакта введите команду:\n"
-            response += f"/del <ФИО> или /del <номер телефона>\n"
-            response += f"Например: /del {obj.responsible_persons[0].name}\n"
-            response += f"Или: /del {obj.responsible_persons[0].phone}"
-
+            person_lines = RESPONSIBLE_SECTION.render(obj.responsible_persons).split("\n")
+            footer = [
+                "",
+                "🗑️ Для удаления контакта введите команду:",
+                "/del <ФИО> или /del <номер телефона>",
+                f"Например: /del {obj.responsible_persons[0].name}",
+                f"Или: /del {obj.responsible_persons[0].phone}",
+            ]
+            # Сообщение редактируется, поэтому список ужимается до лимита одного сообщения
+            response = fit_message(person_lines, header, footer, keep_tail=False)
         else:
-            response = f"👥 ОТВЕТСТВЕННЫЕ ЛИЦА\n\nОбъект: {obj.name}\n\n"
-            response += "❌ Нет ответственных лиц\n\n"
-            response += "Для добавления нажмите кнопку ниже"
+            response = "\n".join(header + ["❌ Нет ответственных лиц", "", "Для добавления нажмите кнопку ниже"])
 
         markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton("➕ Добавить ответственное лицо", callback_data=f"add_resp:{object_id}"))
-        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data=f"back_to_object:{object_id}"))
+        markup.add(types.InlineKeyboardButton("➕ Добавить ответственное лицо",
+                                              callback_data=encode_callback("add_resp", object_id)))
+        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data=encode_callback("back_to_object", object_id)))
 
         self.bot.edit_message_text(
             response,
@@ -241,7 +272,7 @@ class ConstructionHandler(BaseHandler):
             reply_markup=markup
         )
 
-    def handle_delete_responsible(self, message, object_id: str):
+    def handle_delete_responsible(self, message, object_id: int):
         """Обрабатывает команду /del для удаления ответственного лица"""
         chat_id = message.chat.id
         user_data = self.get_user_data(chat_id)
@@ -267,10 +298,15 @@ class ConstructionHandler(BaseHandler):
             if (search_term.lower() in person.name.lower() or
                     search_term in person.phone):
                 removed_person = obj.responsible_persons.pop(i)
+                user_data.construction_manager.touch()
+                self.bot.search_service.remove_entity(chat_id, 'contact', removed_person)
                 removed = True
                 break
 
         if removed and removed_person:
+            # АВТОСОХРАНЕНИЕ
+            self._auto_save_user_data(chat_id)
+
             self.bot.send_message(
                 chat_id,
                 f"✅ Ответственное лицо удалено:\n"
@@ -285,7 +321,7 @@ class ConstructionHandler(BaseHandler):
                 f"Проверьте правильность ФИО или номера телефона"
             )
 
-    def _show_responsible_persons(self, chat_id: int, object_id: str):
+    def _show_responsible_persons(self, chat_id: int, object_id: int):
         """Показывает список ответственных лиц (вспомогательный метод)"""
         user_data = self.get_user_data(chat_id)
         obj = user_data.construction_manager.get_object(object_id)
@@ -294,35 +330,32 @@ class ConstructionHandler(BaseHandler):
             return
 
         # Формируем текстовый список
+        response = MessageBuilder("👥 ОТВЕТСТВЕННЫЕ ЛИЦА")
+        response.line(f"Объект: {obj.name}")
+        response.blank()
         if obj.responsible_persons:
-            response = f"👥 ОТВЕТСТВЕННЫЕ ЛИЦА\n\nОбъект: {obj.name}\n\n"
-
-            for i, person in enumerate(obj.responsible_persons, 1):
-                response += f"{i}. {person.position}, {person.name}, {person.phone}"
-                if person.email:
-                    response += f", {person.email}"
-                response += "\n"
-
-            response += f"\n🗑️ Для удаления контакта введите команду:\n"
-            response += f"/del <ФИО> или /del <номер телефона>"
-
+            response.section(RESPONSIBLE_SECTION, obj.responsible_persons)
+            response.blank()
+            response.line("🗑️ Для удаления контакта введите команду:")
+            response.line("/del <ФИО> или /del <номер телефона>")
         else:
-            response = f"👥 ОТВЕТСТВЕННЫЕ ЛИЦА\n\nОбъект: {obj.name}\n\n"
-            response += "❌ Нет ответственных лиц\n\n"
-            response += "Для добавления нажмите кнопку ниже"
+            response.line("❌ Нет ответственных лиц")
+            response.blank()
+            response.line("Для добавления нажмите кнопку ниже")
 
         markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton("➕ Добавить ответственное лицо", callback_data=f"add_resp:{object_id}"))
-        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data=f"back_to_object:{object_id}"))
+        markup.add(types.InlineKeyboardButton("➕ Добавить ответственное лицо",
+                                              callback_data=encode_callback("add_resp", object_id)))
+        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data=encode_callback("back_to_object", object_id)))
 
-        self.bot.send_message(chat_id, response, reply_markup=markup)
+        self.send_text(chat_id, response, reply_markup=markup)
 
-    def start_add_responsible_person(self, call, object_id: str):
+    def start_add_responsible_person(self, call, object_id: int):
         chat_id = call.message.chat.id
         user_data = self.get_user_data(chat_id)
 
         # Сохраняем данные для следующего шага
-        user_data.temp_object_id = object_id
+        user_data.conversation.put(ResponsibleDraft(object_id))
         self.set_user_state(chat_id, 'waiting_resp_name')
 
         self.bot.send_message(chat_id, "Введите ФИО ответственного лица:")
@@ -336,7 +369,9 @@ class ConstructionHandler(BaseHandler):
             return
 
         user_data = self.get_user_data(chat_id)
-        user_data.temp_resp_name = resp_name
+        draft = user_data.conversation.get(ResponsibleDraft)
+        if draft:
+            user_data.conversation.put(draft._replace(name=resp_name))
         self.set_user_state(chat_id, 'waiting_resp_position')
 
         self.bot.send_message(chat_id, "Введите должность ответственного лица:")
@@ -350,7 +385,9 @@ class ConstructionHandler(BaseHandler):
             return
 
         user_data = self.get_user_data(chat_id)
-        user_data.temp_resp_position = position
+        draft = user_data.conversation.get(ResponsibleDraft)
+        if draft:
+            user_data.conversation.put(draft._replace(position=position))
         self.set_user_state(chat_id, 'waiting_resp_phone')
 
         self.bot.send_message(chat_id, "Введите телефон ответственного лица:")
@@ -366,15 +403,14 @@ class ConstructionHandler(BaseHandler):
         user_data = self.get_user_data(chat_id)
 
         # Получаем сохраненные данные
-        object_id = getattr(user_data, 'temp_object_id', '')
-        resp_name = getattr(user_data, 'temp_resp_name', '')
-        position = getattr(user_data, 'temp_resp_position', '')
+        draft = user_data.conversation.get(ResponsibleDraft)
 
-        if not all([object_id, resp_name, position]):
+        if not draft or not all(draft):
             self.bot.send_message(chat_id, "❌ Ошибка: данные не найдены.")
             self.handle_construction_main(message)
             return
 
+        object_id, resp_name, position = draft
         obj = user_data.construction_manager.get_object(object_id)
 
         if obj:
@@ -385,11 +421,14 @@ class ConstructionHandler(BaseHandler):
                 phone=phone
             )
             obj.add_responsible_person(person)
+            user_data.construction_manager.touch()
+            self.bot.search_service.index_entity(chat_id, 'contact', person, obj)
+
+            # АВТОСОХРАНЕНИЕ
+            self._auto_save_user_data(chat_id)
 
             # Очищаем временные данные
-            for attr in ['temp_object_id', 'temp_resp_name', 'temp_resp_position']:
-                if hasattr(user_data, attr):
-                    delattr(user_data, attr)
+            user_data.conversation.drop(ResponsibleDraft, SelectedObject)
 
             self.bot.send_message(chat_id,
                                   f"✅ Ответственное лицо добавлено!\nФИО: {resp_name}\nДолжность: {position}\nТелефон: {phone}")
@@ -398,89 +437,83 @@ class ConstructionHandler(BaseHandler):
             self.bot.send_message(chat_id, "❌ Объект не найден.")
             self.handle_construction_main(message)
 
-    def handle_remove_responsible_person(self, call, object_id: str, person_index: int):
+    def handle_remove_responsible_person(self, call, object_id: int, person_index: int):
         chat_id = call.message.chat.id
         user_data = self.get_user_data(chat_id)
         obj = user_data.construction_manager.get_object(object_id)
 
+        persons = obj.responsible_persons if obj else []
+        person = persons[person_index] if 0 <= person_index < len(persons) else None
+
         if obj and obj.remove_responsible_person(person_index):
-            self.bot.answer_callback_query(call.id, "✅ Ответственное лицо удалено")
+            user_data.construction_manager.touch()
+            self.bot.search_service.remove_entity(chat_id, 'contact', person)
+            self._auto_save_user_data(chat_id)
+            self.answer_callback(call, "✅ Ответственное лицо удалено")
             self.handle_responsible_persons(call, object_id)
         else:
-            self.bot.answer_callback_query(call.id, "❌ Ошибка при удалении")
+            self.answer_callback(call, "❌ Ошибка при удалении")
 
-    def handle_construction_callback(self, call):
+    def handle_construction_callback(self, call, callback: CallbackData):
         chat_id = call.message.chat.id
-        data = call.data
+        action, args = callback
 
-        if data == "back_to_construction":
+        if action == "back_to_construction":
             self.bot.delete_message(chat_id, call.message.message_id)
             self.handle_construction_main(call.message)
             return
 
-        if data == "back_to_objects":
+        if action == "back_to_objects":
             self.bot.delete_message(chat_id, call.message.message_id)
             self.handle_manage_object_menu(call.message)
             return
 
-        if data.startswith("select_object:"):
-            object_id = data.split(":")[1]
-            self.handle_object_management(call, object_id)
+        if not args:
             return
+        object_id = args[0]
 
-        if data.startswith("back_to_object:"):
-            object_id = data.split(":")[1]
+        if action in ("select_object", "back_to_object"):
             self.handle_object_management(call, object_id)
             return
 
-        if data.startswith("obj_responsible:"):
-            object_id = data.split(":")[1]
+        if action == "obj_responsible":
             self.handle_responsible_persons(call, object_id)
             return
 
-        if data.startswith("obj_comments:"):
-            object_id = data.split(":")[1]
+        if action == "obj_comments":
             self.handle_comments(call, object_id)
             return
 
-        if data.startswith("view_comments:"):
-            _, object_id, stage_name = data.split(":")
-            self.handle_view_comments(call, object_id, stage_name)
+        if action == "view_comments" and len(args) > 1:
+            self.handle_view_comments(call, object_id, stage_from_index(args[1]))
             return
 
-        if data.startswith("add_comment:"):
-            parts = data.split(":")
-            object_id = parts[1]
-            stage_name = parts[2] if len(parts) > 2 else None
-            self.start_add_comment(call, object_id, stage_name)
+        if action == "add_comment":
+            stage = stage_from_index(args[1]) if len(args) > 1 else None
+            self.start_add_comment(call, object_id, stage.name if stage else None)
             return
 
-        if data.startswith("obj_next_stage:"):
-            object_id = data.split(":")[1]
+        if action == "obj_next_stage":
             self.handle_next_stage(call, object_id)
             return
 
-        if data.startswith("obj_complete:"):
-            object_id = data.split(":")[1]
+        if action == "obj_complete":
             self.handle_complete_object(call, object_id)
             return
 
-        if data.startswith("confirm_complete:"):
-            object_id = data.split(":")[1]
+        if action == "confirm_complete":
             self.handle_confirm_complete(call, object_id)
             return
 
-        if data.startswith("add_resp:"):
-            object_id = data.split(":")[1]
+        if action == "add_resp":
             self.start_add_responsible_person(call, object_id)
             return
 
-        if data.startswith("remove_resp:"):
-            _, object_id, person_index = data.split(":")
-            self.handle_remove_responsible_person(call, object_id, int(person_index))
+        if action == "remove_resp" and len(args) > 1:
+            self.handle_remove_responsible_person(call, object_id, args[1])
             return
 
-    def handle_comments(self, call, object_id: str):
+    def handle_comments(self, call, object_id: int):
         chat_id = call.message.chat.id
         user_data = self.get_user_data(chat_id)
         obj = user_data.construction_manager.get_object(object_id)
@@ -492,18 +525,19 @@ class ConstructionHandler(BaseHandler):
 
         # Показываем комментарии по этапам
         for stage in ConstructionStage:
-            comments = obj.comments[stage]
-            if comments:
-                button_text = f"💬 {stage.value} ({len(comments)})"
-                callback_data = f"view_comments:{object_id}:{stage.name}"
+            comments_count = obj.comment_log.count(stage)
+            if comments_count:
+                button_text = f"💬 {stage.value} ({comments_count})"
+                callback_data = encode_callback("view_comments", object_id, stage_index(stage))
                 markup.add(types.InlineKeyboardButton(button_text, callback_data=callback_data))
             else:
                 button_text = f"💬 {stage.value} (нет)"
-                callback_data = f"view_comments:{object_id}:{stage.name}"
+                callback_data = encode_callback("view_comments", object_id, stage_index(stage))
                 markup.add(types.InlineKeyboardButton(button_text, callback_data=callback_data))
 
-        markup.add(types.InlineKeyboardButton("➕ Добавить комментарий", callback_data=f"add_comment:{object_id}"))
-        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data=f"back_to_object:{object_id}"))
+        markup.add(types.InlineKeyboardButton("➕ Добавить комментарий",
+                                              callback_data=encode_callback("add_comment", object_id)))
+        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data=encode_callback("back_to_object", object_id)))
 
         response = f"💬 КОММЕНТАРИИ\n\nОбъект: {obj.name}\n\nВыберите этап для просмотра комментариев:"
         self.bot.edit_message_text(
@@ -513,31 +547,30 @@ class ConstructionHandler(BaseHandler):
             reply_markup=markup
         )
 
-    def handle_view_comments(self, call, object_id: str, stage_name: str):
+    def handle_view_comments(self, call, object_id: int, stage: Optional[ConstructionStage]):
         chat_id = call.message.chat.id
         user_data = self.get_user_data(chat_id)
         obj = user_data.construction_manager.get_object(object_id)
 
-        if not obj:
+        if not obj or stage is None:
             return
 
-        try:
-            stage = ConstructionStage[stage_name]
-        except KeyError:
-            return
-
-        comments = obj.comments[stage]
+        # Больше этого в одно редактируемое сообщение всё равно не влезет
+        comments = obj.comment_log.last(stage, COMMENTS_VIEW_LIMIT)
 
         markup = types.InlineKeyboardMarkup()
         markup.add(
-            types.InlineKeyboardButton("➕ Добавить комментарий", callback_data=f"add_comment:{object_id}:{stage.name}"))
-        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data=f"obj_comments:{object_id}"))
+            types.InlineKeyboardButton("➕ Добавить комментарий",
+                                       callback_data=encode_callback("add_comment", object_id, stage_index(stage))))
+        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data=encode_callback("obj_comments", object_id)))
 
+        header = [f"💬 КОММЕНТАРИИ - {stage.value}", "", f"Объект: {obj.name}", ""]
         if comments:
-            comments_text = "\n".join([f"• {comment}" for comment in comments])
-            response = f"💬 КОММЕНТАРИИ - {stage.value}\n\nОбъект: {obj.name}\n\n{comments_text}"
+            # Сообщение редактируется, поэтому показываем самые свежие комментарии, которые влезают
+            response = fit_message([f"• {comment.format()}" for comment in comments], header,
+                                   total=obj.comment_log.count(stage))
         else:
-            response = f"💬 КОММЕНТАРИИ - {stage.value}\n\nОбъект: {obj.name}\n\nНет комментариев"
+            response = "\n".join(header + ["Нет комментариев"])
 
         self.bot.edit_message_text(
             response,
@@ -546,13 +579,12 @@ class ConstructionHandler(BaseHandler):
             reply_markup=markup
         )
 
-    def start_add_comment(self, call, object_id: str, stage_name: str = None):
+    def start_add_comment(self, call, object_id: int, stage_name: str = None):
         chat_id = call.message.chat.id
         user_data = self.get_user_data(chat_id)
 
         # Сохраняем данные для следующего шага
-        user_data.temp_object_id = object_id
-        user_data.temp_stage_name = stage_name
+        user_data.conversation.put(StageCommentDraft(object_id, stage_name))
         self.set_user_state(chat_id, 'waiting_comment')
 
         if stage_name:
@@ -577,14 +609,14 @@ class ConstructionHandler(BaseHandler):
         user_data = self.get_user_data(chat_id)
 
         # Получаем сохраненные данные
-        object_id = getattr(user_data, 'temp_object_id', '')
-        stage_name = getattr(user_data, 'temp_stage_name', '')
+        draft = user_data.conversation.get(StageCommentDraft)
 
-        if not object_id:
+        if not draft:
             self.bot.send_message(chat_id, "❌ Ошибка: данные объекта не найдены.")
             self.handle_construction_main(message)
             return
 
+        object_id, stage_name = draft
         obj = user_data.construction_manager.get_object(object_id)
 
         if obj:
@@ -592,26 +624,29 @@ class ConstructionHandler(BaseHandler):
                 # Комментарий для конкретного этапа
                 try:
                     stage = ConstructionStage[stage_name]
-                    obj.add_comment(stage, comment)
+                    added = obj.add_comment(stage, comment, chat_id)
+                    self.bot.search_service.index_entity(chat_id, 'comment', added, obj)
                     self.bot.send_message(chat_id, f"✅ Комментарий добавлен к этапу '{stage.value}'!")
                 except KeyError:
                     self.bot.send_message(chat_id, "❌ Ошибка: этап не найден.")
             else:
                 # Комментарий для текущего этапа объекта
-                obj.add_comment(obj.current_stage, comment)
+                added = obj.add_comment(obj.current_stage, comment, chat_id)
+                self.bot.search_service.index_entity(chat_id, 'comment', added, obj)
                 self.bot.send_message(chat_id, f"✅ Комментарий добавлен к текущему этапу '{obj.current_stage.value}'!")
 
+            # АВТОСОХРАНЕНИЕ: комментарий дописывается в журнал объекта
+            self._auto_save_user_data(chat_id)
+
             # Очищаем временные данные
-            for attr in ['temp_object_id', 'temp_stage_name']:
-                if hasattr(user_data, attr):
-                    delattr(user_data, attr)
+            user_data.conversation.drop(StageCommentDraft, SelectedObject)
 
             self.handle_construction_main(message)
         else:
             self.bot.send_message(chat_id, "❌ Объект не найден.")
             self.handle_construction_main(message)
 
-    def handle_next_stage(self, call, object_id: str):
+    def handle_next_stage(self, call, object_id: int):
         chat_id = call.message.chat.id
         user_data = self.get_user_data(chat_id)
         obj = user_data.construction_manager.get_object(object_id)
@@ -620,12 +655,14 @@ class ConstructionHandler(BaseHandler):
             return
 
         if obj.move_to_next_stage():
-            self.bot.answer_callback_query(call.id, f"✅ Объект переведен на этап: {obj.current_stage.value}")
+            user_data.construction_manager.touch()
+            self._auto_save_user_data(chat_id)
+            self.answer_callback(call, f"✅ Объект переведен на этап: {obj.current_stage.value}")
             self.handle_object_management(call, object_id)
         else:
-            self.bot.answer_callback_query(call.id, "❌ Объект уже на последнем этапе")
+            self.answer_callback(call, "❌ Объект уже на последнем этапе")
 
-    def handle_complete_object(self, call, object_id: str):
+    def handle_complete_object(self, call, object_id: int):
         chat_id = call.message.chat.id
         user_data = self.get_user_data(chat_id)
         obj = user_data.construction_manager.get_object(object_id)
@@ -635,8 +672,8 @@ class ConstructionHandler(BaseHandler):
 
         markup = types.InlineKeyboardMarkup()
         markup.add(
-            types.InlineKeyboardButton("✅ Да, завершить", callback_data=f"confirm_complete:{object_id}"),
-            types.InlineKeyboardButton("❌ Нет, отменить", callback_data=f"back_to_object:{object_id}")
+            types.InlineKeyboardButton("✅ Да, завершить", callback_data=encode_callback("confirm_complete", object_id)),
+            types.InlineKeyboardButton("❌ Нет, отменить", callback_data=encode_callback("back_to_object", object_id))
         )
 
         response = f"⚠️ ПОДТВЕРЖДЕНИЕ\n\nВы уверены, что хотите завершить объект?\n\nОбъект: {obj.name}\nАдрес: {obj.address}\nТекущий этап: {obj.current_stage.value}"
@@ -648,7 +685,7 @@ class ConstructionHandler(BaseHandler):
             reply_markup=markup
         )
 
-    def handle_confirm_complete(self, call, object_id: str):
+    def handle_confirm_complete(self, call, object_id: int):
         chat_id = call.message.chat.id
         user_data = self.get_user_data(chat_id)
         obj = user_data.construction_manager.get_object(object_id)
@@ -657,5 +694,7 @@ class ConstructionHandler(BaseHandler):
             return
 
         obj.complete_object()
-        self.bot.answer_callback_query(call.id, "✅ Объект завершен!")
+        user_data.construction_manager.touch()
+        self._auto_save_user_data(chat_id)
+        self.answer_callback(call, "✅ Объект завершен!")
         self.handle_construction_main(call.message)
\ No newline at end of file
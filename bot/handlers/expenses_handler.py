@@ -1,7 +1,12 @@
 from telebot import types
 from .base_handler import BaseHandler
 from ..models.user_data import Expense
+from ..services.message_renderer import MessageBuilder, SectionTemplate
+from ..services.logging_service import get_logger
 
+logger = get_logger('expenses')
+
+CATEGORY_SECTION = SectionTemplate(None, lambda item: f"• {item[0]}: {item[1]}")
 
 class ExpensesHandler(BaseHandler):
     def __init__(self, bot, users_data):
@@ -59,13 +64,16 @@ class ExpensesHandler(BaseHandler):
         buttons = [types.KeyboardButton(category) for category in categories]
         markup.add(*buttons)
 
-        response = "👤 ЛИЧНЫЕ РАСХОДЫ\n\nВыберите категорию:\n\n"
-        for category, description in self.personal_categories.items():
-            response += f"• {category}: {description}\n"
-
-        response += "\nДля добавления расхода выберите категорию, затем введите:\nСумма Описание\nНапример: 1500 Книга по Python"
+        response = MessageBuilder("👤 ЛИЧНЫЕ РАСХОДЫ")
+        response.line("Выберите категорию:")
+        response.blank()
+        response.section(CATEGORY_SECTION, self.personal_categories.items())
+        response.blank()
+        response.line("Для добавления расхода выберите категорию, затем введите:")
+        response.line("Сумма Описание")
+        response.line("Например: 1500 Книга по Python")
 
-        self.bot.send_message(message.chat.id, response, reply_markup=markup)
+        self.send_text(message.chat.id, response, reply_markup=markup)
 
     def handle_work_expenses(self, message):
         self.set_user_state(message.chat.id, 'work_expenses_menu')
@@ -75,13 +83,16 @@ class ExpensesHandler(BaseHandler):
         buttons = [types.KeyboardButton(category) for category in categories]
         markup.add(*buttons)
 
-        response = "💼 РАБОЧИЕ РАСХОДЫ\n\nВыберите категорию:\n\n"
-        for category, description in self.work_categories.items():
-            response += f"• {category}: {description}\n"
+        response = MessageBuilder("💼 РАБОЧИЕ РАСХОДЫ")
+        response.line("Выберите категорию:")
+        response.blank()
+        response.section(CATEGORY_SECTION, self.work_categories.items())
+        response.blank()
+        response.line("Для добавления расхода выберите категорию, затем введите:")
+        response.line("Сумма Описание")
+        response.line("Например: 5000 Новый монитор")
 
-        response += "\nДля добавления расхода выберите категорию, затем введите:\nСумма Описание\nНапример: 5000 Новый монитор"
-
-        self.bot.send_message(message.chat.id, response, reply_markup=markup)
+        self.send_text(message.chat.id, response, reply_markup=markup)
 
     def handle_personal_category_selection(self, message):
         chat_id = message.chat.id
@@ -142,6 +153,7 @@ class ExpensesHandler(BaseHandler):
             expense = Expense(category, amount, description, expense_type)
             user_data = self.get_user_data(chat_id)
             user_data.add_expense(expense)
+            self.bot.search_service.index_entity(chat_id, 'expense', expense)
 
             # АВТОСОХРАНЕНИЕ после добавления расхода
             self._auto_save_user_data(chat_id)
@@ -163,9 +175,6 @@ class ExpensesHandler(BaseHandler):
         """Автосохранение данных пользователя"""
         try:
             user_data = self.get_user_data(chat_id)
-            # Импортируем сервис хранения
-            from ..services.storage_service import JSONStorageService
-            storage = JSONStorageService()
-            storage.save_user_data(user_data)
+            self.bot.storage_service.save_user_data(user_data)
         except Exception as e:
-            print(f"Ошибка автосохранения: {e}")
\ No newline at end of file
+            logger.exception("Ошибка автосохранения: %s", e, extra={'chat_id': chat_id})
\ No newline at end of file
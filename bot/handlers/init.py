@@ -2,4 +2,5 @@ from .expenses_handler import ExpensesHandler
 from .report_handler import ReportHandler
 from .timesheet_handler import TimesheetHandler
 from .construction_handler import ConstructionHandler
-from .running_list_handler import RunningListHandler  # ДОБАВЛЯЕМ
\ No newline at end of file
+from .running_list_handler import RunningListHandler  # ДОБАВЛЯЕМ
+from .search_handler import SearchHandler
@@ -2,16 +2,38 @@ import os
 from datetime import datetime, timedelta
 from telebot import types
 from .base_handler import BaseHandler
+from ..services.message_renderer import MessageBuilder
+from ..services.storage_schema import snapshot_segment
+
+# Как часто (в записях) отчет отмечает ход работы и проверяет отмену
+REPORT_PROGRESS_EVERY = 500
 
 
 class ReportHandler(BaseHandler):
     def __init__(self, bot, users_data):
         super().__init__(bot, users_data)
 
-    def create_expense_report(self, chat_id, period_days=30):
-        user_data = self.get_user_data(chat_id)
-        recent_expenses = user_data.get_expenses_by_period(period_days)
-
+    def handle_expense_report(self, message, period_days: int):
+        """Отчет за период формируется фоновой задачей; файл придет отдельным сообщением"""
+        chat_id = message.chat.id
+        book = snapshot_segment(self.get_user_data(chat_id).expense_book)
+        self.bot.jobs.submit(chat_id, 'expense_report', "Отчет по расходам",
+                             lambda job: self._send_expense_report(job, book, period_days))
+
+    def _send_expense_report(self, job, book, period_days: int):
+        filename, report_text = self.create_expense_report(job.chat_id, book.get_expenses_by_period(period_days),
+                                                           period_days, job)
+        if not filename:
+            return f"❌ {report_text}"
+        try:
+            job.check()
+            with open(filename, 'rb') as f:
+                self.bot.send_document(job.chat_id, f, caption=report_text)
+        finally:
+            os.remove(filename)
+        return "✅ Отчет по расходам готов"
+
+    def create_expense_report(self, chat_id, recent_expenses, period_days=30, job=None):
         if not recent_expenses:
             return None, f"За последние {period_days} дней расходов не найдено."
 
@@ -25,30 +47,41 @@ class ReportHandler(BaseHandler):
 
         filename = f"expense_report_{chat_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
 
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(f"ОТЧЕТ ПО РАСХОДАМ\n")
-            f.write(f"Период: последние {period_days} дней\n")
-            f.write(f"Дата формирования: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n")
-            f.write("=" * 50 + "\n\n")
-
-            f.write(f"ОБЩАЯ СУММА: {total_amount} руб.\n\n")
-
-            f.write("РАСХОДЫ ПО КАТЕГОРИЯМ:\n")
-            for category, amount in sorted(categories.items(), key=lambda x: x[1], reverse=True):
-                percentage = (amount / total_amount) * 100
-                f.write(f"{category}: {amount} руб. ({percentage:.1f}%)\n")
-
-            f.write("\nДЕТАЛИЗАЦИЯ:\n")
-            for exp in sorted(recent_expenses, key=lambda x: x.date, reverse=True):
-                date_str = exp.date.strftime('%d.%m.%Y')
-                f.write(f"{date_str} | {exp.category} | {exp.amount} руб. | {exp.description}\n")
-
-        report_text = f"📊 ОТЧЕТ ПО РАСХОДАМ\n\nПериод: последние {period_days} дней\nОбщая сумма: {total_amount} руб.\n\nОсновные категории:\n"
+        try:
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write(f"ОТЧЕТ ПО РАСХОДАМ\n")
+                f.write(f"Период: последние {period_days} дней\n")
+                f.write(f"Дата формирования: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n")
+                f.write("=" * 50 + "\n\n")
+
+                f.write(f"ОБЩАЯ СУММА: {total_amount} руб.\n\n")
+
+                f.write("РАСХОДЫ ПО КАТЕГОРИЯМ:\n")
+                for category, amount in sorted(categories.items(), key=lambda x: x[1], reverse=True):
+                    percentage = (amount / total_amount) * 100
+                    f.write(f"{category}: {amount} руб. ({percentage:.1f}%)\n")
+
+                f.write("\nДЕТАЛИЗАЦИЯ:\n")
+                for i, exp in enumerate(sorted(recent_expenses, key=lambda x: x.timestamp, reverse=True)):
+                    if job is not None and i % REPORT_PROGRESS_EVERY == 0:
+                        job.progress(f"записей {i} из {len(recent_expenses)}")
+                    date_str = exp.date.strftime('%d.%m.%Y')
+                    f.write(f"{date_str} | {exp.category} | {exp.amount} руб. | {exp.description}\n")
+        except BaseException:
+            # Отмена (JobCancelled) или ошибка записи: недописанный файл не нужен
+            os.remove(filename)
+            raise
+
+        report_text = MessageBuilder("📊 ОТЧЕТ ПО РАСХОДАМ")
+        report_text.line(f"Период: последние {period_days} дней")
+        report_text.line(f"Общая сумма: {total_amount} руб.")
+        report_text.blank()
+        report_text.line("Основные категории:")
         for category, amount in sorted(categories.items(), key=lambda x: x[1], reverse=True)[:5]:
             percentage = (amount / total_amount) * 100
-            report_text += f"• {category}: {amount} руб. ({percentage:.1f}%)\n"
+            report_text.line(f"• {category}: {amount} руб. ({percentage:.1f}%)")
 
-        return filename, report_text
+        return filename, report_text.build()
 
     def handle_calculate_expenses(self, message):
         chat_id = message.chat.id
@@ -66,9 +99,12 @@ class ReportHandler(BaseHandler):
 
     def handle_clear_data(self, message):
         chat_id = message.chat.id
-        user_data = self.get_user_data(chat_id)
+        book = self.get_user_data(chat_id).expense_book
+        # Архив не читается: для подтверждения хватает числа записей
+        archived = len(book.archive)
+        total_expenses = len(book.expenses) + archived
 
-        if not user_data.expenses:
+        if not total_expenses:
             self.bot.send_message(chat_id, "❌ Нет данных для очистки. Расходы отсутствуют.")
             return
 
@@ -77,14 +113,19 @@ class ReportHandler(BaseHandler):
         btn_no = types.KeyboardButton('НЕТ, отменить')
         markup.add(btn_yes, btn_no)
 
-        total_expenses = len(user_data.expenses)
-        total_amount = user_data.get_total_expenses()
-        dates = [exp.date for exp in user_data.expenses]
-
-        response = f"⚠️ **ПОДТВЕРЖДЕНИЕ ОЧИСТКИ ДАННЫХ**\n\nВы собираетесь удалить ВСЕ данные по расходам:\n\n📊 Статистика:\n• Количество записей: {total_expenses}\n• Общая сумма: {total_amount} руб.\n• Период: с {min(dates).strftime('%d.%m.%Y')} по {max(dates).strftime('%d.%m.%Y')}\n\n❓ **Вы уверены, что хотите удалить все данные?**\nЭта операция необратима!\n\nВыберите действие:"
+        response = f"⚠️ **ПОДТВЕРЖДЕНИЕ ОЧИСТКИ ДАННЫХ**\n\nВы собираетесь удалить ВСЕ данные по расходам:\n\n📊 Статистика:\n• Количество записей: {total_expenses}\n• Из них в архиве: {archived}\n\n❓ **Вы уверены, что хотите удалить все данные?**\nЭта операция необратима!\n\nВыберите действие:"
         self.bot.send_message(chat_id, response, reply_markup=markup)
         self.set_user_state(chat_id, 'waiting_clear_confirmation')
 
+    def handle_execute_clear_data(self, message):
+        """Очистка - в потоке апдейта: журнал архива не читается, а удаляется целиком"""
+        chat_id = message.chat.id
+        deleted_count = self.execute_clear_data(chat_id)
+        self.bot.send_message(chat_id, f"✅ Все данные по расходам удалены!\nУдалено записей: {deleted_count}")
+
     def execute_clear_data(self, chat_id):
         user_data = self.get_user_data(chat_id)
-        return user_data.clear_expenses()
\ No newline at end of file
+        self.bot.search_service.remove_kind(chat_id, 'expense')
+        deleted_count = user_data.clear_expenses()
+        self.bot.storage_service.save_user_data(user_data)
+        return deleted_count
\ No newline at end of file
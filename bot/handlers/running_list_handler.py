@@ -1,6 +1,60 @@
+import re
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional
+
 from telebot import types
 from .base_handler import BaseHandler
 from ..models.running_list import RunningTask, TaskPriority
+from ..models.conversation import TaskDraft
+from ..services.callback_codec import CallbackData, encode_callback, priority_index, priority_from_index
+from ..services.message_renderer import MessageBuilder, SectionTemplate
+from ..services.logging_service import get_logger
+
+logger = get_logger('running_list')
+
+# Срок без времени - на начало рабочего дня
+DUE_TIME = time(9, 0)
+NO_DUE_DATE = 'без срока'
+_DUE_DATE_RE = re.compile(r'^(?:(сегодня|завтра)|(\d{1,2})\.(\d{1,2})(?:\.(\d{2}|\d{4}))?)(?:\s+(\d{1,2})[:.](\d{2}))?$')
+
+
+def parse_due_date(text: str, now: datetime) -> Optional[datetime]:
+    """Срок задачи из "дд.мм[.гггг] [чч:мм]" или "сегодня/завтра [чч:мм]"; None - не разобран"""
+    match = _DUE_DATE_RE.match(text.strip().lower())
+    if not match:
+        return None
+    word, day, month, year, hour, minute = match.groups()
+    try:
+        at = time(int(hour), int(minute)) if hour else DUE_TIME
+        if word:
+            return datetime.combine(now.date() + timedelta(days=1 if word == 'завтра' else 0), at)
+        if year:
+            return datetime.combine(date(int(year) + (2000 if len(year) == 2 else 0), int(month), int(day)), at)
+        due = datetime.combine(date(now.year, int(month), int(day)), at)
+        # Без года - ближайшая такая дата
+        return due if due > now else due.replace(year=now.year + 1)
+    except ValueError:
+        return None
+
+
+def _format_due(task) -> str:
+    return f" ⏰ {task.due_date.strftime('%d.%m %H:%M')}" if task.due_date else ""
+
+
+def _format_completed_task(i, task):
+    completed_date = task.completed_date.strftime('%d.%m.%Y %H:%M') if task.completed_date else "неизвестно"
+    return (
+        f"{i}. {task.description}",
+        f"   🎯 {task.priority.value} | ✅ {completed_date}",
+        "",
+    )
+
+
+PRIORITY_SECTION = SectionTemplate("{priority}:", lambda i, task: f"{i}. {task.description}{_format_due(task)}",
+                                   numbered=True)
+COMMAND_NUMBERING_SECTION = SectionTemplate("Нумерация для команд:", lambda i, task: f"{i}. {task.description}",
+                                            numbered=True)
+COMPLETED_SECTION = SectionTemplate(None, _format_completed_task, numbered=True)
 
 
 class RunningListHandler(BaseHandler):
@@ -19,7 +73,7 @@ class RunningListHandler(BaseHandler):
 
         user_data = self.get_user_data(message.chat.id)
         active_count = len(user_data.running_list.get_active_tasks())
-        completed_count = len(user_data.running_list.get_completed_tasks())
+        completed_count = user_data.running_list.completed_count()
 
         response = f"""
 📋 Раздел: RUNNING LIST
@@ -57,88 +111,146 @@ class RunningListHandler(BaseHandler):
             return
 
         user_data = self.get_user_data(chat_id)
-        user_data.temp_task_description = description
+        user_data.conversation.put(TaskDraft(description))
         self.set_user_state(chat_id, 'waiting_task_priority')
 
         markup = types.InlineKeyboardMarkup(row_width=2)
         markup.add(
-            types.InlineKeyboardButton("🔵 Низкий", callback_data="priority:LOW"),
-            types.InlineKeyboardButton("🟡 Средний", callback_data="priority:MEDIUM"),
-            types.InlineKeyboardButton("🔴 Высокий", callback_data="priority:HIGH"),
-            types.InlineKeyboardButton("⚡ Срочный", callback_data="priority:URGENT")
+            *[types.InlineKeyboardButton(priority.value,
+                                         callback_data=encode_callback("priority", priority_index(priority)))
+              for priority in TaskPriority]
         )
 
         response = f"📝 Задача: {description}\n\nВыберите приоритет:"
         self.bot.send_message(chat_id, response, reply_markup=markup)
 
-    def handle_running_list_callback(self, call):
+    def handle_running_list_callback(self, call, callback: CallbackData):
         chat_id = call.message.chat.id
-        data = call.data
+        action, args = callback
 
-        print(f"DEBUG: Running list callback получен: {data}")
+        logger.debug("Running list callback получен: %s %s", action, args, extra={'chat_id': chat_id})
 
-        if data.startswith("priority:"):
-            priority_name = data.split(":")[1]
-            print(f"DEBUG: Обработка приоритета: {priority_name}")
+        if action == "priority" and args:
+            priority = priority_from_index(args[0])
+            priority_name = priority.name if priority else ""
+            logger.debug("Обработка приоритета: %s", priority_name, extra={'chat_id': chat_id})
             self.handle_priority_selection(call, priority_name)
         else:
-            print(f"DEBUG: Неизвестный callback: {data}")
+            logger.warning("Неизвестный callback: %s", action, extra={'chat_id': chat_id})
 
     def handle_priority_selection(self, call, priority_name: str):
         chat_id = call.message.chat.id
         user_data = self.get_user_data(chat_id)
 
-        print(f"DEBUG: handle_priority_selection вызван с priority_name: {priority_name}")
-        print(f"DEBUG: temp_task_description: {getattr(user_data, 'temp_task_description', 'НЕ НАЙДЕНО')}")
+        draft = user_data.conversation.get(TaskDraft)
+        logger.debug("handle_priority_selection вызван с priority_name: %s, task_description: %s", priority_name,
+                     draft.description if draft else 'НЕ НАЙДЕНО', extra={'chat_id': chat_id})
+
+        if priority_name not in TaskPriority.__members__:
+            logger.warning("Неверный приоритет: %s", priority_name, extra={'chat_id': chat_id})
+            self.bot.send_message(chat_id, "❌ Ошибка: неверный приоритет.")
+            self.handle_running_list_main(call.message)
+            return
+
+        if not draft or not draft.description:
+            logger.warning("Описание задачи не найдено", extra={'chat_id': chat_id})
+            self.bot.send_message(chat_id, "❌ Ошибка: описание задачи не найдено.")
+            self.handle_running_list_main(call.message)
+            return
+
+        user_data.conversation.put(draft._replace(priority=priority_name))
+        self.set_user_state(chat_id, 'waiting_task_due_date')
 
+        # Удаляем сообщение с кнопками приоритета
         try:
-            priority = TaskPriority[priority_name]
-            description = getattr(user_data, 'temp_task_description', '')
+            self.bot.delete_message(chat_id, call.message.message_id)
+        except:
+            pass
 
-            if not description:
-                print(f"DEBUG: Ошибка - описание задачи не найдено")
-                self.bot.send_message(chat_id, "❌ Ошибка: описание задачи не найдено.")
-                self.handle_running_list_main(call.message)
-                return
+        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+        markup.add(types.KeyboardButton(NO_DUE_DATE), types.KeyboardButton('назад'))
+
+        self.bot.send_message(
+            chat_id,
+            f"📝 Задача: {draft.description}\n"
+            f"🎯 Приоритет: {TaskPriority[priority_name].value}\n\n"
+            f"📅 Введите срок: дд.мм.гггг чч:мм, дд.мм или \"завтра 10:00\"\n"
+            f"(без времени - {DUE_TIME.strftime('%H:%M')}), либо нажмите «{NO_DUE_DATE}»",
+            reply_markup=markup
+        )
 
-            # Добавляем задачу
-            task = user_data.running_list.add_task(description, priority)
-            print(f"DEBUG: Задача добавлена: {task.description} с приоритетом {task.priority.value}")
-
-            # АВТОСОХРАНЕНИЕ после добавления задачи
-            self._auto_save_user_data(chat_id)
-
-            # Очищаем временные данные
-            if hasattr(user_data, 'temp_task_description'):
-                delattr(user_data, 'temp_task_description')
-
-            # Удаляем сообщение с кнопками приоритета
-            try:
-                self.bot.delete_message(chat_id, call.message.message_id)
-            except:
-                pass
-
-            self.bot.send_message(
-                chat_id,
-                f"✅ Задача добавлена!\n"
-                f"📝 {task.description}\n"
-                f"🎯 Приоритет: {task.priority.value}"
-            )
-            self.handle_running_list_main(call.message)
+    def handle_task_due_date_input(self, message):
+        chat_id = message.chat.id
+        text = message.text.strip()
+        user_data = self.get_user_data(chat_id)
 
-        except KeyError:
-            print(f"DEBUG: Ошибка - неверный приоритет: {priority_name}")
-            self.bot.send_message(chat_id, "❌ Ошибка: неверный приоритет.")
-            self.handle_running_list_main(call.message)
+        if text == 'назад':
+            user_data.conversation.drop(TaskDraft)
+            self.handle_running_list_main(message)
+            return
+
+        draft = user_data.conversation.get(TaskDraft)
+        if not draft or not draft.priority:
+            logger.warning("Черновик задачи не найден", extra={'chat_id': chat_id})
+            self.bot.send_message(chat_id, "❌ Ошибка: описание задачи не найдено.")
+            self.handle_running_list_main(message)
+            return
+
+        due_date = None
+        if text.lower() != NO_DUE_DATE:
+            now = datetime.now()
+            due_date = parse_due_date(text, now)
+            if due_date is None:
+                self.bot.send_message(chat_id, "❌ Не понял срок. Пример: 25.12.2025 18:00, 25.12 или завтра 10:00")
+                return
+            if due_date <= now:
+                self.bot.send_message(chat_id, "❌ Срок уже прошел. Введите будущую дату")
+                return
+
+        # Добавляем задачу
+        task = user_data.running_list.add_task(draft.description, TaskPriority[draft.priority], due_date)
+        logger.debug("Задача добавлена: %s с приоритетом %s", task.description, task.priority.value, extra={'chat_id': chat_id})
+        self.bot.search_service.index_entity(chat_id, 'task', task)
+        # Напоминание о сроке
+        self.bot.task_reminders.add(user_data, task)
+
+        # АВТОСОХРАНЕНИЕ после добавления задачи
+        self._auto_save_user_data(chat_id)
+
+        # Очищаем временные данные
+        user_data.conversation.drop(TaskDraft)
+
+        due_line = f"\n⏰ Срок: {due_date.strftime('%d.%m.%Y %H:%M')}" if due_date else ""
+        self.bot.send_message(
+            chat_id,
+            f"✅ Задача добавлена!\n"
+            f"📝 {task.description}\n"
+            f"🎯 Приоритет: {task.priority.value}"
+            f"{due_line}"
+        )
+        self.handle_running_list_main(message)
+
+    def send_due_reminders(self, chat_id: int, tasks: List[RunningTask]):
+        """Напоминание о наступивших сроках (TaskReminders, поток планировщика)"""
+        active = self.get_user_data(chat_id).running_list.get_active_tasks()
+        numbers = {task.id: i for i, task in enumerate(active, 1)}
+        lines = ["⏰ Наступил срок задач:" if len(tasks) > 1 else "⏰ Наступил срок задачи:"]
+        for task in tasks:
+            lines.append(f"{numbers.get(task.id, '•')}. {task.description} ({task.priority.value},"
+                         f" до {task.due_date.strftime('%d.%m %H:%M')})")
+        lines.append("")
+        lines.append("✅ Для завершения задачи введите: /done <номер задачи>")
+        self.bot.send_message(chat_id, "\n".join(lines))
 
     def _auto_save_user_data(self, chat_id: int):
         """Автосохранение данных пользователя"""
         try:
             user_data = self.get_user_data(chat_id)
             self.bot.storage_service.save_user_data(user_data)
-            print(f"DEBUG: Данные пользователя {chat_id} автосохранены")
+            logger.debug("Данные пользователя %s автосохранены", chat_id, extra={'chat_id': chat_id})
         except Exception as e:
-            print(f"DEBUG: Ошибка автосохранения: {e}")
+            logger.exception("Ошибка автосохранения: %s", e, extra={'chat_id': chat_id})
+
     def handle_view_tasks(self, message):
         chat_id = message.chat.id
         user_data = self.get_user_data(chat_id)
@@ -151,25 +263,24 @@ class RunningListHandler(BaseHandler):
             self.bot.send_message(chat_id, response)
             return
 
-        response = "📋 АКТИВНЫЕ ЗАДАЧИ\n\n"
+        response = MessageBuilder("📋 АКТИВНЫЕ ЗАДАЧИ")
 
         # Группируем по приоритетам
         for priority in TaskPriority:
             tasks_by_priority = [t for t in active_tasks if t.priority == priority]
             if tasks_by_priority:
-                response += f"\n{priority.value}:\n"
-                for i, task in enumerate(tasks_by_priority, 1):
-                    response += f"{i}. {task.description}\n"
+                response.blank()
+                response.section(PRIORITY_SECTION, tasks_by_priority, priority=priority.value)
 
-        response += f"\n✅ Для завершения задачи введите: /done <номер задачи>"
-        response += f"\n🗑️ Для удаления задачи введите: /delete <номер задачи>"
+        response.blank()
+        response.line("✅ Для завершения задачи введите: /done <номер задачи>")
+        response.line("🗑️ Для удаления задачи введите: /delete <номер задачи>")
 
         # Показываем нумерованный список для команд
-        response += f"\n\nНумерация для команд:"
-        for i, task in enumerate(active_tasks, 1):
-            response += f"\n{i}. {task.description}"
+        response.blank()
+        response.section(COMMAND_NUMBERING_SECTION, active_tasks)
 
-        self.bot.send_message(chat_id, response)
+        self.send_text(chat_id, response)
 
     def handle_completed_tasks(self, message):
         chat_id = message.chat.id
@@ -183,23 +294,18 @@ class RunningListHandler(BaseHandler):
             self.bot.send_message(chat_id, response)
             return
 
-        response = "✅ ВЫПОЛНЕННЫЕ ЗАДАЧИ\n\n"
-
-        for i, task in enumerate(completed_tasks, 1):
-            completed_date = task.completed_date.strftime('%d.%m.%Y %H:%M') if task.completed_date else "неизвестно"
-            response += f"{i}. {task.description}\n"
-            response += f"   🎯 {task.priority.value} | ✅ {completed_date}\n\n"
-
-        response += f"🔄 Для reopening задачи введите: /reopen <номер задачи>"
+        response = MessageBuilder("✅ ВЫПОЛНЕННЫЕ ЗАДАЧИ")
+        response.section(COMPLETED_SECTION, completed_tasks)
+        response.line("🔄 Для reopening задачи введите: /reopen <номер задачи>")
 
-        self.bot.send_message(chat_id, response)
+        self.send_text(chat_id, response)
 
     def handle_complete_task(self, message, task_number: str):
         chat_id = message.chat.id
         user_data = self.get_user_data(chat_id)
         running_list = user_data.running_list
 
-        print(f"DEBUG: handle_complete_task вызван с номером: '{task_number}'")
+        logger.debug("handle_complete_task вызван с номером: '%s'", task_number, extra={'chat_id': chat_id})
 
         try:
             task_index = int(task_number) - 1
@@ -207,7 +313,7 @@ class RunningListHandler(BaseHandler):
 
             if 0 <= task_index < len(active_tasks):
                 task = active_tasks[task_index]
-                task.complete()
+                running_list.complete_task(task)
 
                 # АВТОСОХРАНЕНИЕ
                 self._auto_save_user_data(chat_id)
@@ -229,7 +335,7 @@ class RunningListHandler(BaseHandler):
         user_data = self.get_user_data(chat_id)
         running_list = user_data.running_list
 
-        print(f"DEBUG: handle_delete_task вызван с номером: '{task_number}'")
+        logger.debug("handle_delete_task вызван с номером: '%s'", task_number, extra={'chat_id': chat_id})
 
         try:
             task_index = int(task_number) - 1
@@ -238,6 +344,7 @@ class RunningListHandler(BaseHandler):
             if 0 <= task_index < len(active_tasks):
                 task = active_tasks[task_index]
                 running_list.delete_task(task.id)
+                self.bot.search_service.remove_entity(chat_id, 'task', task)
 
                 # АВТОСОХРАНЕНИЕ
                 self._auto_save_user_data(chat_id)
@@ -259,7 +366,7 @@ class RunningListHandler(BaseHandler):
         user_data = self.get_user_data(chat_id)
         running_list = user_data.running_list
 
-        print(f"DEBUG: handle_reopen_task вызван с номером: '{task_number}'")
+        logger.debug("handle_reopen_task вызван с номером: '%s'", task_number, extra={'chat_id': chat_id})
 
         try:
             task_index = int(task_number) - 1
@@ -267,7 +374,9 @@ class RunningListHandler(BaseHandler):
 
             if 0 <= task_index < len(completed_tasks):
                 task = completed_tasks[task_index]
-                task.reopen()
+                running_list.reopen_task(task)
+                # Срок еще не наступил - напоминание снова в силе
+                self.bot.task_reminders.add(user_data, task)
 
                 # АВТОСОХРАНЕНИЕ
                 self._auto_save_user_data(chat_id)
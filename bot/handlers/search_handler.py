@@ -0,0 +1,120 @@
+from telebot import types
+from .base_handler import BaseHandler
+from ..models.conversation import SearchQuery
+from ..services.callback_codec import CallbackData, encode_callback
+from ..services.message_renderer import MessageBuilder
+from ..services.search_service import SEARCH_PAGE_SIZE, SearchDocument
+from ..services.tracing_service import traced_update
+
+
+def format_document(document: SearchDocument) -> str:
+    entity = document.entity
+    if document.kind == 'task':
+        status = " ✅" if entity.is_completed else ""
+        return f"📋 {entity.description} ({entity.priority.value}){status}"
+    if document.kind == 'expense':
+        return f"💸 {entity.date.strftime('%d.%m.%Y')} {entity.category}: {entity.amount} руб. — {entity.description}"
+    if document.kind == 'object':
+        status = " ✅ завершен" if entity.is_completed else f" — {entity.current_stage.value}"
+        return f"🏗 {entity.name} ({entity.address}){status}"
+    if document.kind == 'contact':
+        return f"👤 {entity.name}, {entity.position}, {entity.phone} — {document.owner.name}"
+    if document.kind == 'comment':
+        return f"💬 {document.owner.name} / {entity.stage.value}: {entity.format()}"
+    return str(entity)
+
+
+KIND_TITLES = {
+    'task': "Задача",
+    'expense': "Расход",
+    'object': "Объект",
+    'contact': "Контакт",
+    'comment': "Комментарий",
+}
+
+
+class SearchHandler(BaseHandler):
+    def __init__(self, bot, users_data):
+        super().__init__(bot, users_data)
+
+    def handle_find(self, message, query: str):
+        chat_id = message.chat.id
+        query = query.strip()
+
+        if not query:
+            self.bot.send_message(chat_id, "🔎 Используйте: /find <текст>\nНапример: /find цемент")
+            return
+
+        user_data = self.get_user_data(chat_id)
+        user_data.conversation.put(SearchQuery(query))
+
+        response, markup = self._render_page(chat_id, query, 0)
+        self.bot.send_message(chat_id, response, reply_markup=markup)
+
+    def handle_find_page_callback(self, call, callback: CallbackData):
+        chat_id = call.message.chat.id
+        user_data = self.get_user_data(chat_id)
+        search = user_data.conversation.get(SearchQuery)
+        query = search.query if search else None
+
+        if not query or not callback.args:
+            self.answer_callback(call, "❌ Поиск устарел, повторите /find")
+            return
+
+        response, markup = self._render_page(chat_id, query, callback.args[0])
+        self.bot.edit_message_text(
+            response,
+            chat_id=chat_id,
+            message_id=call.message.message_id,
+            reply_markup=markup
+        )
+
+    def _render_page(self, chat_id: int, query: str, page: int):
+        hits, total = self.bot.search_service.search(chat_id, query, page * SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE)
+
+        response = MessageBuilder(f"🔎 ПОИСК: {query}")
+        if not hits:
+            response.line("❌ Ничего не найдено")
+            return response.build(), None
+
+        pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+        response.line(f"Найдено: {total} (страница {page + 1} из {pages})")
+        response.blank()
+        first = page * SEARCH_PAGE_SIZE + 1
+        response.lines(f"{i}. {format_document(hit.document)}" for i, hit in enumerate(hits, first))
+
+        markup = None
+        if pages > 1:
+            markup = types.InlineKeyboardMarkup(row_width=2)
+            buttons = []
+            if page > 0:
+                buttons.append(types.InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("find_page", page - 1)))
+            if page + 1 < pages:
+                buttons.append(types.InlineKeyboardButton("Далее ▶️", callback_data=encode_callback("find_page", page + 1)))
+            markup.add(*buttons)
+
+        # Страница - не больше 10 коротких строк, в одно сообщение помещается всегда
+        return response.build(), markup
+
+    @traced_update('inline_query')
+    def handle_inline_query(self, inline_query):
+        # В личном чате chat_id совпадает с id пользователя
+        chat_id = inline_query.from_user.id
+        offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+
+        hits, total = self.bot.search_service.search(chat_id, inline_query.query, offset, SEARCH_PAGE_SIZE)
+
+        results = []
+        for hit in hits:
+            text = format_document(hit.document)
+            results.append(types.InlineQueryResultArticle(
+                id=str(hit.document.key),
+                title=KIND_TITLES.get(hit.document.kind, "Найдено"),
+                description=text,
+                input_message_content=types.InputTextMessageContent(text)
+            ))
+
+        next_offset = str(offset + len(hits)) if offset + len(hits) < total else ""
+        self.bot.answer_inline_query(
+            inline_query.id, results, cache_time=0, is_personal=True, next_offset=next_offset
+        )
@@ -1,7 +1,16 @@
+from collections import Counter
 from datetime import date
+from typing import List
 from telebot import types
 from .base_handler import BaseHandler
 from ..models.timesheet import Employee
+from ..models.conversation import EmployeeDraft
+from ..services.callback_codec import CallbackData, encode_callback
+from ..services.message_renderer import MessageBuilder
+from ..services.storage_schema import snapshot_segment
+from ..services.logging_service import get_logger
+
+logger = get_logger('timesheet')
 
 
 class TimesheetHandler(BaseHandler):
@@ -55,7 +64,7 @@ class TimesheetHandler(BaseHandler):
 
         # Сохраняем имя и запрашиваем зарплату
         user_data = self.get_user_data(chat_id)
-        user_data.temp_employee_name = employee_name
+        user_data.conversation.put(EmployeeDraft(employee_name))
         self.set_user_state(chat_id, 'waiting_employee_salary')
 
         response = f"👤 Работник: {employee_name}\n\nВведите дневную ставку (зарплата за один день):"
@@ -71,7 +80,8 @@ class TimesheetHandler(BaseHandler):
                 raise ValueError("Зарплата должна быть положительным числом")
 
             user_data = self.get_user_data(chat_id)
-            employee_name = getattr(user_data, 'temp_employee_name', '')
+            draft = user_data.conversation.get(EmployeeDraft)
+            employee_name = draft.name if draft else ''
 
             if not employee_name:
                 self.bot.send_message(chat_id, "❌ Ошибка: данные работника не найдены.")
@@ -79,16 +89,15 @@ class TimesheetHandler(BaseHandler):
                 return
 
             # Добавляем работника
-            from ..models.timesheet import Employee
-            employee = Employee(name=employee_name, daily_salary=daily_salary)
-            user_data.timesheet.employees[employee.id] = employee
+            employee = user_data.timesheet.add_employee(employee_name, daily_salary)
+            # Блокировка отметок в конце дня и закрытие периодов
+            self.bot.timesheet_timers.ensure(user_data)
 
             # АВТОСОХРАНЕНИЕ после добавления работника
             self._auto_save_user_data(chat_id)
 
             # Очищаем временные данные
-            if hasattr(user_data, 'temp_employee_name'):
-                delattr(user_data, 'temp_employee_name')
+            user_data.conversation.drop(EmployeeDraft)
 
             self.bot.send_message(chat_id,
                                   f"✅ Работник добавлен!\nФИО: {employee.name}\nДневная ставка: {daily_salary} руб.")
@@ -101,11 +110,9 @@ class TimesheetHandler(BaseHandler):
         """Автосохранение данных пользователя"""
         try:
             user_data = self.get_user_data(chat_id)
-            from ..services.storage_service import JSONStorageService
-            storage = JSONStorageService()
-            storage.save_user_data(user_data)
+            self.bot.storage_service.save_user_data(user_data)
         except Exception as e:
-            print(f"Ошибка автосохранения: {e}")
+            logger.exception("Ошибка автосохранения: %s", e, extra={'chat_id': chat_id})
 
     def handle_manage_attendance(self, message):
         chat_id = message.chat.id
@@ -130,78 +137,89 @@ class TimesheetHandler(BaseHandler):
 
     def _show_attendance_keyboard(self, chat_id: int, work_date: date):
         user_data = self.get_user_data(chat_id)
-        employees = user_data.timesheet.get_all_employees()
 
+        response = f"""
+📝 УЧЕТ ПРИСУТСТВИЯ
+
+Дата: {work_date.strftime('%d.%m.%Y')}
+
+Отметьте присутствующих работников:
+• ✅ - присутствовал
+• ❌ - отсутствовал
+
+После отметки нажмите "Сохранить"
+"""
+        self.bot.send_message(chat_id, response, reply_markup=self._attendance_markup(user_data, work_date))
+
+    def _attendance_markup(self, user_data, work_date: date) -> types.InlineKeyboardMarkup:
         markup = types.InlineKeyboardMarkup()
 
-        for employee in employees:
+        for employee in user_data.timesheet.get_all_employees():
             # Получаем текущий статус присутствия
             attendance_status = "✅" if self._is_employee_present_today(user_data, employee.id, work_date) else "❌"
 
             button_text = f"{attendance_status} {employee.name} - {employee.daily_salary} руб./день"
-            callback_data = f"toggle_attendance:{employee.id}"
+            callback_data = encode_callback("toggle_attendance", employee.id)
             markup.add(types.InlineKeyboardButton(button_text, callback_data=callback_data))
 
         # Кнопка сохранения
         markup.add(
-            types.InlineKeyboardButton("💾 Сохранить и заблокировать на сегодня", callback_data="save_attendance"))
+            types.InlineKeyboardButton("💾 Сохранить и заблокировать на сегодня", callback_data=encode_callback("save_attendance")))
 
         # Кнопка назад
-        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data="back_to_timesheet"))
-
-        response = f"""
-📝 УЧЕТ ПРИСУТСТВИЯ
-
-Дата: {work_date.strftime('%d.%m.%Y')}
+        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data=encode_callback("back_to_timesheet")))
+        return markup
 
-Отметьте присутствующих работников:
-• ✅ - присутствовал
-• ❌ - отсутствовал
-
-После отметки нажмите "Сохранить"
-"""
-        self.bot.send_message(chat_id, response, reply_markup=markup)
-
-    def _is_employee_present_today(self, user_data, employee_id: str, work_date: date) -> bool:
+    def _is_employee_present_today(self, user_data, employee_id: int, work_date: date) -> bool:
         """Проверяет, отмечен ли работник как присутствующий на указанную дату"""
+        work_day = work_date.toordinal()
         for record in user_data.timesheet.attendance_records:
-            if record.employee_id == employee_id and record.work_date == work_date:
+            if record.employee_id == employee_id and record.work_day == work_day:
                 return record.is_present
         return False
 
-    def handle_attendance_callback(self, call):
+    def handle_attendance_callback(self, call, callback: CallbackData):
         chat_id = call.message.chat.id
-        data = call.data
+        action, args = callback
 
-        if data == "back_to_timesheet":
+        if action == "back_to_timesheet":
             self.bot.delete_message(chat_id, call.message.message_id)
             self.handle_timesheet_main(call.message)
             return
 
-        if data == "save_attendance":
+        if action == "save_attendance":
             self._save_attendance(call)
             return
 
-        if data.startswith("toggle_attendance:"):
-            self._toggle_attendance(call)
+        if action == "toggle_attendance" and args:
+            self.handle_attendance_toggles(call, [args[0]])
             return
 
-    def _toggle_attendance(self, call):
+    def handle_attendance_toggles(self, call, employee_ids: List[int]):
+        """
+        Переключает присутствие по пачке нажатий на одну клавиатуру: повторные нажатия
+        на того же работника взаимно гасятся, клавиатура перерисовывается один раз.
+        """
         chat_id = call.message.chat.id
-        employee_id = call.data.split(":")[1]
         today = date.today()
 
         user_data = self.get_user_data(chat_id)
 
-        # Получаем текущий статус
-        current_status = self._is_employee_present_today(user_data, employee_id, today)
+        changed = False
+        for employee_id, taps in Counter(employee_ids).items():
+            if taps % 2:
+                current_status = self._is_employee_present_today(user_data, employee_id, today)
+                changed |= user_data.timesheet.mark_attendance(employee_id, today, not current_status)
+        if not changed:
+            # Состояние не изменилось (нажатия погасили друг друга или дата заблокирована) - кнопки те же
+            return
 
-        # Меняем статус
-        user_data.timesheet.mark_attendance(employee_id, today, not current_status)
+        # АВТОСОХРАНЕНИЕ: одна запись на пачку нажатий
+        self._auto_save_user_data(chat_id)
 
-        # Обновляем клавиатуру
-        self.bot.delete_message(chat_id, call.message.message_id)
-        self._show_attendance_keyboard(chat_id, today)
+        # Текст сообщения не меняется - обновляем только кнопки того же сообщения
+        self.bot.edit_message_reply_markup(chat_id, call.message.message_id,
+                                           reply_markup=self._attendance_markup(user_data, today))
 
     def _save_attendance(self, call):
         chat_id = call.message.chat.id
@@ -211,10 +229,12 @@ class TimesheetHandler(BaseHandler):
 
         # Блокируем дату для изменений
         user_data.timesheet.lock_attendance_for_date(today)
+        self._auto_save_user_data(chat_id)
 
         # Подсчитываем присутствующих
+        today_day = today.toordinal()
         present_count = sum(1 for record in user_data.timesheet.attendance_records
-                            if record.work_date == today and record.is_present)
+                            if record.work_day == today_day and record.is_present)
 
         self.bot.delete_message(chat_id, call.message.message_id)
         self.bot.send_message(chat_id,
@@ -230,39 +250,61 @@ class TimesheetHandler(BaseHandler):
             self.handle_timesheet_main(message)
             return
 
+        # Расчет идет фоновой задачей по снимку табеля: отметки, сделанные тем временем, его не сбивают
+        timesheet = snapshot_segment(user_data.timesheet)
+        self.bot.jobs.submit(chat_id, 'salary', "Расчет зарплаты", lambda job: self._send_salary(job, timesheet))
+        self.handle_timesheet_main(message)
+
+    def _send_salary(self, job, timesheet):
         # Получаем текущий период
-        start_date, end_date = user_data.timesheet.get_current_period()
+        start_date, end_date = timesheet.get_current_period()
+        response = self._salary_report(timesheet, start_date, end_date, job)
+        job.check()
+        self.send_text(job.chat_id, response)
+        return "✅ Расчет зарплаты готов"
+
+    def send_period_summary(self, chat_id: int, timesheet, start_date: date, end_date: date):
+        """Итог закрытого периода (TimesheetTimers): отметки заблокированы, расчет зарплаты за период"""
+        response = MessageBuilder()
+        response.line(f"📒 Период {start_date.strftime('%d.%m.%Y')} - {end_date.strftime('%d.%m.%Y')} закрыт, "
+                      f"отметки присутствия заблокированы.")
+        self.send_text(chat_id, self._salary_report(timesheet, start_date, end_date, response=response))
+
+    def _salary_report(self, timesheet, start_date: date, end_date: date, job=None,
+                       response: MessageBuilder = None) -> MessageBuilder:
         period_name = "1-15" if start_date.day == 1 else "16-конец месяца"
 
-        response = f"""
-💰 РАСЧЕТ ЗАРПЛАТЫ
-
-Период: {period_name} {start_date.strftime('%B %Y')}
-Даты: {start_date.strftime('%d.%m.%Y')} - {end_date.strftime('%d.%m.%Y')}
-
-Зарплата работников:
-"""
+        response = response if response is not None else MessageBuilder()
+        response.blank()
+        response.line("💰 РАСЧЕТ ЗАРПЛАТЫ")
+        response.blank()
+        response.line(f"Период: {period_name} {start_date.strftime('%B %Y')}")
+        response.line(f"Даты: {start_date.strftime('%d.%m.%Y')} - {end_date.strftime('%d.%m.%Y')}")
+        response.blank()
+        response.line("Зарплата работников:")
 
         total_payout = 0
-        employees = user_data.timesheet.get_all_employees()
+        employees = timesheet.get_all_employees()
 
-        for employee in employees:
-            salary = user_data.timesheet.calculate_salary_for_period(employee.id, start_date, end_date)
+        for i, employee in enumerate(employees):
+            if job is not None:
+                job.progress(f"работник {i + 1} из {len(employees)}")
+            salary = timesheet.calculate_salary_for_period(employee.id, start_date, end_date)
             working_days = len(
-                [r for r in user_data.timesheet.get_attendance_for_period(employee.id, start_date, end_date)
+                [r for r in timesheet.get_attendance_for_period(employee.id, start_date, end_date)
                  if r.is_present])
 
-            response += f"\n👤 {employee.name}\n"
-            response += f"   📅 Отработано дней: {working_days}\n"
-            response += f"   💰 Зарплата: {salary:.2f} руб.\n"
-            response += f"   📊 Ставка: {employee.daily_salary} руб./день\n"
+            response.blank()
+            response.line(f"👤 {employee.name}")
+            response.line(f"   📅 Отработано дней: {working_days}")
+            response.line(f"   💰 Зарплата: {salary:.2f} руб.")
+            response.line(f"   📊 Ставка: {employee.daily_salary} руб./день")
 
             total_payout += salary
 
-        response += f"\n📈 ОБЩАЯ СУММА К ВЫПЛАТЕ: {total_payout:.2f} руб."
-
-        self.bot.send_message(chat_id, response)
-        self.handle_timesheet_main(message)
+        response.blank()
+        response.line(f"📈 ОБЩАЯ СУММА К ВЫПЛАТЕ: {total_payout:.2f} руб.")
+        return response
 
     def handle_remove_employee_menu(self, message):
         chat_id = message.chat.id
@@ -277,22 +319,25 @@ class TimesheetHandler(BaseHandler):
 
         for employee in user_data.timesheet.get_all_employees():
             button_text = f"❌ {employee.name} - {employee.daily_salary} руб./день"
-            callback_data = f"remove_employee:{employee.id}"
+            callback_data = encode_callback("remove_employee", employee.id)
             markup.add(types.InlineKeyboardButton(button_text, callback_data=callback_data))
 
-        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data="back_to_timesheet"))
+        markup.add(types.InlineKeyboardButton("⬅️ Назад", callback_data=encode_callback("back_to_timesheet")))
 
         response = "🗑️ УДАЛЕНИЕ РАБОТНИКА\n\nВыберите работника для удаления:"
         self.bot.send_message(chat_id, response, reply_markup=markup)
 
-    def handle_remove_employee_callback(self, call):
+    def handle_remove_employee_callback(self, call, callback: CallbackData):
         chat_id = call.message.chat.id
-        employee_id = call.data.split(":")[1]
+        if not callback.args:
+            return
+        employee_id = callback.args[0]
 
         user_data = self.get_user_data(chat_id)
         employee = user_data.timesheet.get_employee(employee_id)
 
         if employee and user_data.timesheet.remove_employee(employee_id):
+            self._auto_save_user_data(chat_id)
             self.bot.delete_message(chat_id, call.message.message_id)
             self.bot.send_message(chat_id, f"✅ Работник {employee.name} удален из табеля.")
             self.handle_timesheet_main(call.message)
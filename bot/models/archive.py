@@ -0,0 +1,111 @@
+from typing import Callable, List, Optional
+from .schema import Field
+
+
+class Archive:
+    """
+    Холодные записи раздела: выполненные задачи, завершенные объекты, старые расходы, отметки закрытых периодов.
+    На диске - отдельный журнал рядом с файлом пользователя (JSONStorageService._save_archive),
+    в файле пользователя - только число записей. С диска журнал читается при первом обращении
+    к records(), до этого в памяти лежат лишь записи, перенесенные после последнего сохранения.
+    """
+    __slots__ = ('count', 'loader', '_records', '_pending', 'needs_rewrite')
+
+    FIELDS = (
+        Field('count', default=0),
+    )
+
+    def __init__(self):
+        self.count = 0
+        # Читает журнал с диска; задается хранилищем при загрузке пользователя. None вместо списка - журнала нет
+        self.loader: Optional[Callable[[], Optional[list]]] = None
+        self._records: Optional[list] = None
+        # Перенесены в архив, но еще не дописаны в журнал
+        self._pending: list = []
+        # Из архива удаляли записи - журнал нужно переписать целиком
+        self.needs_rewrite = False
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def loaded(self) -> bool:
+        return self._records is not None
+
+    def records(self) -> list:
+        """Все записи архива в порядке переноса; при первом обращении журнал читается с диска"""
+        if self._records is None:
+            persisted = self.count - len(self._pending)
+            stored = self.loader() if persisted and self.loader is not None else []
+            if stored is None:
+                # Журнал недоступен: отдаем только записи в памяти и не считаем архив загруженным,
+                # иначе следующее сохранение перезаписало бы журнал пустым
+                return list(self._pending)
+            if len(stored) != persisted:
+                # Лишние записи в журнале - от сохранения, прерванного до записи файла пользователя:
+                # они еще лежат в рабочих данных. Недостающие - поврежденный журнал
+                stored = stored[:persisted]
+                self.needs_rewrite = True
+            self._records = stored + self._pending
+            self.count = len(self._records)
+        return self._records
+
+    def snapshot(self) -> 'Archive':
+        """
+        Копия для чтения из другого потока: список записей фиксируется. Не загруженный журнал копия
+        прочитает сама тем же загрузчиком - дописанное после снимка отсекается по count
+        """
+        copy = Archive()
+        copy.count = self.count
+        copy.loader = self.loader
+        copy._records = list(self._records) if self._records is not None else None
+        copy._pending = list(self._pending)
+        return copy
+
+    def resident(self) -> list:
+        """Записи архива, которые уже в памяти (без чтения журнала)"""
+        return self._records if self._records is not None else self._pending
+
+    def add(self, records: list):
+        self._pending.extend(records)
+        if self._records is not None:
+            self._records.extend(records)
+        self.count += len(records)
+
+    def remove(self, record) -> bool:
+        """Убирает запись из архива (например, задачу открыли снова)"""
+        return self.remove_where(lambda item: item is record) > 0
+
+    def remove_where(self, predicate: Callable[[object], bool]) -> int:
+        if not self.count:
+            return 0
+        records = self.records()
+        if self._records is None:
+            # Журнал недоступен - убираем только из записей в памяти, журнал не трогаем
+            kept = [item for item in self._pending if not predicate(item)]
+            removed = len(self._pending) - len(kept)
+            self._pending = kept
+            self.count -= removed
+            return removed
+        kept = [item for item in records if not predicate(item)]
+        removed = len(records) - len(kept)
+        if removed:
+            self._records = kept
+            self._pending = [item for item in self._pending if not predicate(item)]
+            self.count = len(kept)
+            self.needs_rewrite = True
+        return removed
+
+    def clear(self) -> int:
+        count = self.count
+        self._records, self._pending = [], []
+        self.count = 0
+        self.needs_rewrite = True
+        return count
+
+    def unpersisted(self) -> List:
+        return self._pending
+
+    def mark_persisted(self):
+        self._pending = []
+        self.needs_rewrite = False
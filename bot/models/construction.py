@@ -1,6 +1,12 @@
+import sys
+from bisect import bisect_left, bisect_right
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 from enum import Enum
+from .archive import Archive
+from .ids import IdSequence
+from .schema import DATETIME, LENGTH, EnumName, Field, ListOf, MapOf, Nested
+from .segment import Segment
 
 
 class ConstructionStage(Enum):
@@ -10,24 +16,146 @@ class ConstructionStage(Enum):
 
 
 class ResponsiblePerson:
+    __slots__ = ('name', 'position', 'phone', 'email')
+
+    FIELDS = (
+        Field('name', arg='name'),
+        Field('position', arg='position'),
+        Field('phone', arg='phone'),
+        Field('email', arg='email', default=''),
+    )
+
     def __init__(self, name: str, position: str, phone: str, email: str = ""):
         self.name = name
-        self.position = position
+        # Должности повторяются от объекта к объекту - храним одну копию строки
+        self.position = sys.intern(position)
         self.phone = phone
         self.email = email
 
 
+class Comment:
+    __slots__ = ('timestamp', 'author_chat_id', 'stage', 'text')
+
+    # Формат, в котором комментарии раньше хранились готовыми строками
+    LEGACY_FORMAT = '%d.%m.%Y %H:%M'
+
+    def __init__(self, timestamp: datetime, author_chat_id: int, stage: ConstructionStage, text: str):
+        self.timestamp = timestamp
+        self.author_chat_id = author_chat_id
+        self.stage = stage
+        self.text = text
+
+    def format(self) -> str:
+        return f"{self.timestamp.strftime(self.LEGACY_FORMAT)}: {self.text}"
+
+    @classmethod
+    def from_legacy(cls, line: str, stage: ConstructionStage, author_chat_id: int,
+                    fallback_timestamp: datetime) -> 'Comment':
+        """Разбирает старую строку вида '14.11.2025 03:03: текст'"""
+        try:
+            timestamp = datetime.strptime(line[:16], cls.LEGACY_FORMAT)
+            text = line[16:].removeprefix(': ')
+        except ValueError:
+            timestamp, text = fallback_timestamp, line
+        return cls(timestamp, author_chat_id, stage, text)
+
+
+class CommentLog:
+    """
+    Журнал комментариев объекта: только добавление, упорядочен по времени.
+    Индексы (общий по времени и по этапам) позволяют отвечать на
+    "комментарии с момента X" и "последние N по этапу" за O(log n + k).
+    """
+    __slots__ = ('_entries', '_timestamps', '_by_stage', '_stage_timestamps', 'persisted_count', 'needs_rewrite')
+
+    def __init__(self):
+        self._entries: List[Comment] = []
+        self._timestamps: List[datetime] = []
+        self._by_stage: Dict[ConstructionStage, List[Comment]] = {stage: [] for stage in ConstructionStage}
+        self._stage_timestamps: Dict[ConstructionStage, List[datetime]] = {stage: [] for stage in ConstructionStage}
+        # Сколько записей с начала журнала уже лежит на диске
+        self.persisted_count = 0
+        # Порядок записей на диске разошелся с журналом (вставка задним числом) - файл нужно переписать
+        self.needs_rewrite = False
+
+    def append(self, comment: Comment):
+        if self._timestamps and comment.timestamp < self._timestamps[-1]:
+            # Запись задним числом (например, при загрузке старого формата) - вставляем по месту
+            index = bisect_right(self._timestamps, comment.timestamp)
+            self._entries.insert(index, comment)
+            self._timestamps.insert(index, comment.timestamp)
+            if index < self.persisted_count:
+                self.needs_rewrite = True
+        else:
+            self._entries.append(comment)
+            self._timestamps.append(comment.timestamp)
+
+        stage_entries = self._by_stage[comment.stage]
+        stage_timestamps = self._stage_timestamps[comment.stage]
+        if stage_timestamps and comment.timestamp < stage_timestamps[-1]:
+            index = bisect_right(stage_timestamps, comment.timestamp)
+            stage_entries.insert(index, comment)
+            stage_timestamps.insert(index, comment.timestamp)
+        else:
+            stage_entries.append(comment)
+            stage_timestamps.append(comment.timestamp)
+
+    def since(self, timestamp: datetime, stage: Optional[ConstructionStage] = None) -> List[Comment]:
+        """Комментарии начиная с момента timestamp (включительно), по возрастанию времени"""
+        if stage is None:
+            return self._entries[bisect_left(self._timestamps, timestamp):]
+        return self._by_stage[stage][bisect_left(self._stage_timestamps[stage], timestamp):]
+
+    def last(self, stage: ConstructionStage, count: int) -> List[Comment]:
+        """Последние count комментариев этапа, по возрастанию времени"""
+        if count <= 0:
+            return []
+        return self._by_stage[stage][-count:]
+
+    def count(self, stage: Optional[ConstructionStage] = None) -> int:
+        if stage is None:
+            return len(self._entries)
+        return len(self._by_stage[stage])
+
+    def unpersisted(self) -> List[Comment]:
+        return self._entries[self.persisted_count:]
+
+    def mark_persisted(self):
+        self.persisted_count = len(self._entries)
+        self.needs_rewrite = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[Comment]:
+        return iter(self._entries)
+
+
 class ConstructionObject:
-    def __init__(self, name: str, address: str, object_id: Optional[str] = None):
-        self.id = object_id or str(datetime.now().timestamp())
+    __slots__ = ('id', 'name', 'address', 'created_date', 'current_stage', 'responsible_persons', 'comment_log',
+                 'is_completed', 'completion_date')
+
+    FIELDS = (
+        Field('id', arg='object_id'),
+        Field('name', arg='name'),
+        Field('address', arg='address'),
+        Field('created_date', DATETIME),
+        Field('current_stage', EnumName(ConstructionStage)),
+        Field('responsible_persons', ListOf(ResponsiblePerson)),
+        # Комментарии лежат в отдельном журнале объекта (см. JSONStorageService._save_comment_log)
+        Field('comments_count', LENGTH, attr='comment_log', load=False),
+        Field('is_completed'),
+        Field('completion_date', DATETIME, optional=True),
+    )
+
+    def __init__(self, name: str, address: str, object_id: int):
+        self.id = object_id
         self.name = name
         self.address = address
         self.created_date = datetime.now()
         self.current_stage = ConstructionStage.ACCEPTANCE
         self.responsible_persons: List[ResponsiblePerson] = []  # УПРОЩАЕМ - просто список
-        self.comments: Dict[ConstructionStage, List[str]] = {
-            stage: [] for stage in ConstructionStage
-        }
+        self.comment_log = CommentLog()
         self.is_completed = False
         self.completion_date: Optional[datetime] = None
 
@@ -40,8 +168,11 @@ class ConstructionObject:
             return True
         return False
 
-    def add_comment(self, stage: ConstructionStage, comment: str):
-        self.comments[stage].append(f"{datetime.now().strftime('%d.%m.%Y %H:%M')}: {comment}")
+    def add_comment(self, stage: ConstructionStage, text: str, author_chat_id: int,
+                    timestamp: Optional[datetime] = None) -> Comment:
+        comment = Comment(timestamp or datetime.now(), author_chat_id, stage, text)
+        self.comment_log.append(comment)
+        return comment
 
     def move_to_next_stage(self):
         stages = list(ConstructionStage)
@@ -56,30 +187,68 @@ class ConstructionObject:
         self.completion_date = datetime.now()
 
 
-class ConstructionManager:
-    def __init__(self, chat_id: int):
+class ConstructionManager(Segment):
+    __slots__ = ('chat_id', 'objects', 'archive', 'id_sequence')
+
+    FIELDS = (
+        Field('objects', MapOf(ConstructionObject)),
+        Field('archive', Nested(Archive)),
+    )
+
+    def __init__(self, chat_id: int, id_sequence: Optional[IdSequence] = None):
+        super().__init__()
         self.chat_id = chat_id
-        self.objects: Dict[str, ConstructionObject] = {}
+        self.id_sequence = id_sequence or IdSequence()
+        self.objects: Dict[int, ConstructionObject] = {}
+        # Давно завершенные объекты (их журналы комментариев остаются на месте)
+        self.archive = Archive()
 
     def add_object(self, name: str, address: str) -> ConstructionObject:
-        obj = ConstructionObject(name, address)
+        obj = ConstructionObject(name, address, self.id_sequence.next_id())
         self.objects[obj.id] = obj
+        self.touch()
         return obj
 
-    def remove_object(self, object_id: str) -> bool:
+    def remove_object(self, object_id: int) -> bool:
         if object_id in self.objects:
             del self.objects[object_id]
-            return True
-        return False
+        elif not self.archive.remove_where(lambda obj: obj.id == object_id):
+            return False
+        self.touch()
+        return True
+
+    def get_object(self, object_id: int) -> Optional[ConstructionObject]:
+        obj = self.objects.get(object_id)
+        if obj is None and self.archive:
+            # Объект из архива возвращается в рабочие данные: его могут изменить (комментарии,
+            # ответственные), и изменения сохранятся как обычно. В архив он вернется при следующем сохранении
+            obj = next((obj for obj in self.archive.records() if obj.id == object_id), None)
+            if obj is not None:
+                self.archive.remove(obj)
+                self.objects[obj.id] = obj
+                self.touch()
+        return obj
 
-    def get_object(self, object_id: str) -> Optional[ConstructionObject]:
-        return self.objects.get(object_id)
+    def archive_completed(self, before: datetime) -> int:
+        """Переносит в архив объекты, завершенные раньше before"""
+        cold = [obj for obj in self.objects.values()
+                if obj.is_completed and (obj.completion_date is None or obj.completion_date < before)]
+        for obj in cold:
+            del self.objects[obj.id]
+        if cold:
+            self.archive.add(cold)
+            self.touch()
+        return len(cold)
 
     def get_active_objects(self) -> List[ConstructionObject]:
         return [obj for obj in self.objects.values() if not obj.is_completed]
 
     def get_completed_objects(self) -> List[ConstructionObject]:
-        return [obj for obj in self.objects.values() if obj.is_completed]
+        """Завершенные объекты вместе с архивом (архив читается с диска)"""
+        return self.archive.records() + [obj for obj in self.objects.values() if obj.is_completed]
+
+    def completed_count(self) -> int:
+        return len(self.archive) + sum(1 for obj in self.objects.values() if obj.is_completed)
 
     def get_objects_by_stage(self, stage: ConstructionStage) -> List[ConstructionObject]:
         return [obj for obj in self.objects.values() if obj.current_stage == stage and not obj.is_completed]
\ No newline at end of file
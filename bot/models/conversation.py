@@ -0,0 +1,108 @@
+import time
+from typing import Dict, NamedTuple, Optional, Type, TypeVar
+
+DEFAULT_STATE = 'main_menu'
+
+
+# Контексты многошаговых диалогов: у каждого диалога свой тип с фиксированными полями
+
+class TaskDraft(NamedTuple):
+    """Новая задача Running List: описание введено, ждем приоритет, затем срок"""
+    description: str
+    # Имя TaskPriority; None - приоритет еще не выбран
+    priority: Optional[str] = None
+
+
+class ObjectDraft(NamedTuple):
+    """Новый стройобъект: название введено, ждем адрес"""
+    name: str
+
+
+class SelectedObject(NamedTuple):
+    """Объект, открытый в управлении объектом (для /del)"""
+    object_id: int
+
+
+class ResponsibleDraft(NamedTuple):
+    """Новое ответственное лицо объекта: имя и должность вводятся по очереди"""
+    object_id: int
+    name: str = ''
+    position: str = ''
+
+
+class StageCommentDraft(NamedTuple):
+    """Комментарий к этапу объекта (без этапа - к текущему): ждем текст"""
+    object_id: int
+    stage_name: Optional[str] = None
+
+
+class EmployeeDraft(NamedTuple):
+    """Новый сотрудник табеля: имя введено, ждем дневную ставку"""
+    name: str
+
+
+class SearchQuery(NamedTuple):
+    """Последний запрос /find - для перелистывания страниц результатов"""
+    query: str
+
+
+FLOW_TYPES: Dict[str, Type[NamedTuple]] = {
+    cls.__name__: cls
+    for cls in (TaskDraft, ObjectDraft, SelectedObject, ResponsibleDraft, StageCommentDraft, EmployeeDraft,
+                SearchQuery)
+}
+
+Flow = TypeVar('Flow', bound=tuple)
+
+
+class Conversation:
+    """Состояние диалога с пользователем: экран и контексты начатых диалогов. Хранится отдельно от данных"""
+    __slots__ = ('chat_id', '_state', 'flows', 'touched_at')
+
+    def __init__(self, chat_id: int, state: str = DEFAULT_STATE, flows: Optional[Dict[str, tuple]] = None,
+                 touched_at: Optional[float] = None):
+        self.chat_id = chat_id
+        self._state = state
+        self.flows: Dict[str, tuple] = flows if flows is not None else {}
+        self.touched_at = touched_at if touched_at is not None else time.time()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    @state.setter
+    def state(self, value: str):
+        self._state = value
+        self.touched_at = time.time()
+
+    @property
+    def is_default(self) -> bool:
+        return self._state == DEFAULT_STATE and not self.flows
+
+    def put(self, flow: tuple):
+        self.flows[type(flow).__name__] = flow
+        self.touched_at = time.time()
+
+    def get(self, flow_type: Type[Flow]) -> Optional[Flow]:
+        return self.flows.get(flow_type.__name__)
+
+    def drop(self, *flow_types: type):
+        for flow_type in flow_types:
+            self.flows.pop(flow_type.__name__, None)
+        self.touched_at = time.time()
+
+    def reset(self):
+        self._state = DEFAULT_STATE
+        self.flows.clear()
+        self.touched_at = time.time()
+
+    def to_list(self) -> list:
+        # list(items()) - снимок за один шаг: словарь могут менять из потока апдейта
+        return [self._state, round(self.touched_at, 1), {name: list(flow) for name, flow in list(self.flows.items())}]
+
+    @classmethod
+    def from_list(cls, chat_id: int, data: list) -> 'Conversation':
+        state, touched_at, flows = data
+        return cls(chat_id, state, {
+            name: FLOW_TYPES[name](*values) for name, values in flows.items() if name in FLOW_TYPES
+        }, touched_at)
@@ -0,0 +1,15 @@
+class IdSequence:
+    """Монотонный счетчик идентификаторов сущностей одного пользователя"""
+    __slots__ = ('last_id',)
+
+    def __init__(self, last_id: int = 0):
+        self.last_id = last_id
+
+    def next_id(self) -> int:
+        self.last_id += 1
+        return self.last_id
+
+    def observe(self, entity_id: int):
+        """Учитывает уже существующий id, чтобы новые id его не повторили"""
+        if entity_id > self.last_id:
+            self.last_id = entity_id
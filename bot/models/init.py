@@ -1,4 +1,11 @@
-from .user_data import Expense, UserData
+from .ids import IdSequence
+from .archive import Archive
+from .segment import Segment
+from .user_data import Expense, ExpenseBook, UserData
 from .timesheet import Employee, AttendanceRecord, Timesheet
-from .construction import ConstructionStage, ResponsiblePerson, ConstructionObject, ConstructionManager
-from .running_list import RunningTask, TaskPriority, RunningList  # ДОБАВЛЯЕМ
\ No newline at end of file
+from .construction import ConstructionStage, ResponsiblePerson, Comment, CommentLog, ConstructionObject, \
+    ConstructionManager
+from .running_list import RunningTask, TaskPriority, RunningList  # ДОБАВЛЯЕМ
+from .conversation import Conversation, TaskDraft, ObjectDraft, SelectedObject, ResponsibleDraft, \
+    StageCommentDraft, EmployeeDraft, SearchQuery
+from .schema import Field, DATE, DATETIME, EnumName, ListOf, MapOf, Nested
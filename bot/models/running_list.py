@@ -1,6 +1,12 @@
+from bisect import insort
 from datetime import datetime
+from operator import attrgetter
 from typing import List, Optional
 from enum import Enum
+from .archive import Archive
+from .ids import IdSequence
+from .schema import DATETIME, EnumName, Field, ListOf, Nested
+from .segment import Segment
 
 
 class TaskPriority(Enum):
@@ -11,8 +17,20 @@ class TaskPriority(Enum):
 
 
 class RunningTask:
-    def __init__(self, description: str, priority: TaskPriority = TaskPriority.MEDIUM, task_id: Optional[str] = None):
-        self.id = task_id or str(datetime.now().timestamp())
+    __slots__ = ('id', 'description', 'priority', 'created_date', 'is_completed', 'completed_date', 'due_date')
+
+    FIELDS = (
+        Field('id', arg='task_id'),
+        Field('description', arg='description'),
+        Field('priority', EnumName(TaskPriority), arg='priority'),
+        Field('created_date', DATETIME),
+        Field('is_completed'),
+        Field('completed_date', DATETIME, optional=True, default=None),
+        Field('due_date', DATETIME, optional=True, default=None),
+    )
+
+    def __init__(self, description: str, priority: TaskPriority, task_id: int):
+        self.id = task_id
         self.description = description
         self.priority = priority
         self.created_date = datetime.now()
@@ -29,31 +47,82 @@ class RunningTask:
         self.completed_date = None
 
 
-class RunningList:
-    def __init__(self, chat_id: int):
+class RunningList(Segment):
+    __slots__ = ('chat_id', 'tasks', 'archive', 'id_sequence')
+
+    # Поврежденная задача пропускается, остальные загружаются
+    FIELDS = (
+        Field('tasks', ListOf(RunningTask, skip_invalid=True)),
+        Field('archive', Nested(Archive)),
+    )
+
+    def __init__(self, chat_id: int, id_sequence: Optional[IdSequence] = None):
+        super().__init__()
         self.chat_id = chat_id
+        self.id_sequence = id_sequence or IdSequence()
+        # Задачи по возрастанию id; давно выполненные - в архиве
         self.tasks: List[RunningTask] = []
+        self.archive = Archive()
 
-    def add_task(self, description: str, priority: TaskPriority = TaskPriority.MEDIUM) -> RunningTask:
-        task = RunningTask(description, priority)
+    def add_task(self, description: str, priority: TaskPriority = TaskPriority.MEDIUM,
+                 due_date: Optional[datetime] = None) -> RunningTask:
+        task = RunningTask(description, priority, self.id_sequence.next_id())
+        task.due_date = due_date
         self.tasks.append(task)
+        self.touch()
         return task
 
-    def get_task(self, task_id: str) -> Optional[RunningTask]:
-        return next((task for task in self.tasks if task.id == task_id), None)
+    def get_task(self, task_id: int) -> Optional[RunningTask]:
+        task = next((task for task in self.tasks if task.id == task_id), None)
+        if task is None and self.archive:
+            task = next((task for task in self.archive.records() if task.id == task_id), None)
+        return task
 
-    def delete_task(self, task_id: str) -> bool:
+    def delete_task(self, task_id: int) -> bool:
         task = self.get_task(task_id)
         if task:
-            self.tasks.remove(task)
+            if task in self.tasks:
+                self.tasks.remove(task)
+            else:
+                self.archive.remove(task)
+            self.touch()
             return True
         return False
 
+    def complete_task(self, task: RunningTask):
+        task.complete()
+        self.touch()
+
+    def reopen_task(self, task: RunningTask):
+        # Задача из архива возвращается в рабочий список
+        if task not in self.tasks and self.archive.remove(task):
+            insort(self.tasks, task, key=attrgetter('id'))
+        task.reopen()
+        self.touch()
+
+    def archive_completed(self, before: datetime) -> int:
+        """Переносит в архив задачи, выполненные раньше before"""
+        hot, cold = [], []
+        for task in self.tasks:
+            if task.is_completed and (task.completed_date is None or task.completed_date < before):
+                cold.append(task)
+            else:
+                hot.append(task)
+        if cold:
+            self.tasks = hot
+            self.archive.add(cold)
+            self.touch()
+        return len(cold)
+
     def get_active_tasks(self) -> List[RunningTask]:
         return [task for task in self.tasks if not task.is_completed]
 
     def get_completed_tasks(self) -> List[RunningTask]:
-        return [task for task in self.tasks if task.is_completed]
+        """Выполненные задачи вместе с архивом (архив читается с диска)"""
+        return self.archive.records() + [task for task in self.tasks if task.is_completed]
+
+    def completed_count(self) -> int:
+        return len(self.archive) + sum(1 for task in self.tasks if task.is_completed)
 
     def get_tasks_by_priority(self, priority: TaskPriority) -> List[RunningTask]:
         return [task for task in self.tasks if task.priority == priority and not task.is_completed]
\ No newline at end of file
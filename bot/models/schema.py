@@ -0,0 +1,222 @@
+"""
+Описание полей моделей для файла пользователя.
+
+Модель перечисляет поля в атрибуте FIELDS; по нему один раз при импорте генерируются
+функции _enc_<Модель>(obj) -> dict и _dec_<Модель>(dict) -> obj (и их варианты для целых списков)
+с прямыми обращениями к атрибутам и конвертерами, подставленными на место:
+без обхода описаний на каждой записи.
+"""
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Type
+
+# Поле обязательно: в файле его нет - запись повреждена
+REQUIRED = object()
+
+
+class Kind:
+    """Как значение хранится в файле: выражения для генерируемого кода (src - выражение со значением)"""
+    # Значение, если ключа нет в файле и у поля нет своего default
+    missing: Any = REQUIRED
+
+    def encode(self, src: str, ns: dict) -> str:
+        return src
+
+    def decode(self, src: str, ns: dict) -> str:
+        return src
+
+
+class _DateTime(Kind):
+    def encode(self, src, ns):
+        return f"{src}.isoformat()"
+
+    def decode(self, src, ns):
+        ns['_datetime_fromiso'] = datetime.fromisoformat
+        return f"_datetime_fromiso({src})"
+
+
+class _Date(_DateTime):
+    def decode(self, src, ns):
+        ns['_date_fromiso'] = date.fromisoformat
+        return f"_date_fromiso({src})"
+
+
+class _Length(Kind):
+    """Только для записи: размер коллекции (например, число комментариев из отдельного журнала)"""
+
+    def encode(self, src, ns):
+        return f"len({src})"
+
+
+RAW = Kind()
+DATETIME = _DateTime()
+DATE = _Date()
+LENGTH = _Length()
+
+
+class EnumName(Kind):
+    """Член Enum хранится по имени"""
+
+    def __init__(self, enum: Type[Enum]):
+        self.enum = enum
+
+    def encode(self, src, ns):
+        return f"{src}.name"
+
+    def decode(self, src, ns):
+        ns[f"_enum_{self.enum.__name__}"] = self.enum
+        return f"_enum_{self.enum.__name__}[{src}]"
+
+
+class ListOf(Kind):
+    """Список моделей. skip_invalid - поврежденные записи пропускаются, а не ломают чтение всего файла"""
+    missing = ()
+
+    def __init__(self, model: type, skip_invalid: bool = False):
+        self.model = model
+        self.skip_invalid = skip_invalid
+
+    def encode(self, src, ns):
+        return f"_enc_list_{self.model.__name__}({src})"
+
+    def decode(self, src, ns):
+        suffix = '_valid' if self.skip_invalid else ''
+        return f"_dec_list{suffix}_{self.model.__name__}({src})"
+
+
+class MapOf(ListOf):
+    """Словарь моделей по ключевому атрибуту; в файле - список"""
+
+    def __init__(self, model: type, key: str = 'id'):
+        super().__init__(model)
+        self.key = key
+
+    def encode(self, src, ns):
+        return f"_enc_list_{self.model.__name__}({src}.values())"
+
+    def decode(self, src, ns):
+        return f"{{x.{self.key}: x for x in _dec_list_{self.model.__name__}({src})}}"
+
+
+class Nested(Kind):
+    """Вложенный объект-контейнер, который модель создает сама: при чтении заполняется на месте"""
+    missing = {}
+
+    def __init__(self, model: type):
+        self.model = model
+
+    def encode(self, src, ns):
+        return f"_enc_{self.model.__name__}({src})"
+
+
+class Field(NamedTuple):
+    key: str
+    kind: Kind = RAW
+    # Атрибут модели, если отличается от ключа (можно через точку: id_sequence.last_id)
+    attr: Optional[str] = None
+    # Параметр конструктора, через который значение передается при чтении
+    arg: Optional[str] = None
+    # Значение может быть None
+    optional: bool = False
+    # Значение для старых файлов без этого ключа
+    default: Any = REQUIRED
+    # False - поле только пишется
+    load: bool = True
+
+
+class Codec(NamedTuple):
+    encode: Callable[[Any], dict]
+    # Создает объект (модели-записи)
+    decode: Callable[[dict], Any]
+    # Заполняет уже созданный объект (контейнеры, см. Nested)
+    fill: Callable[[Any, dict], None]
+    # То же для целого списка записей
+    encode_list: Callable[[Any], List[dict]]
+    decode_list: Callable[[List[dict]], List[Any]]
+    source: str
+
+
+_NAMESPACE: Dict[str, Any] = {}
+_compiled: Dict[type, Codec] = {}
+
+
+def _skip_invalid(model: str, error: Exception):
+    from ..services.logging_service import get_logger
+    get_logger('storage').warning("Пропущена поврежденная запись %s: %r", model, error)
+
+
+def _value(field: Field, expr: str, convert: Callable[[str], str], index: int) -> str:
+    if not field.optional:
+        return convert(expr)
+    return f"(None if (_v{index} := {expr}) is None else {convert(f'_v{index}')})"
+
+
+def _indent(lines: List[str], depth: int) -> str:
+    return "".join(f"{' ' * depth}{line}\n" for line in lines)
+
+
+def compile_model(model: type) -> Codec:
+    """Генерирует (один раз) функции записи и чтения модели по ее FIELDS"""
+    if model in _compiled:
+        return _compiled[model]
+
+    name = model.__name__
+    ns = _NAMESPACE
+    ns[name] = model
+    encoded, args, assigns = [], [], []
+    for index, field in enumerate(model.FIELDS):
+        kind = field.kind
+        if isinstance(kind, (ListOf, Nested)):
+            compile_model(kind.model)
+        attr = f"obj.{field.attr or field.key}"
+        encoded.append(f"{field.key!r}: {_value(field, attr, lambda src: kind.encode(src, ns), index)}")
+        if not field.load:
+            continue
+
+        default = kind.missing if field.default is REQUIRED else field.default
+        if default is REQUIRED:
+            src = f"d[{field.key!r}]"
+        else:
+            ns[f"_default_{name}_{index}"] = default
+            src = f"d.get({field.key!r}, _default_{name}_{index})"
+        if isinstance(kind, Nested):
+            assigns.append(f"_fill_{kind.model.__name__}({attr}, {src})")
+            continue
+        value = _value(field, src, lambda src: kind.decode(src, ns), index)
+        if field.arg:
+            args.append(f"{field.arg}={value}")
+        else:
+            assigns.append(f"{attr} = {value}")
+
+    # Списки кодируются и читаются одним вызовом на весь список, а не на каждую запись
+    create = [f"obj = {name}({', '.join(args)})"] + assigns
+    ns['_skip_invalid'] = _skip_invalid
+    source = (
+        f"def _enc_{name}(obj):\n"
+        f"    return {{{', '.join(encoded)}}}\n\n"
+        f"def _enc_list_{name}(items):\n"
+        f"    return [{{{', '.join(encoded)}}} for obj in items]\n\n"
+        f"def _fill_{name}(obj, d):\n{_indent(assigns or ['pass'], 4)}\n"
+        f"def _dec_{name}(d):\n{_indent(create, 4)}"
+        f"    return obj\n\n"
+        f"def _dec_list_{name}(items):\n"
+        f"    result = []\n"
+        f"    append = result.append\n"
+        f"    for d in items:\n{_indent(create, 8)}"
+        f"        append(obj)\n"
+        f"    return result\n\n"
+        f"def _dec_list_valid_{name}(items):\n"
+        f"    result = []\n"
+        f"    append = result.append\n"
+        f"    for d in items:\n"
+        f"        try:\n{_indent(create, 12)}"
+        f"        except (KeyError, ValueError, TypeError) as e:\n"
+        f"            _skip_invalid({name!r}, e)\n"
+        f"            continue\n"
+        f"        append(obj)\n"
+        f"    return result\n"
+    )
+    exec(compile(source, f"<schema {name}>", 'exec'), ns)
+    _compiled[model] = Codec(ns[f"_enc_{name}"], ns[f"_dec_{name}"], ns[f"_fill_{name}"],
+                             ns[f"_enc_list_{name}"], ns[f"_dec_list_{name}"], source)
+    return _compiled[model]
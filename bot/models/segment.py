@@ -0,0 +1,18 @@
+class Segment:
+    """
+    Раздел данных пользователя, который хранится своим файлом (JSONStorageService):
+    расходы, табель, объекты, running list. revision растет при каждом изменении раздела,
+    хранилище пишет раздел, только если revision ушла от записанной (saved_revision).
+    """
+    __slots__ = ('revision', 'saved_revision')
+
+    def __init__(self):
+        self.revision = 0
+        self.saved_revision = 0
+
+    def touch(self):
+        self.revision += 1
+
+    @property
+    def dirty(self) -> bool:
+        return self.revision != self.saved_revision
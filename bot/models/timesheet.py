@@ -1,52 +1,135 @@
 from datetime import datetime, date, timedelta
+from itertools import chain
 from typing import Dict, List, Optional
+from .archive import Archive
+from .ids import IdSequence
+from .schema import DATE, DATETIME, Field, ListOf, MapOf, Nested
+from .segment import Segment
 
 
 class Employee:
-    def __init__(self, name: str, daily_salary: float, employee_id: Optional[str] = None):
-        self.id = employee_id or str(datetime.now().timestamp())
+    __slots__ = ('id', 'name', 'daily_salary', 'created_date')
+
+    FIELDS = (
+        Field('id', arg='employee_id'),
+        Field('name', arg='name'),
+        Field('daily_salary', arg='daily_salary'),
+        Field('created_date', DATETIME),
+    )
+
+    def __init__(self, name: str, daily_salary: float, employee_id: int):
+        self.id = employee_id
         self.name = name
         self.daily_salary = daily_salary
         self.created_date = datetime.now()
 
 
 class AttendanceRecord:
-    def __init__(self, employee_id: str, work_date: date, is_present: bool = False):
+    # Дата хранится порядковым номером дня (date.toordinal), флаги - маленьким int:
+    # так запись занимает в несколько раз меньше памяти, чем с __dict__ и объектом date
+    __slots__ = ('employee_id', 'work_day', '_flags')
+
+    _PRESENT = 1
+    _LOCKED = 2
+
+    FIELDS = (
+        Field('employee_id', arg='employee_id'),
+        Field('work_date', DATE, arg='work_date'),
+        Field('is_present', arg='is_present'),
+        Field('is_locked'),
+    )
+
+    def __init__(self, employee_id: int, work_date: date, is_present: bool = False):
         self.employee_id = employee_id
-        self.work_date = work_date
-        self.is_present = is_present
-        self.is_locked = False  # Становится True после сохранения
+        self.work_day = work_date.toordinal()
+        self._flags = self._PRESENT if is_present else 0
+
+    @property
+    def work_date(self) -> date:
+        return date.fromordinal(self.work_day)
+
+    @work_date.setter
+    def work_date(self, value: date):
+        self.work_day = value.toordinal()
+
+    @property
+    def is_present(self) -> bool:
+        return bool(self._flags & self._PRESENT)
+
+    @is_present.setter
+    def is_present(self, value: bool):
+        self._flags = (self._flags | self._PRESENT) if value else (self._flags & ~self._PRESENT)
+
+    @property
+    def is_locked(self) -> bool:
+        # Становится True после сохранения
+        return bool(self._flags & self._LOCKED)
+
+    @is_locked.setter
+    def is_locked(self, value: bool):
+        self._flags = (self._flags | self._LOCKED) if value else (self._flags & ~self._LOCKED)
+
+
+def payroll_period(today: date) -> tuple[date, date]:
+    """Период расчета зарплаты, в который попадает дата: 1-15 или 16-конец месяца"""
+    if today.day <= 15:
+        start_date = date(today.year, today.month, 1)
+        end_date = date(today.year, today.month, 15)
+    else:
+        start_date = date(today.year, today.month, 16)
+        # Последний день месяца
+        if today.month == 12:
+            end_date = date(today.year, today.month, 31)
+        else:
+            end_date = date(today.year, today.month + 1, 1) - timedelta(days=1)
+
+    return start_date, end_date
+
+
+class Timesheet(Segment):
+    __slots__ = ('chat_id', 'employees', 'attendance_records', 'archive', 'id_sequence')
 
+    FIELDS = (
+        Field('employees', MapOf(Employee)),
+        Field('attendance_records', ListOf(AttendanceRecord)),
+        Field('archive', Nested(Archive)),
+    )
 
-class Timesheet:
-    def __init__(self, chat_id: int):
+    def __init__(self, chat_id: int, id_sequence: Optional[IdSequence] = None):
+        super().__init__()
         self.chat_id = chat_id
-        self.employees: Dict[str, Employee] = {}
+        self.id_sequence = id_sequence or IdSequence()
+        self.employees: Dict[int, Employee] = {}
         self.attendance_records: List[AttendanceRecord] = []
+        # Заблокированные отметки закрытых периодов
+        self.archive = Archive()
 
     def add_employee(self, name: str, daily_salary: float) -> Employee:
-        employee = Employee(name, daily_salary)
+        employee = Employee(name, daily_salary, self.id_sequence.next_id())
         self.employees[employee.id] = employee
+        self.touch()
         return employee
 
-    def remove_employee(self, employee_id: str) -> bool:
+    def remove_employee(self, employee_id: int) -> bool:
         if employee_id in self.employees:
             # Удаляем все записи посещаемости для этого сотрудника
             self.attendance_records = [
                 record for record in self.attendance_records
                 if record.employee_id != employee_id
             ]
+            self.archive.remove_where(lambda record: record.employee_id == employee_id)
             del self.employees[employee_id]
+            self.touch()
             return True
         return False
 
-    def get_employee(self, employee_id: str) -> Optional[Employee]:
+    def get_employee(self, employee_id: int) -> Optional[Employee]:
         return self.employees.get(employee_id)
 
     def get_all_employees(self) -> List[Employee]:
         return list(self.employees.values())
 
-    def mark_attendance(self, employee_id: str, work_date: date, is_present: bool) -> bool:
+    def mark_attendance(self, employee_id: int, work_date: date, is_present: bool) -> bool:
         # Проверяем, не заблокирована ли уже запись на эту дату
         existing_record = self._find_attendance_record(employee_id, work_date)
         if existing_record and existing_record.is_locked:
@@ -57,26 +140,61 @@ class Timesheet:
         else:
             record = AttendanceRecord(employee_id, work_date, is_present)
             self.attendance_records.append(record)
+        self.touch()
         return True
 
     def lock_attendance_for_date(self, work_date: date):
         """Блокирует все записи на указанную дату"""
+        work_day = work_date.toordinal()
         for record in self.attendance_records:
-            if record.work_date == work_date:
+            if record.work_day == work_day:
                 record.is_locked = True
+        self.touch()
+
+    def lock_attendance_until(self, work_date: date) -> int:
+        """Блокирует все незаблокированные записи по указанную дату включительно (забытые дни тоже)"""
+        work_day = work_date.toordinal()
+        locked = 0
+        for record in self.attendance_records:
+            if record.work_day <= work_day and not record.is_locked:
+                record.is_locked = True
+                locked += 1
+        if locked:
+            self.touch()
+        return locked
 
     def is_date_locked(self, work_date: date) -> bool:
         """Проверяет, заблокирована ли дата для изменений"""
-        records_for_date = [r for r in self.attendance_records if r.work_date == work_date]
-        return any(record.is_locked for record in records_for_date)
-
-    def get_attendance_for_period(self, employee_id: str, start_date: date, end_date: date) -> List[AttendanceRecord]:
+        work_day = work_date.toordinal()
+        return any(record.is_locked for record in self.attendance_records if record.work_day == work_day)
+
+    def get_attendance_for_period(self, employee_id: int, start_date: date, end_date: date) -> List[AttendanceRecord]:
+        start_day, end_day = start_date.toordinal(), end_date.toordinal()
+        records = self.attendance_records
+        if self.archive and start_date < self.get_current_period()[0]:
+            # Период захватывает закрытые - их отметки в архиве
+            records = chain(self.archive.records(), records)
         return [
-            record for record in self.attendance_records
-            if record.employee_id == employee_id and start_date <= record.work_date <= end_date
+            record for record in records
+            if record.employee_id == employee_id and start_day <= record.work_day <= end_day
         ]
 
-    def calculate_salary_for_period(self, employee_id: str, start_date: date, end_date: date) -> float:
+    def archive_closed_periods(self, today: Optional[date] = None) -> int:
+        """Переносит в архив заблокированные отметки периодов до текущего"""
+        period_start = self.get_current_period(today)[0].toordinal()
+        hot, cold = [], []
+        for record in self.attendance_records:
+            if record.is_locked and record.work_day < period_start:
+                cold.append(record)
+            else:
+                hot.append(record)
+        if cold:
+            self.attendance_records = hot
+            self.archive.add(cold)
+            self.touch()
+        return len(cold)
+
+    def calculate_salary_for_period(self, employee_id: int, start_date: date, end_date: date) -> float:
         employee = self.get_employee(employee_id)
         if not employee:
             return 0.0
@@ -86,24 +204,13 @@ class Timesheet:
 
         return working_days * employee.daily_salary
 
-    def get_current_period(self) -> tuple[date, date]:
+    def get_current_period(self, today: Optional[date] = None) -> tuple[date, date]:
         """Возвращает даты текущего периода (1-15 или 16-конец месяца)"""
-        today = date.today()
-        if today.day <= 15:
-            start_date = date(today.year, today.month, 1)
-            end_date = date(today.year, today.month, 15)
-        else:
-            start_date = date(today.year, today.month, 16)
-            # Последний день месяца
-            if today.month == 12:
-                end_date = date(today.year, today.month, 31)
-            else:
-                end_date = date(today.year, today.month + 1, 1) - timedelta(days=1)
-
-        return start_date, end_date
+        return payroll_period(today or date.today())
 
-    def _find_attendance_record(self, employee_id: str, work_date: date) -> Optional[AttendanceRecord]:
+    def _find_attendance_record(self, employee_id: int, work_date: date) -> Optional[AttendanceRecord]:
+        work_day = work_date.toordinal()
         for record in self.attendance_records:
-            if record.employee_id == employee_id and record.work_date == work_date:
+            if record.employee_id == employee_id and record.work_day == work_day:
                 return record
-        return None
\ No newline at end of file
+        return None
@@ -1,19 +1,57 @@
+import sys
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
+from .archive import Archive
 from .timesheet import Timesheet
 from .construction import ConstructionManager
 from .running_list import RunningList
+from .ids import IdSequence
+from .conversation import Conversation
+from .schema import DATETIME, Field, ListOf, Nested
+from .segment import Segment
+
+# Точка отсчета для компактного хранения даты расхода (секунды с эпохи, без учета часового пояса)
+_EPOCH = datetime(1970, 1, 1)
+
+# Расходы старше самого длинного периода отчета (3 месяца, FinanceBot._handle_period_selection) уходят в архив
+EXPENSE_ARCHIVE_DAYS = 90
+# Выполненные задачи и завершенные объекты остаются в рабочих данных еще неделю
+COMPLETED_ARCHIVE_DAYS = 7
 
 
 class Expense:
+    __slots__ = ('category', 'amount', 'description', 'type', '_timestamp')
+
+    FIELDS = (
+        Field('date', DATETIME, arg='date'),
+        Field('category', arg='category'),
+        Field('amount', arg='amount'),
+        Field('description', arg='description'),
+        Field('type', arg='expense_type'),
+    )
+
     def __init__(self, category: str, amount: float, description: str, expense_type: str,
                  date: Optional[datetime] = None):
-        self.category = category
+        # Категорий и типов немного, а записей - сотни тысяч: храним одну копию каждой строки
+        self.category = sys.intern(category)
         self.amount = amount
         self.description = description
-        self.type = expense_type
+        self.type = sys.intern(expense_type)
         self.date = date or datetime.now()
 
+    @property
+    def date(self) -> datetime:
+        return _EPOCH + timedelta(seconds=self._timestamp)
+
+    @date.setter
+    def date(self, value: datetime):
+        # float (24 байта) вместо datetime (48 байт); точность - до микросекунд
+        self._timestamp = (value - _EPOCH).total_seconds()
+
+    @property
+    def timestamp(self) -> float:
+        return self._timestamp
+
     def to_dict(self):
         return {
             'date': self.date,
@@ -24,26 +62,177 @@ class Expense:
         }
 
 
-class UserData:
-    def __init__(self, chat_id: int):
+class ExpenseBook(Segment):
+    """Раздел расходов: последние EXPENSE_ARCHIVE_DAYS дней в памяти, более старые - в архиве"""
+    __slots__ = ('chat_id', 'expenses', 'archive')
+
+    FIELDS = (
+        Field('expenses', ListOf(Expense)),
+        Field('archive', Nested(Archive)),
+    )
+
+    def __init__(self, chat_id: int, id_sequence: Optional[IdSequence] = None):
+        super().__init__()
         self.chat_id = chat_id
         self.expenses: List[Expense] = []
-        self.state: str = 'main_menu'
-        self.timesheet = Timesheet(chat_id)
-        self.construction_manager = ConstructionManager(chat_id)
-        self.running_list = RunningList(chat_id)
+        self.archive = Archive()
 
     def add_expense(self, expense: Expense):
         self.expenses.append(expense)
+        self.touch()
 
-    def clear_expenses(self):
-        count = len(self.expenses)
+    def clear(self) -> int:
+        count = len(self.expenses) + self.archive.clear()
         self.expenses = []
+        self.touch()
         return count
 
     def get_expenses_by_period(self, period_days: int) -> List[Expense]:
-        cutoff_date = datetime.now() - timedelta(days=period_days)
-        return [exp for exp in self.expenses if exp.date >= cutoff_date]
+        # Периоды отчетов не длиннее EXPENSE_ARCHIVE_DAYS - архив не нужен
+        cutoff = (datetime.now() - timedelta(days=period_days) - _EPOCH).total_seconds()
+        return [exp for exp in self.expenses if exp.timestamp >= cutoff]
+
+    def archive_before(self, before: datetime) -> int:
+        """Переносит в архив расходы старше before"""
+        cutoff = (before - _EPOCH).total_seconds()
+        hot, cold = [], []
+        for expense in self.expenses:
+            if expense.timestamp < cutoff:
+                cold.append(expense)
+            else:
+                hot.append(expense)
+        if cold:
+            self.expenses = hot
+            self.archive.add(cold)
+            self.touch()
+        return len(cold)
+
+
+class UserData:
+    __slots__ = ('chat_id', 'conversation', 'id_sequence', 'segment_versions', 'segment_loader', 'timers',
+                 '_expense_book', '_timesheet', '_construction_manager', '_running_list')
+
+    # Заголовок файла пользователя (bot/models/schema.py); разделы хранятся отдельными файлами (SEGMENTS),
+    # conversation - в ConversationStore
+    FIELDS = (
+        Field('chat_id', arg='chat_id'),
+        Field('last_id', attr='id_sequence.last_id', default=0),
+        Field('timers', optional=True, default=None),
+    )
+
+    # Разделы: имя -> слот с контейнером и его класс
+    SEGMENTS = {
+        'expenses': ('_expense_book', ExpenseBook),
+        'timesheet': ('_timesheet', Timesheet),
+        'construction': ('_construction_manager', ConstructionManager),
+        'running_list': ('_running_list', RunningList),
+    }
+
+    def __init__(self, chat_id: int, segment_loader: Optional[Callable[['UserData', str], Segment]] = None):
+        self.chat_id = chat_id
+        # Экран и контексты диалогов; хранятся в ConversationStore, а не в файле пользователя
+        self.conversation = Conversation(chat_id)
+        # Один счетчик на пользователя: id сотрудников, объектов и задач не пересекаются
+        self.id_sequence = IdSequence()
+        # Номера записанных на диск версий разделов (ведет хранилище)
+        self.segment_versions: Dict[str, int] = {}
+        # Сроки таймеров пользователя (секунды эпохи) по имени, чтобы пережить перезапуск
+        # (TimesheetTimers, TaskReminders); None - таймеры еще не заводились
+        self.timers: Optional[Dict[str, float]] = None
+        # Загружает раздел при первом обращении; без загрузчика (новый пользователь) разделы создаются сразу
+        self.segment_loader = segment_loader
+        for name, (slot, _) in self.SEGMENTS.items():
+            setattr(self, slot, None if segment_loader is not None else self.create_segment(name))
+
+    def create_segment(self, name: str) -> Segment:
+        return self.SEGMENTS[name][1](self.chat_id, self.id_sequence)
+
+    def loaded(self, name: str) -> Optional[Segment]:
+        """Раздел, если он уже в памяти (без загрузки)"""
+        return getattr(self, self.SEGMENTS[name][0])
+
+    def set_segment(self, name: str, segment: Segment):
+        setattr(self, self.SEGMENTS[name][0], segment)
+
+    def loaded_segments(self) -> Dict[str, Segment]:
+        return {name: segment for name in self.SEGMENTS if (segment := self.loaded(name)) is not None}
+
+    def segment(self, name: str) -> Segment:
+        """Раздел; если его еще нет в памяти - загружается"""
+        segment = self.loaded(name)
+        if segment is None:
+            segment = self.segment_loader(self, name)
+        return segment
+
+    def set_timer(self, name: str, when: float):
+        # Новый словарь, а не правка на месте: заголовок может кодироваться в другом потоке
+        self.timers = dict(self.timers or {}, **{name: when})
+
+    def drop_timer(self, name: str):
+        timers = dict(self.timers or {})
+        timers.pop(name, None)
+        self.timers = timers
+
+    @property
+    def expense_book(self) -> ExpenseBook:
+        segment = self._expense_book
+        return segment if segment is not None else self.segment('expenses')
+
+    @property
+    def timesheet(self) -> Timesheet:
+        segment = self._timesheet
+        return segment if segment is not None else self.segment('timesheet')
+
+    @property
+    def construction_manager(self) -> ConstructionManager:
+        segment = self._construction_manager
+        return segment if segment is not None else self.segment('construction')
+
+    @property
+    def running_list(self) -> RunningList:
+        segment = self._running_list
+        return segment if segment is not None else self.segment('running_list')
+
+    @property
+    def expenses(self) -> List[Expense]:
+        return self.expense_book.expenses
+
+    @property
+    def state(self) -> str:
+        return self.conversation.state
+
+    @state.setter
+    def state(self, value: str):
+        self.conversation.state = value
+
+    def add_expense(self, expense: Expense):
+        self.expense_book.add_expense(expense)
+
+    def clear_expenses(self):
+        return self.expense_book.clear()
+
+    def get_expenses_by_period(self, period_days: int) -> List[Expense]:
+        return self.expense_book.get_expenses_by_period(period_days)
+
+    def get_all_expenses(self) -> List[Expense]:
+        """Все расходы вместе с архивом (архив читается с диска)"""
+        book = self.expense_book
+        return book.archive.records() + book.expenses
 
     def get_total_expenses(self) -> float:
-        return sum(exp.amount for exp in self.expenses)
\ No newline at end of file
+        return sum(exp.amount for exp in self.get_all_expenses())
+
+    def archive_cold(self, now: Optional[datetime] = None) -> int:
+        """Переносит холодные записи загруженных разделов в архив; возвращает число перенесенных"""
+        now = now or datetime.now()
+        completed_before = now - timedelta(days=COMPLETED_ARCHIVE_DAYS)
+        moved = 0
+        if self._expense_book is not None:
+            moved += self._expense_book.archive_before(now - timedelta(days=EXPENSE_ARCHIVE_DAYS))
+        if self._running_list is not None:
+            moved += self._running_list.archive_completed(completed_before)
+        if self._construction_manager is not None:
+            moved += self._construction_manager.archive_completed(completed_before)
+        if self._timesheet is not None:
+            moved += self._timesheet.archive_closed_periods(now.date())
+        return moved
@@ -0,0 +1,245 @@
+import glob
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from .logging_service import get_logger
+from .metrics_service import BACKUP_BYTES, BACKUP_DURATION, BACKUP_FILES
+from .storage_manifest import UserManifest
+
+logger = get_logger('backup')
+
+# Сколько последних копий хранить; объекты, на которые они не ссылаются, удаляются
+BACKUP_KEEP = 14
+# Общие файлы папки данных, которые попадают в копию целиком
+SHARED_FILES = ('bot_state.json', 'conversations*.json')
+
+
+class _Snapshot:
+    """
+    Снимок на момент начала копии. Файлы пользователя читаются либо обходом,
+    либо перед первой перезаписью после начала (storage.before_write) - что случится раньше,
+    поэтому в копию попадает состояние на момент начала, а обработка апдейтов не останавливается.
+    Пользователь, чья версия не менялась с прошлой копии, не читается: берутся ссылки из нее.
+    """
+
+    def __init__(self, backups: 'BackupService', previous: Dict[str, dict]):
+        self.backups = backups
+        self.previous = previous
+        self.users: Dict[str, dict] = {}
+        self.read = self.reused = 0
+
+    def capture(self, chat_id: int):
+        # Вызывается под storage.user_lock(chat_id): файлы пользователя сейчас никто не пишет.
+        # Пользователь, появившийся после начала, попадает сюда без файлов и в копию не идет
+        key = str(chat_id)
+        if key in self.users:
+            return
+        storage = self.backups.storage_service
+        version = storage.manifest.version(chat_id)
+        previous = self.previous.get(key)
+        if previous is not None and version and previous['version'] == version:
+            self.users[key] = previous
+            self.reused += 1
+            return
+        files = {}
+        for path in storage.user_files(chat_id):
+            files[os.path.relpath(path, storage.storage_dir)] = self.backups.put_file(path)
+        self.users[key] = {'version': version, 'files': files}
+        self.read += 1
+
+
+class BackupService:
+    """
+    Резервные копии папки данных в backup_dir:
+    objects/<xx>/<sha256>.gz - содержимое файлов (gzip), одинаковые файлы хранятся один раз;
+    <id>.json.gz - опись копии: файлы каждого пользователя и общие файлы со ссылками на объекты.
+    Первая копия полная, следующие читают только пользователей, сохранявшихся после предыдущей.
+    """
+
+    def __init__(self, storage_service, backup_dir: str, keep: int = BACKUP_KEEP):
+        self.storage_service = storage_service
+        self.backup_dir = backup_dir
+        self.objects_dir = os.path.join(backup_dir, 'objects')
+        self.keep = keep
+        self._running = threading.Lock()
+        self._stop = threading.Event()
+        self._stored_bytes = 0
+
+    # Объекты и описи
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}.gz")
+
+    def put_file(self, path: str) -> str:
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        target = self._object_path(digest)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            packed = gzip.compress(content, compresslevel=6, mtime=0)
+            # Один и тот же объект могут писать одновременно обход и перехват записи - у каждого свой tmp
+            tmp = f"{target}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(packed)
+            os.replace(tmp, target)
+            self._stored_bytes += len(packed)
+            BACKUP_FILES.inc(outcome='stored')
+        else:
+            BACKUP_FILES.inc(outcome='deduplicated')
+        return digest
+
+    def _get_object(self, digest: str) -> bytes:
+        with open(self._object_path(digest), 'rb') as f:
+            content = gzip.decompress(f.read())
+        if hashlib.sha256(content).hexdigest() != digest:
+            raise ValueError(f"Объект {digest} поврежден")
+        return content
+
+    def _index_path(self, backup_id: str) -> str:
+        return os.path.join(self.backup_dir, f"{backup_id}.json.gz")
+
+    def list_backups(self) -> List[str]:
+        """Id копий от старых к новым"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        return sorted(name[:-len('.json.gz')] for name in os.listdir(self.backup_dir) if name.endswith('.json.gz'))
+
+    def load_index(self, backup_id: str) -> dict:
+        with gzip.open(self._index_path(backup_id), 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    # Создание копии
+
+    def create(self) -> Optional[dict]:
+        """Делает копию; возвращает ее статистику (None - другая копия еще идет)"""
+        if not self._running.acquire(blocking=False):
+            logger.warning("Копия уже создается, пропускаем")
+            return None
+        try:
+            return self._create()
+        finally:
+            self._running.release()
+
+    def _create(self) -> dict:
+        start = time.perf_counter()
+        storage = self.storage_service
+        backups = self.list_backups()
+        previous = self.load_index(backups[-1]) if backups else None
+        backup_id = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        self._stored_bytes = 0
+
+        snapshot = _Snapshot(self, previous['users'] if previous else {})
+        # Сначала перехват записи, потом список: пользователь, сохраненный после этого момента,
+        # будет прочитан до перезаписи
+        storage.before_write = snapshot.capture
+        try:
+            members = storage.list_users()
+            shared = {}
+            for pattern in SHARED_FILES:
+                for path in sorted(glob.glob(os.path.join(storage.storage_dir, pattern))):
+                    shared[os.path.relpath(path, storage.storage_dir)] = self.put_file(path)
+            for chat_id in sorted(members):
+                with storage.user_lock(chat_id):
+                    snapshot.capture(chat_id)
+        finally:
+            storage.before_write = None
+
+        users = {key: entry for key, entry in snapshot.users.items() if entry['files']}
+        index = {
+            'id': backup_id,
+            'created': datetime.now().isoformat(),
+            'parent': previous['id'] if previous else None,
+            'users': users,
+            'shared': shared,
+        }
+        os.makedirs(self.backup_dir, exist_ok=True)
+        path = self._index_path(backup_id)
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8', compresslevel=6) as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+        self._prune()
+
+        duration = time.perf_counter() - start
+        BACKUP_DURATION.observe(duration)
+        BACKUP_BYTES.inc(self._stored_bytes)
+        stats = {'id': backup_id, 'users': len(users), 'read': snapshot.read, 'reused': snapshot.reused,
+                 'stored_bytes': self._stored_bytes, 'seconds': round(duration, 3)}
+        logger.info("Резервная копия %s: пользователей %s, прочитано %s, без изменений %s, записано байт %s",
+                    backup_id, len(users), snapshot.read, snapshot.reused, self._stored_bytes)
+        return stats
+
+    def _prune(self):
+        """Удаляет копии сверх keep и объекты, на которые больше никто не ссылается"""
+        backups = self.list_backups()
+        if len(backups) <= self.keep:
+            return
+        for backup_id in backups[:-self.keep]:
+            os.remove(self._index_path(backup_id))
+
+        referenced = set()
+        for backup_id in backups[-self.keep:]:
+            index = self.load_index(backup_id)
+            referenced.update(index['shared'].values())
+            for entry in index['users'].values():
+                referenced.update(entry['files'].values())
+        removed = 0
+        for path in glob.glob(os.path.join(self.objects_dir, '*', '*.gz')):
+            if os.path.basename(path)[:-3] not in referenced:
+                os.remove(path)
+                removed += 1
+        logger.info("Удалено старых копий: %s, объектов: %s", len(backups) - self.keep, removed)
+
+    # Восстановление
+
+    def restore(self, backup_id: str, target_dir: str, force: bool = False) -> int:
+        """Разворачивает копию в target_dir (папка данных); возвращает число пользователей"""
+        index = self.load_index(backup_id)
+        users_dir = os.path.join(target_dir, 'users')
+        if os.path.isdir(users_dir):
+            if not force:
+                raise FileExistsError(f"В {target_dir} уже есть данные пользователей; для замены нужен force")
+            # Замена, а не слияние: пользователи, которых нет в копии, тоже уходят
+            shutil.rmtree(users_dir)
+
+        files = dict(index['shared'])
+        for entry in index['users'].values():
+            files.update(entry['files'])
+        for relpath, digest in files.items():
+            path = os.path.join(target_dir, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(self._get_object(digest))
+            os.replace(path + '.tmp', path)
+
+        # Манифест старой папки к восстановленным файлам не относится - строим заново
+        manifest = UserManifest(target_dir)
+        for path in (manifest.snapshot_path, manifest.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
+        manifest.rebuild(os.path.join(target_dir, 'users'))
+        logger.info("Копия %s восстановлена в %s: пользователей %s, файлов %s",
+                    backup_id, target_dir, len(index['users']), len(files))
+        return len(index['users'])
+
+    # Фоновые копии
+
+    def start(self, interval: float):
+        threading.Thread(target=self._run, args=(interval,), name='backup', daemon=True).start()
+
+    def _run(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.create()
+            except Exception as e:
+                logger.exception("Ошибка создания резервной копии: %s", e)
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,179 @@
+import base64
+import binascii
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from ..models.construction import ConstructionStage
+from ..models.running_list import TaskPriority
+
+# Формат callback_data версии 1:
+#   "!" + версия (1 символ) + код действия (1 символ) + base64url(varint-аргументы) без "="
+# Например select_object с id=42 кодируется в "!1oKg" (4 байта вместо "select_object:1763078468.604826").
+CALLBACK_PREFIX = "!"
+CALLBACK_VERSION = 1
+
+# Лимит Telegram на callback_data
+CALLBACK_DATA_LIMIT = 64
+
+ACTION_CODES: Dict[str, str] = {
+    # Табель
+    'toggle_attendance': 'a',
+    'save_attendance': 's',
+    'back_to_timesheet': 't',
+    'remove_employee': 'r',
+    # Строительные объекты
+    'select_object': 'o',
+    'obj_responsible': 'p',
+    'obj_comments': 'c',
+    'view_comments': 'v',
+    'add_comment': 'm',
+    'obj_next_stage': 'n',
+    'obj_complete': 'x',
+    'confirm_complete': 'y',
+    'resp_stage': 'g',
+    'add_resp': 'e',
+    'remove_resp': 'd',
+    'back_to_object': 'b',
+    'back_to_construction': 'B',
+    'back_to_objects': 'O',
+    # Running List
+    'priority': 'P',
+    # Поиск
+    'find_page': 'f',
+}
+ACTIONS_BY_CODE: Dict[str, str] = {code: action for action, code in ACTION_CODES.items()}
+
+_STAGES = list(ConstructionStage)
+_PRIORITIES = list(TaskPriority)
+
+# Аргументы-перечисления в старом текстовом формате передавались именами
+_LEGACY_ENUM_ARGS = {
+    'view_comments': (1, ConstructionStage),
+    'add_comment': (1, ConstructionStage),
+    'resp_stage': (1, ConstructionStage),
+    'priority': (0, TaskPriority),
+}
+
+
+class CallbackDecodeError(ValueError):
+    pass
+
+
+class CallbackData(NamedTuple):
+    action: str
+    args: Tuple[int, ...]
+
+
+def stage_index(stage: ConstructionStage) -> int:
+    return _STAGES.index(stage)
+
+
+def stage_from_index(index: int) -> Optional[ConstructionStage]:
+    return _STAGES[index] if 0 <= index < len(_STAGES) else None
+
+
+def priority_index(priority: TaskPriority) -> int:
+    return _PRIORITIES.index(priority)
+
+
+def priority_from_index(index: int) -> Optional[TaskPriority]:
+    return _PRIORITIES[index] if 0 <= index < len(_PRIORITIES) else None
+
+
+def _pack_varints(values) -> bytes:
+    out = bytearray()
+    for value in values:
+        if value < 0:
+            raise ValueError("Аргументы callback должны быть неотрицательными")
+        while True:
+            byte = value & 0x7F
+            value >>= 7
+            if value:
+                out.append(byte | 0x80)
+            else:
+                out.append(byte)
+                break
+    return bytes(out)
+
+
+def _unpack_varints(data: bytes) -> Tuple[int, ...]:
+    values = []
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+    if shift:
+        raise CallbackDecodeError("Обрезанный varint в callback_data")
+    return tuple(values)
+
+
+def encode_callback(action: str, *args: int) -> str:
+    """Кодирует действие и целочисленные аргументы в компактную строку callback_data"""
+    payload = base64.urlsafe_b64encode(_pack_varints(args)).rstrip(b"=").decode('ascii')
+    data = f"{CALLBACK_PREFIX}{CALLBACK_VERSION}{ACTION_CODES[action]}{payload}"
+    if len(data) > CALLBACK_DATA_LIMIT:
+        raise ValueError(f"callback_data длиннее {CALLBACK_DATA_LIMIT} байт: {data}")
+    return data
+
+
+def _decode_v1(body: str) -> CallbackData:
+    if not body:
+        raise CallbackDecodeError("Пустой callback_data")
+    action = ACTIONS_BY_CODE.get(body[0])
+    if action is None:
+        raise CallbackDecodeError(f"Неизвестный код действия: {body[0]}")
+    payload = body[1:]
+    try:
+        raw = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)) if payload else b""
+    except (binascii.Error, ValueError) as e:
+        raise CallbackDecodeError(f"Битый base64 в callback_data: {payload}") from e
+    return CallbackData(action, _unpack_varints(raw))
+
+
+def _decode_legacy(data: str) -> CallbackData:
+    """Старый формат "action:arg1:arg2" - кнопки, отправленные до перехода на кодек"""
+    action, *raw_args = data.split(":")
+    if action not in ACTION_CODES:
+        raise CallbackDecodeError(f"Неизвестное действие: {action}")
+
+    args = []
+    enum_arg = _LEGACY_ENUM_ARGS.get(action)
+    for position, raw in enumerate(raw_args):
+        if enum_arg and enum_arg[0] == position:
+            members = list(enum_arg[1])
+            member = enum_arg[1].__members__.get(raw)
+            if member is None:
+                raise CallbackDecodeError(f"Неизвестное значение {raw} для {action}")
+            args.append(members.index(member))
+        elif raw.isdigit():
+            args.append(int(raw))
+        else:
+            # Старые id вида "1763078468.604826" после миграции не существуют
+            raise CallbackDecodeError(f"Устаревший аргумент {raw} для {action}")
+    return CallbackData(action, tuple(args))
+
+
+_DECODERS = {
+    1: _decode_v1,
+}
+
+
+def decode_callback(data: str) -> CallbackData:
+    """Разбирает callback_data любой поддерживаемой версии"""
+    if not data.startswith(CALLBACK_PREFIX):
+        return _decode_legacy(data)
+
+    try:
+        version = int(data[1])
+    except (IndexError, ValueError):
+        raise CallbackDecodeError(f"Некорректная версия callback_data: {data}")
+
+    decoder = _DECODERS.get(version)
+    if decoder is None:
+        raise CallbackDecodeError(f"Неподдерживаемая версия callback_data: {version}")
+    return decoder(data[2:])
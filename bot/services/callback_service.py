@@ -0,0 +1,197 @@
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from telebot import types
+
+from .callback_codec import CallbackData, CallbackDecodeError, decode_callback
+from .logging_service import get_logger
+from .metrics_service import CALLBACKS
+
+logger = get_logger('callbacks')
+
+STALE_KEYBOARD_TEXT = "⚠️ Это меню устарело, используйте последнее сообщение"
+
+# Нажатия в разделе чата в течение этого времени (сек) после предыдущего обрабатываются одной пачкой
+DEBOUNCE_SECONDS = 0.3
+
+Batch = List[Tuple[object, CallbackData]]
+
+
+def answer_callback(bot, call, text: Optional[str] = None, show_alert: bool = False) -> bool:
+    """Отвечает на callback-запрос ровно один раз; повторные вызовы ничего не делают"""
+    if getattr(call, 'acknowledged', False):
+        return False
+    call.acknowledged = True
+    try:
+        bot.answer_callback_query(call.id, text, show_alert=show_alert)
+    except Exception as e:
+        # Запрос мог устареть (ответ позже 15 секунд) - на обработку это не влияет
+        logger.warning("Не удалось ответить на callback %s: %s", call.id, e)
+    return True
+
+
+class CallbackPipeline:
+    """
+    Обработка нажатий inline-кнопок:
+    - ответ Telegram сразу при получении (кроме действий, которые сами показывают всплывающий текст);
+    - нажатия на клавиатуру старше последней отправленной клавиатуры того же раздела отбрасываются;
+    - первое нажатие в разделе чата обрабатывается сразу, следующие в течение debounce секунд после него
+      копятся и обрабатываются одной пачкой по таймеру scheduler: одно изменение состояния и одна перерисовка.
+      Окно продлевается, пока нажатия идут. Без scheduler (или debounce=0) копятся только нажатия,
+      пришедшие во время обработки предыдущего. Действия вне разделов обрабатываются сразу и не копятся.
+    """
+
+    def __init__(self, bot, groups: Dict[str, Iterable[str]], toast_actions: Iterable[str] = (),
+                 scheduler=None, debounce: float = DEBOUNCE_SECONDS):
+        self.bot = bot
+        # действие -> раздел (клавиатуры одного раздела вытесняют друг друга)
+        self.groups = {action: group for group, actions in groups.items() for action in actions}
+        self.toast_actions = frozenset(toast_actions)
+        self.scheduler = scheduler
+        self.debounce = debounce if scheduler is not None else 0.0
+        self._latest: Dict[Tuple[int, str], int] = {}
+        # (чат, раздел) -> нажатия, ждущие окончания окна; ключа нет - окно закрыто
+        self._windows: Dict[Tuple[int, str], Batch] = {}
+        self._handlers: Dict[Tuple[int, str], Callable[[Batch], None]] = {}
+        self._lock = threading.Lock()
+
+    # Учет отправленных клавиатур
+
+    def install(self):
+        """Оборачивает bot.send_message, чтобы запоминать последнюю клавиатуру каждого раздела"""
+        send_message = self.bot.send_message
+
+        def send_and_track(chat_id, text, *args, **kwargs):
+            message = send_message(chat_id, text, *args, **kwargs)
+            markup = kwargs.get('reply_markup')
+            if isinstance(markup, types.InlineKeyboardMarkup) and message is not None:
+                self.keyboard_sent(chat_id, markup, message.message_id)
+            return message
+
+        self.bot.send_message = send_and_track
+
+    def _keyboard_group(self, markup: types.InlineKeyboardMarkup) -> Optional[str]:
+        for row in markup.keyboard:
+            for button in row:
+                if not button.callback_data:
+                    continue
+                try:
+                    group = self.groups.get(decode_callback(button.callback_data).action)
+                except CallbackDecodeError:
+                    continue
+                if group is not None:
+                    return group
+        return None
+
+    def keyboard_sent(self, chat_id: int, markup: types.InlineKeyboardMarkup, message_id: int):
+        group = self._keyboard_group(markup)
+        if group is None:
+            return
+        with self._lock:
+            key = (chat_id, group)
+            if message_id > self._latest.get(key, 0):
+                self._latest[key] = message_id
+
+    def is_stale(self, call, callback: CallbackData) -> bool:
+        group = self.groups.get(callback.action)
+        if group is None:
+            return False
+        latest = self._latest.get((call.message.chat.id, group))
+        return latest is not None and call.message.message_id < latest
+
+    # Обработка
+
+    def dispatch(self, call, callback: CallbackData, handle: Callable[[Batch], None]):
+        """
+        Передает нажатие в handle(пачка нажатий). Если в разделе чата открыто окно (недавнее
+        или еще обрабатываемое нажатие), нажатие копится и уйдет следующей пачкой.
+        """
+        if self.is_stale(call, callback):
+            CALLBACKS.inc(outcome='stale')
+            answer_callback(self.bot, call, STALE_KEYBOARD_TEXT)
+            return
+
+        group = self.groups.get(callback.action)
+        if group is None:
+            if callback.action not in self.toast_actions:
+                answer_callback(self.bot, call)
+            self._handle(handle, [(call, callback)])
+            return
+
+        # Сначала открываем окно, потом отвечаем: нажатия, пришедшие во время ответа, уже попадут в него
+        key = (call.message.chat.id, group)
+        with self._lock:
+            pending = self._windows.get(key)
+            queued = pending is not None
+            if queued:
+                pending.append((call, callback))
+            else:
+                self._windows[key] = []
+                self._handlers[key] = handle
+
+        if callback.action not in self.toast_actions:
+            answer_callback(self.bot, call)
+        if queued:
+            CALLBACKS.inc(outcome='queued')
+            return
+
+        try:
+            self._handle(handle, [(call, callback)])
+        except Exception:
+            self._close(key)
+            raise
+        if self.debounce > 0:
+            self.scheduler.schedule(('callback_window', key), self.scheduler.clock() + self.debounce, self._flush)
+            return
+        # Без окна по времени: пачками дообрабатываем то, что пришло во время обработки
+        while self._next_batch(key):
+            pass
+
+    def _handle(self, handle: Callable[[Batch], None], batch: Batch):
+        CALLBACKS.inc(outcome='batch')
+        handle(batch)
+        for handled_call, _ in batch:
+            # Действие с всплывающим текстом не ответило само - убираем часики без текста
+            answer_callback(self.bot, handled_call)
+
+    def _next_batch(self, key: Tuple[int, str]) -> bool:
+        """Обрабатывает накопленную пачку; False - копить нечего, окно закрыто"""
+        with self._lock:
+            batch = self._windows.get(key)
+            if not batch:
+                # Под той же блокировкой: новое нажатие либо уже в batch, либо откроет свое окно
+                self._windows.pop(key, None)
+                self._handlers.pop(key, None)
+                return False
+            self._windows[key] = []
+            handle = self._handlers[key]
+        try:
+            self._handle(handle, batch)
+        except Exception:
+            self._close(key)
+            raise
+        return True
+
+    def _flush(self, timer_key, when: float):
+        # Поток планировщика: окно истекло - пачка накопленных нажатий; пока нажатия идут, окно продлевается
+        key = timer_key[1]
+        if self._next_batch(key):
+            self.scheduler.schedule(timer_key, self.scheduler.clock() + self.debounce, self._flush)
+
+    def flush(self, owned: Optional[Callable[[int], bool]] = None):
+        """Сразу обрабатывает накопленные нажатия (owned - только этих чатов) и закрывает их окна"""
+        with self._lock:
+            keys = [key for key in self._windows if owned is None or owned(key[0])]
+        for key in keys:
+            if self.scheduler is not None:
+                self.scheduler.cancel(('callback_window', key))
+            while self._next_batch(key):
+                pass
+
+    def _close(self, key: Tuple[int, str]):
+        # Накопленные нажатия не будут обработаны - хотя бы убираем у них часики
+        with self._lock:
+            leftover = self._windows.pop(key, [])
+            self._handlers.pop(key, None)
+        for left_call, _ in leftover:
+            answer_callback(self.bot, left_call)
@@ -0,0 +1,117 @@
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from ..models.conversation import Conversation
+from .logging_service import get_logger
+from .metrics_service import CONVERSATIONS_EXPIRED
+
+logger = get_logger('conversations')
+
+# Диалог, брошенный дольше этого (сек), сбрасывается в главное меню
+FLOW_TTL = 24 * 3600
+# Как часто изменившиеся состояния диалогов пишутся на диск (сек)
+DUMP_INTERVAL = 10.0
+
+
+class ConversationStore:
+    """
+    Состояния диалогов (экран и контексты) всех пользователей, отдельно от их данных.
+    В памяти; на диск - компактным файлом раз в DUMP_INTERVAL и только если что-то менялось,
+    причем пишутся только пользователи вне главного меню. Переход по меню файл пользователя не трогает.
+    Диалоги, брошенные дольше ttl, сбрасываются в главное меню.
+    partition(chat_id) - имя файла для чата: у воркеров (bot/cluster.py) свой файл на шард,
+    так что файл пишет только владелец шарда.
+    """
+
+    def __init__(self, storage_service, partition: Optional[Callable[[int], str]] = None,
+                 owns_chat: Optional[Callable[[int], bool]] = None, ttl: float = FLOW_TTL):
+        self.storage_service = storage_service
+        self.partition = partition or (lambda chat_id: 'conversations')
+        self.ttl = ttl
+        self._conversations: Dict[int, Conversation] = {}
+        self._lock = threading.Lock()
+        self._dumped_at: Dict[str, float] = {}
+        self._stop = threading.Event()
+        self.load(owns_chat)
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def load(self, owned: Optional[Callable[[int], bool]] = None) -> int:
+        """Читает сохраненные диалоги (owned - только этих чатов); брошенные не восстанавливаются"""
+        now = time.time()
+        loaded = {}
+        for key, data in self.storage_service.load_conversations().items():
+            chat_id = int(key)
+            if (owned is None or owned(chat_id)) and now - data[1] <= self.ttl:
+                loaded[chat_id] = Conversation.from_list(chat_id, data)
+        with self._lock:
+            self._conversations.update(loaded)
+        return len(loaded)
+
+    def adopt(self, user_data):
+        """Связывает пользователя с его сохраненным диалогом (или берет в учет его новый)"""
+        with self._lock:
+            conversation = self._conversations.get(user_data.chat_id)
+            if conversation is None:
+                self._conversations[user_data.chat_id] = user_data.conversation
+            else:
+                user_data.conversation = conversation
+        return user_data
+
+    def forget(self, owned: Callable[[int], bool]):
+        """Убирает чаты из хранилища (шард передан другому воркеру); перед этим сохраняет их последнее состояние"""
+        self.dump(force=True)
+        with self._lock:
+            chat_ids = [chat_id for chat_id in self._conversations if owned(chat_id)]
+            for chat_id in chat_ids:
+                self._conversations.pop(chat_id, None)
+            for name in {self.partition(chat_id) for chat_id in chat_ids}:
+                self._dumped_at.pop(name, None)
+
+    def expire(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        expired = 0
+        with self._lock:
+            for conversation in self._conversations.values():
+                if not conversation.is_default and now - conversation.touched_at > self.ttl:
+                    conversation.reset()
+                    expired += 1
+        if expired:
+            CONVERSATIONS_EXPIRED.inc(expired)
+            logger.info("Сброшено брошенных диалогов: %s", expired)
+        return expired
+
+    def dump(self, force: bool = False) -> int:
+        """Пишет файлы, в которых с прошлой записи какой-то диалог менялся; возвращает число файлов"""
+        with self._lock:
+            partitions: Dict[str, Dict[int, Conversation]] = {}
+            for chat_id, conversation in self._conversations.items():
+                partitions.setdefault(self.partition(chat_id), {})[chat_id] = conversation
+            payloads = {}
+            for name, conversations in partitions.items():
+                latest = max(conversation.touched_at for conversation in conversations.values())
+                if latest <= self._dumped_at.get(name, 0.0) and not force:
+                    continue
+                payloads[name] = {str(chat_id): conversation.to_list()
+                                  for chat_id, conversation in conversations.items() if not conversation.is_default}
+                self._dumped_at[name] = latest
+        for name, payload in payloads.items():
+            self.storage_service.save_conversations(name, payload)
+        return len(payloads)
+
+    def start(self, interval: float = DUMP_INTERVAL):
+        threading.Thread(target=self._run, args=(interval,), name='conversations', daemon=True).start()
+
+    def _run(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.expire()
+                self.dump()
+            except Exception as e:
+                logger.exception("Ошибка сохранения состояний диалогов: %s", e)
+
+    def stop(self):
+        self._stop.set()
+        self.dump()
@@ -0,0 +1,171 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from .logging_service import get_logger
+from .metrics_service import JOB_DURATION, JOBS
+from .tracing_service import TRACER
+
+logger = get_logger('jobs')
+
+# Потоков на все фоновые задачи процесса
+JOB_WORKERS = 2
+# Задач одного пользователя одновременно (в очереди и в работе)
+JOBS_PER_USER = 1
+# Сообщение о ходе работы правится не чаще раза в столько секунд (лимиты Telegram на правку)
+PROGRESS_INTERVAL = 2.0
+
+
+class JobCancelled(Exception):
+    """Задачу отменили (/cancel); бросается из Job.progress"""
+
+
+class Job:
+    __slots__ = ('id', 'chat_id', 'kind', 'title', 'run', 'message_id', '_service', '_cancelled', '_progress_at')
+
+    def __init__(self, service: 'JobService', job_id: int, chat_id: int, kind: str, title: str,
+                 run: Callable[['Job'], Optional[str]]):
+        self._service = service
+        self.id = job_id
+        self.chat_id = chat_id
+        self.kind = kind
+        self.title = title
+        self.run = run
+        # Сообщение "⏳ ... формируется…", которое правится по ходу работы
+        self.message_id: Optional[int] = None
+        self._cancelled = threading.Event()
+        self._progress_at = 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+    def progress(self, text: str):
+        """
+        Отметка хода работы: правит сообщение о задаче (не чаще PROGRESS_INTERVAL).
+        Отмененная задача останавливается здесь
+        """
+        self.check()
+        now = time.monotonic()
+        if now - self._progress_at >= PROGRESS_INTERVAL:
+            self._progress_at = now
+            self._service.update(self, f"⏳ {self.title}: {text}")
+
+
+class JobService:
+    """
+    Фоновые задачи: отчеты и расчет зарплаты. Обработчик ставит задачу и сразу
+    получает сообщение "⏳ ... формируется…", пул потоков выполняет ее и правит это сообщение по ходу работы;
+    результат задача отправляет сама. Задачи читают снимок данных пользователя (storage_schema.snapshot_segment),
+    поэтому апдейты их не ждут. У пользователя - не больше per_user задач сразу, /cancel отменяет его задачи.
+    """
+
+    def __init__(self, bot, send_message: Optional[Callable] = None, workers: int = JOB_WORKERS,
+                 per_user: int = JOBS_PER_USER):
+        self.bot = bot
+        # Сообщение о задаче нужно отправить сразу (нужен его id), а не копить до конца апдейта (Outbox.send_now)
+        self._send_message = send_message or bot.send_message
+        self.per_user = per_user
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='jobs')
+        self._jobs: Dict[int, List[Job]] = {}
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+
+    def active(self, chat_id: int) -> List[Job]:
+        with self._cond:
+            return list(self._jobs.get(chat_id, ()))
+
+    def submit(self, chat_id: int, kind: str, title: str, run: Callable[[Job], Optional[str]]) -> Optional[Job]:
+        """
+        Ставит задачу; run(job) выполняется в пуле и возвращает итоговый текст сообщения о задаче.
+        None - у пользователя уже идет задача, ему отправлено сообщение об этом
+        """
+        with self._cond:
+            running = self._jobs.setdefault(chat_id, [])
+            busy = running[0] if len(running) >= self.per_user else None
+            if busy is None:
+                job = Job(self, next(self._ids), chat_id, kind, title, run)
+                running.append(job)
+        if busy is not None:
+            JOBS.inc(kind=kind, outcome='rejected')
+            self._send_message(chat_id, f"⏳ Еще выполняется: {busy.title}. Дождитесь результата или отправьте /cancel")
+            return None
+
+        try:
+            message = self._send_message(chat_id, f"⏳ {title}: формируется…")
+        except Exception:
+            self._release(job)
+            raise
+        job.message_id = getattr(message, 'message_id', None)
+        self._executor.submit(self._run, job)
+        logger.debug("Задача %s (%s) поставлена", job.id, kind, extra={'chat_id': chat_id})
+        return job
+
+    def cancel(self, chat_id: int) -> int:
+        """Отменяет задачи пользователя; идущая остановится на ближайшей отметке хода работы"""
+        jobs = self.active(chat_id)
+        for job in jobs:
+            job.cancel()
+        return len(jobs)
+
+    def update(self, job: Job, text: str):
+        """Правит сообщение о задаче"""
+        if job.message_id is None:
+            self.bot.send_message(job.chat_id, text)
+            return
+        try:
+            self.bot.edit_message_text(text, chat_id=job.chat_id, message_id=job.message_id)
+        except Exception as e:
+            # Сообщение могли удалить - задаче это не мешает
+            logger.warning("Не удалось обновить сообщение задачи %s: %s", job.id, e, extra={'chat_id': job.chat_id})
+
+    def _run(self, job: Job):
+        start = time.perf_counter()
+        outcome = 'done'
+        try:
+            job.check()
+            with TRACER.span(f"job.{job.kind}", 'job', chat_id=job.chat_id):
+                text = job.run(job)
+            self.update(job, text or f"✅ {job.title}: готово")
+        except JobCancelled:
+            outcome = 'cancelled'
+            self.update(job, f"❌ {job.title}: отменено")
+        except Exception as e:
+            outcome = 'failed'
+            logger.exception("Ошибка задачи %s (%s): %s", job.id, job.kind, e, extra={'chat_id': job.chat_id})
+            self.update(job, f"❌ {job.title}: не удалось, попробуйте позже")
+        finally:
+            self._release(job)
+            JOBS.inc(kind=job.kind, outcome=outcome)
+            JOB_DURATION.observe(time.perf_counter() - start, kind=job.kind)
+
+    def _release(self, job: Job):
+        with self._cond:
+            running = self._jobs.get(job.chat_id, [])
+            if job in running:
+                running.remove(job)
+            if not running:
+                self._jobs.pop(job.chat_id, None)
+            self._cond.notify_all()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Ждет, пока выполнятся все поставленные задачи (бенчмарки); False - не дождались"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._jobs, timeout)
+
+    def stop(self):
+        """Отменяет задачи и не берет новые; вызывается при остановке бота"""
+        with self._cond:
+            jobs = [job for running in self._jobs.values() for job in running]
+        for job in jobs:
+            job.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
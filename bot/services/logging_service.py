@@ -0,0 +1,143 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from .metrics_service import METRICS
+from .tracing_service import TRACER
+
+# Уровень логов бота: DEBUG, INFO, WARNING, ERROR
+DEFAULT_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Доля чатов, для которых пишутся DEBUG-события (выбор по chat_id, чтобы у чата была вся цепочка)
+DEFAULT_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1') or 0)
+# Очередь ограничена: если писатель не успевает, записи отбрасываются, а не тормозят апдейты
+DEFAULT_QUEUE_SIZE = 10000
+
+ROOT_LOGGER = 'bot'
+
+LOG_DROPPED = METRICS.counter('bot_log_dropped_total', "Записи лога, отброшенные из-за переполнения очереди")
+
+# Стандартные атрибуты LogRecord - все остальное пришло через extra= и попадает в JSON как поля
+_RECORD_FIELDS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'cid'}
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Логгер подсистемы бота: bot.<name>"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        cid = getattr(record, 'cid', None)
+        if cid is not None:
+            entry['cid'] = cid
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ChatSampleFilter(logging.Filter):
+    """Пропускает DEBUG-события только для выбранной доли чатов"""
+
+    def __init__(self, rate: float = DEFAULT_DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        chat_id = getattr(record, 'chat_id', None)
+        if chat_id is None:
+            return True
+        # Детерминированный выбор: один и тот же чат либо логируется целиком, либо нет
+        return (chat_id * 2654435761) % 1000 < self.rate * 1000
+
+
+class CorrelationFilter(logging.Filter):
+    """Добавляет correlation id текущего апдейта (работает в потоке вызова, до очереди)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.cid = TRACER.correlation_id()
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Сообщение форматируется в потоке писателя; здесь только трейсбек, пока он жив
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+class _DrainingQueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        # Остановка ждет место в полной очереди, чтобы дописать все, что уже принято
+        self.queue.put(self._sentinel)
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(level: str = DEFAULT_LEVEL, debug_sample_rate: float = DEFAULT_DEBUG_SAMPLE_RATE,
+                  stream=None, queue_size: int = DEFAULT_QUEUE_SIZE) -> logging.Logger:
+    """
+    Подключает логгер bot.*: запись в очередь в потоке апдейта, вывод JSON в stdout фоновым потоком.
+    Повторный вызов перенастраивает уровень и выборку.
+    """
+    global _listener
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(level)
+    logger.propagate = False
+
+    if _listener is not None:
+        _listener.stop()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    records = queue.Queue(queue_size)
+    handler = _NonBlockingQueueHandler(records)
+    handler.addFilter(ChatSampleFilter(debug_sample_rate))
+    handler.addFilter(CorrelationFilter())
+    logger.addHandler(handler)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+    _listener = _DrainingQueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    return logger
+
+
+def shutdown_logging():
+    """Дописывает очередь и останавливает поток писателя"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,253 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from enum import Enum
+from itertools import compress
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import Dict, List, Optional, Tuple
+
+# Контейнер длиннее лимита измеряется по выборке элементов, результат масштабируется
+SAMPLE_LIMIT = 256
+# Сколько пользователей пересчитывать за один запрос; остальные берутся из кэша
+DEFAULT_BUDGET = 200
+# Через сколько секунд замер пользователя считается устаревшим, даже если счетчики не менялись
+MAX_AGE = 600.0
+
+SUBSYSTEMS = ('expenses', 'attendance', 'construction', 'running_list', 'search', 'other')
+
+_SKIP_TYPES = (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType, Enum)
+
+
+_CONTAINERS = (dict, list, tuple, set, frozenset, deque)
+
+
+def _sampled(elements: List) -> List[Tuple[object, float]]:
+    """
+    Выборка элементов большого контейнера с множителем.
+    Крупные вложенные контейнеры (например, postings частого слова) обходятся всегда:
+    иначе один такой элемент в выборке умножился бы на весь контейнер.
+    """
+    if len(elements) <= SAMPLE_LIMIT:
+        return [(element, 1.0) for element in elements]
+
+    sample = elements[::len(elements) // SAMPLE_LIMIT]
+    heavy = []
+    if any(isinstance(element, _CONTAINERS) for element in sample):
+        try:
+            lengths = list(map(len, elements))
+        except TypeError:
+            lengths = [len(element) if isinstance(element, _CONTAINERS) else 0 for element in elements]
+        heavy = list(compress(elements, map(SAMPLE_LIMIT.__lt__, lengths)))
+        if heavy:
+            light = list(compress(elements, map(SAMPLE_LIMIT.__ge__, lengths)))
+            sample = light[::max(len(light) // SAMPLE_LIMIT, 1)]
+            elements = light
+
+    scale = len(elements) / len(sample) if sample else 0.0
+    return [(element, scale) for element in sample] + [(element, 1.0) for element in heavy]
+
+
+def _children(obj) -> List[Tuple[object, float]]:
+    """Дочерние объекты с множителем выборки"""
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return []
+    if isinstance(obj, dict):
+        if len(obj) > SAMPLE_LIMIT:
+            return _sampled(list(obj)) + _sampled(list(obj.values()))
+        return [(element, 1.0) for pair in obj.items() for element in pair]
+    if isinstance(obj, _CONTAINERS):
+        if len(obj) > SAMPLE_LIMIT:
+            return _sampled(list(obj))
+        return [(element, 1.0) for element in obj]
+
+    children = []
+    for cls in type(obj).__mro__:
+        for slot in cls.__dict__.get('__slots__', ()):
+            value = getattr(obj, slot, None)
+            if value is not None:
+                children.append((value, 1.0))
+    instance_dict = getattr(obj, '__dict__', None)
+    if instance_dict is not None:
+        children.append((instance_dict, 1.0))
+    return children
+
+
+def deep_size(root, seen: set, counts: Counter) -> int:
+    """
+    Приблизительный размер объекта со всем, на что он ссылается (байты).
+    Уже учтенные объекты (seen) пропускаются; экземпляры моделей считаются в counts.
+    """
+    total = 0.0
+    stack = [(root, 1.0)]
+    while stack:
+        obj, weight = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SKIP_TYPES):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj) * weight
+        if type(obj).__module__.startswith('bot.'):
+            counts[type(obj).__name__] += weight
+        for child, scale in _children(obj):
+            stack.append((child, weight * scale))
+    return int(total)
+
+
+class _UserSample:
+    __slots__ = ('fingerprint', 'measured_at', 'sizes', 'counts')
+
+    def __init__(self, fingerprint: tuple, sizes: Dict[str, int], counts: Counter):
+        self.fingerprint = fingerprint
+        self.measured_at = time.monotonic()
+        self.sizes = sizes
+        self.counts = counts
+
+    @property
+    def total(self) -> int:
+        return sum(self.sizes.values())
+
+
+class MemoryService:
+    """
+    Учет памяти по пользователям и подсистемам для /debug/memory.
+    Замеры кэшируются и пересчитываются только у пользователей, чьи данные изменились,
+    не больше budget за запрос - вызов безопасен в продакшене.
+    """
+
+    def __init__(self, users_data, search_service=None):
+        self.users_data = users_data
+        self.search_service = search_service
+        self._samples: Dict[int, _UserSample] = {}
+        self._lock = threading.Lock()
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+
+    def _fingerprint(self, user_data) -> tuple:
+        # Дешевые счетчики: изменились - пересчитываем пользователя. Незагруженные разделы не загружаем
+        segments = user_data.loaded_segments()
+        manager = segments.get('construction')
+        index = self.search_service.peek_index(user_data.chat_id) if self.search_service else None
+        return (
+            tuple((name, segment.revision) for name, segment in segments.items()),
+            # Комментарии пишутся в журналы объектов и ревизию раздела не меняют
+            sum(len(obj.comment_log) for obj in manager.objects.values()) if manager is not None else -1,
+            user_data.id_sequence.last_id,
+            len(index) if index is not None else -1,
+        )
+
+    def _measure(self, user_data, fingerprint: tuple) -> _UserSample:
+        seen, counts = set(), Counter()
+        sizes = {}
+        for key, name in (('expenses', 'expenses'), ('attendance', 'timesheet'),
+                          ('construction', 'construction'), ('running_list', 'running_list')):
+            segment = user_data.loaded(name)
+            sizes[key] = deep_size(segment, seen, counts) if segment is not None else 0
+        # Индекс ссылается на объекты моделей - они уже учтены выше, сюда попадает только сам индекс
+        index = self.search_service.peek_index(user_data.chat_id) if self.search_service else None
+        sizes['search'] = deep_size(index, seen, counts) if index is not None else 0
+        sizes['other'] = deep_size(user_data, seen, counts)
+        return _UserSample(fingerprint, sizes, counts)
+
+    def report(self, top: int = 10, budget: int = DEFAULT_BUDGET) -> Dict:
+        start = time.perf_counter()
+        users = list(self.users_data.items())
+        now = time.monotonic()
+
+        with self._lock:
+            # Сначала самые старые замеры, чтобы при ограниченном бюджете кэш обновлялся по кругу
+            users.sort(key=lambda item: self._samples[item[0]].measured_at if item[0] in self._samples else 0.0)
+            measured = stale = 0
+            for chat_id, user_data in users:
+                sample = self._samples.get(chat_id)
+                fingerprint = self._fingerprint(user_data)
+                if sample is not None and sample.fingerprint == fingerprint and now - sample.measured_at < MAX_AGE:
+                    continue
+                if measured >= budget:
+                    stale += 1
+                    continue
+                try:
+                    self._samples[chat_id] = self._measure(user_data, fingerprint)
+                    measured += 1
+                except RuntimeError:
+                    # Данные поменялись во время обхода - замерим в следующий раз
+                    stale += 1
+
+            active = set(self.users_data)
+            for chat_id in [chat_id for chat_id in self._samples if chat_id not in active]:
+                del self._samples[chat_id]
+            samples = dict(self._samples)
+
+        subsystems = {name: 0 for name in SUBSYSTEMS}
+        objects = Counter()
+        for sample in samples.values():
+            for name, size in sample.sizes.items():
+                subsystems[name] += size
+            objects.update(sample.counts)
+
+        heaviest = sorted(samples.items(), key=lambda item: item[1].total, reverse=True)[:top]
+        return {
+            'users': len(users),
+            'measured': measured,
+            'stale': stale,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 2),
+            'rss_bytes': _rss_bytes(),
+            'total_bytes': sum(subsystems.values()),
+            'subsystems': subsystems,
+            'objects': {name: int(count) for name, count in objects.most_common()},
+            'top_users': [
+                {'chat_id': chat_id, 'total_bytes': sample.total, 'subsystems': dict(sample.sizes)}
+                for chat_id, sample in heaviest
+            ],
+        }
+
+    # tracemalloc
+
+    def tracemalloc_diff(self, action: str, limit: int = 20, frames: int = 1) -> Dict:
+        """start - включить; snapshot - разница с предыдущим снимком; stop - выключить"""
+        with self._lock:
+            if action == 'start':
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(frames)
+                self._snapshot = tracemalloc.take_snapshot()
+                return {'tracing': True}
+            if action == 'stop':
+                tracemalloc.stop()
+                self._snapshot = None
+                return {'tracing': False}
+            if action != 'snapshot':
+                raise ValueError(f"Неизвестное действие: {action}")
+            if not tracemalloc.is_tracing():
+                raise ValueError("tracemalloc не запущен: сначала action=start")
+
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            previous, self._snapshot = self._snapshot, snapshot
+
+        traced, peak = tracemalloc.get_traced_memory()
+        stats = snapshot.compare_to(previous, 'lineno') if previous is not None else snapshot.statistics('lineno')
+        return {
+            'tracing': True,
+            'traced_bytes': traced,
+            'peak_bytes': peak,
+            'diff': [
+                {
+                    'location': str(stat.traceback),
+                    'size_bytes': stat.size,
+                    'size_diff_bytes': getattr(stat, 'size_diff', stat.size),
+                    'count': stat.count,
+                    'count_diff': getattr(stat, 'count_diff', stat.count),
+                }
+                for stat in stats[:limit]
+            ],
+        }
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
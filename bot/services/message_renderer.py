@@ -0,0 +1,180 @@
+from typing import Callable, Iterable, List, Optional
+
+# Лимит Telegram на длину текста сообщения (в UTF-16 code units)
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def telegram_length(text: str) -> int:
+    """Длина строки так, как её считает Telegram (UTF-16 code units)"""
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-16-le')) // 2
+
+
+class MessageBuilder:
+    """Построитель сообщений: строки копятся в списке и склеиваются один раз"""
+
+    def __init__(self, title: Optional[str] = None):
+        self._lines: List[str] = []
+        if title is not None:
+            self._lines.append(title)
+            self._lines.append("")
+
+    def line(self, text: str = "") -> 'MessageBuilder':
+        self._lines.append(text)
+        return self
+
+    def lines(self, texts: Iterable[str]) -> 'MessageBuilder':
+        self._lines.extend(texts)
+        return self
+
+    def blank(self) -> 'MessageBuilder':
+        self._lines.append("")
+        return self
+
+    def section(self, template: 'SectionTemplate', items, **context) -> 'MessageBuilder':
+        template.render_into(self, items, **context)
+        return self
+
+    def is_empty(self) -> bool:
+        return not self._lines
+
+    def build(self) -> str:
+        return "\n".join(self._lines)
+
+    def chunks(self, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+        return split_lines(self._lines, limit)
+
+    def __str__(self):
+        return self.build()
+
+
+class SectionTemplate:
+    """Повторно используемый шаблон раздела: заголовок + строки элементов"""
+
+    def __init__(self, title: Optional[str], item_format: Callable[..., object],
+                 empty_text: Optional[str] = None, numbered: bool = False):
+        self.title = title
+        self.item_format = item_format
+        self.empty_text = empty_text
+        self.numbered = numbered
+
+    def render_into(self, builder: MessageBuilder, items, **context):
+        items = list(items)
+        if not items and self.empty_text is None:
+            return
+
+        if self.title is not None:
+            builder.line(self.title.format(**context))
+
+        if not items:
+            builder.line(self.empty_text)
+            return
+
+        for i, item in enumerate(items, 1):
+            rendered = self.item_format(i, item) if self.numbered else self.item_format(item)
+            # Формат может вернуть одну строку или несколько
+            if isinstance(rendered, str):
+                builder.line(rendered)
+            else:
+                builder.lines(rendered)
+
+    def render(self, items, **context) -> str:
+        builder = MessageBuilder()
+        self.render_into(builder, items, **context)
+        return builder.build()
+
+
+def _hard_split(line: str, limit: int) -> List[str]:
+    """Режет строку длиннее лимита на куски по limit UTF-16 единиц"""
+    parts = []
+    current = []
+    current_len = 0
+    for ch in line:
+        ch_len = 2 if ord(ch) > 0xFFFF else 1
+        if current_len + ch_len > limit:
+            parts.append("".join(current))
+            current = []
+            current_len = 0
+        current.append(ch)
+        current_len += ch_len
+    if current:
+        parts.append("".join(current))
+    return parts
+
+
+def split_lines(lines: List[str], limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Собирает строки в куски не длиннее limit, разрезая только по границам строк"""
+    chunks = []
+    current: List[str] = []
+    current_len = 0
+
+    for line in lines:
+        line_len = telegram_length(line)
+
+        if line_len > limit:
+            # Слишком длинная строка: закрываем текущий кусок и режем её принудительно
+            if current:
+                chunks.append("\n".join(current))
+                current, current_len = [], 0
+            pieces = _hard_split(line, limit)
+            chunks.extend(pieces[:-1])
+            current, current_len = [pieces[-1]], telegram_length(pieces[-1])
+            continue
+
+        # +1 за символ перевода строки между строками куска
+        added = line_len + (1 if current else 0)
+        if current and current_len + added > limit:
+            chunks.append("\n".join(current))
+            current, current_len = [line], line_len
+        else:
+            current.append(line)
+            current_len += added
+
+    if current:
+        chunks.append("\n".join(current))
+
+    # Telegram не принимает пустые сообщения
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Разбивает готовый текст на сообщения не длиннее limit по границам строк"""
+    if telegram_length(text) <= limit:
+        return [text] if text.strip() else []
+    return split_lines(text.split("\n"), limit)
+
+
+def fit_message(lines: List[str], header: List[str], footer: Optional[List[str]] = None,
+                limit: int = TELEGRAM_MESSAGE_LIMIT, keep_tail: bool = True,
+                omitted_format: str = "… (ещё {count})", total: Optional[int] = None) -> str:
+    """
+    Собирает одно сообщение из заголовка, подвала и стольких строк, сколько влезает в лимит.
+    Нужен там, где сообщение редактируется (edit_message_text) и разбить его нельзя.
+    total - полное число элементов, если в lines передана только их часть.
+    """
+    footer = footer or []
+    total = len(lines) if total is None else total
+    budget = limit - telegram_length("\n".join(header + footer)) - 1
+    # Резерв под строку с количеством пропущенных элементов
+    budget -= telegram_length(omitted_format.format(count=total)) + 1
+
+    taken: List[str] = []
+    ordered = reversed(lines) if keep_tail else iter(lines)
+    for line in ordered:
+        line_len = telegram_length(line) + 1
+        if line_len > budget:
+            break
+        taken.append(line)
+        budget -= line_len
+
+    if keep_tail:
+        taken.reverse()
+
+    omitted = total - len(taken)
+    body = taken
+    if omitted:
+        marker = omitted_format.format(count=omitted)
+        body = [marker] + taken if keep_tail else taken + [marker]
+
+    return "\n".join(header + body + footer)
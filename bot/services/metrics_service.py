@@ -0,0 +1,278 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .tracing_service import TRACER, chat_id_of
+
+# Границы бакетов по умолчанию: обработчики бота укладываются в миллисекунды, запросы к API - в секунды
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Sequence[float] = DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Метки -> [счетчики по бакетам (не накопительные), сумма, количество]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels) -> '_Timer':
+        return _Timer(self, labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, object]):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Общий реестр процесса: его отдает маршрут /metrics
+METRICS = MetricsRegistry()
+
+UPDATES = METRICS.counter('bot_updates_total', "Обработанные апдейты", ['type'])
+UPDATE_DURATION = METRICS.histogram('bot_update_duration_seconds', "Время обработки апдейта целиком", ['type'])
+UPDATES_SKIPPED = METRICS.counter('bot_updates_skipped_total', "Апдейты, отброшенные как повторные", ['reason'])
+OUTBOX_MESSAGES = METRICS.counter('bot_outbox_messages_total', "Сообщения апдейта: отправленные и склеенные с предыдущим",
+                                  ['outcome'])
+CONVERSATIONS_EXPIRED = METRICS.counter('bot_conversations_expired_total', "Брошенные диалоги, сброшенные по TTL")
+SHARD_LEASES = METRICS.counter('bot_shard_leases_total', "Аренды шардов воркера: полученные и отпущенные", ['event'])
+SHARD_DELIVERIES = METRICS.counter('bot_shard_deliveries_total',
+                                   "Пачки апдейтов, переданные диспетчером воркерам: доставленные и повторные",
+                                   ['outcome'])
+CALLBACKS = METRICS.counter('bot_callbacks_total', "Нажатия inline-кнопок: пачки, нажатия в очереди, устаревшие",
+                            ['outcome'])
+HANDLER_DURATION = METRICS.histogram('bot_handler_duration_seconds', "Время работы обработчика экрана",
+                                     ['handler', 'state', 'action'])
+HANDLER_ERRORS = METRICS.counter('bot_handler_errors_total', "Исключения в обработчиках", ['handler'])
+STORAGE_DURATION = METRICS.histogram('bot_storage_duration_seconds', "Время сохранения и загрузки данных",
+                                     ['operation'])
+STORAGE_BYTES = METRICS.histogram('bot_storage_bytes', "Размер сохраненных и загруженных файлов",
+                                  ['operation'], SIZE_BUCKETS)
+STORAGE_ERRORS = METRICS.counter('bot_storage_errors_total', "Ошибки сохранения и загрузки", ['operation'])
+STORAGE_MIGRATED = METRICS.counter('bot_storage_migrated_users_total',
+                                   "Пользователи, перенесенные из плоской раскладки в подпапки")
+STORAGE_ARCHIVED = METRICS.counter('bot_storage_archived_records_total', "Холодные записи, перенесенные в архив",
+                                   ['segment'])
+BACKUP_DURATION = METRICS.histogram('bot_backup_duration_seconds', "Время создания резервной копии")
+BACKUP_FILES = METRICS.counter('bot_backup_files_total', "Файлы, прочитанные в резервную копию: новые и уже бывшие",
+                               ['outcome'])
+BACKUP_BYTES = METRICS.counter('bot_backup_stored_bytes_total', "Байт записано в резервные копии (после сжатия)")
+JOBS = METRICS.counter('bot_jobs_total', "Фоновые задачи: выполненные, отмененные, с ошибкой, не принятые",
+                       ['kind', 'outcome'])
+JOB_DURATION = METRICS.histogram('bot_job_duration_seconds', "Время выполнения фоновой задачи", ['kind'])
+TIMERS_FIRED = METRICS.counter('bot_timers_fired_total', "Срабатывания таймеров планировщика", ['timer', 'outcome'])
+TIMER_LAG = METRICS.histogram('bot_timer_lag_seconds', "Опоздание срабатывания таймера относительно срока", ['timer'])
+API_DURATION = METRICS.histogram('bot_api_request_duration_seconds', "Время запросов к Telegram Bot API",
+                                 ['method'])
+API_ERRORS = METRICS.counter('bot_api_errors_total', "Ошибки запросов к Telegram Bot API", ['method', 'code'])
+
+
+# Замер обработчиков
+
+_active = threading.local()
+
+
+def _timed_handler(func, handler_name: str, users_data):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Вложенные вызовы (обработчик показывает другой экран) входят в замер внешнего
+        if getattr(_active, 'depth', 0):
+            with TRACER.span(handler_name, 'handler'):
+                return func(*args, **kwargs)
+
+        chat_id = chat_id_of(args[0]) if args else None
+        user_data = users_data.get(chat_id) if chat_id is not None else None
+        state = user_data.state if user_data is not None else ''
+        action = getattr(args[1], 'action', '') if len(args) > 1 else ''
+
+        _active.depth = 1
+        start = time.perf_counter()
+        try:
+            with TRACER.span(handler_name, 'handler', state=state, action=action):
+                return func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=handler_name)
+            raise
+        finally:
+            _active.depth = 0
+            HANDLER_DURATION.observe(time.perf_counter() - start, handler=handler_name, state=state, action=action)
+
+    return wrapper
+
+
+def instrument_handler(handler, users_data, prefix: str = 'handle_', exclude: Iterable[str] = ()):
+    """Оборачивает методы обработчика с именами prefix* замером времени и ошибок"""
+    exclude = set(exclude)
+    class_name = type(handler).__name__
+    for name in dir(type(handler)):
+        if not name.startswith(prefix) or name in exclude:
+            continue
+        method = getattr(handler, name)
+        if callable(method):
+            setattr(handler, name, _timed_handler(method, f"{class_name}.{name.lstrip('_')}", users_data))
+
+
+# Замер запросов к Bot API
+
+def install_api_metrics():
+    """Подключает замер запросов pyTelegramBotAPI через apihelper.CUSTOM_REQUEST_SENDER"""
+    from telebot import apihelper
+
+    if apihelper.CUSTOM_REQUEST_SENDER is not None:
+        return
+
+    def send_request(method, url, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            with TRACER.span(f"api.{api_method}", 'api'):
+                response = apihelper._get_req_session().request(method, url, **kwargs)
+        except Exception as e:
+            API_ERRORS.inc(method=api_method, code=type(e).__name__)
+            raise
+        finally:
+            API_DURATION.observe(time.perf_counter() - start, method=api_method)
+        if response.status_code != 200:
+            API_ERRORS.inc(method=api_method, code=str(response.status_code))
+        return response
+
+    apihelper.CUSTOM_REQUEST_SENDER = send_request
@@ -0,0 +1,120 @@
+import threading
+from typing import Dict, List, Optional
+
+from telebot import types
+
+from .message_renderer import TELEGRAM_MESSAGE_LIMIT, telegram_length
+from .metrics_service import OUTBOX_MESSAGES
+
+# Методы, которые видны пользователю в ленте: перед ними копившиеся сообщения отправляются, чтобы не менялся порядок
+ORDERED_METHODS = ('send_document', 'edit_message_text', 'edit_message_reply_markup', 'delete_message')
+
+_REPLY_MARKUPS = (types.ReplyKeyboardMarkup, types.ReplyKeyboardRemove)
+
+
+class _Pending:
+    __slots__ = ('chat_id', 'text', 'reply_markup', 'kwargs')
+
+    def __init__(self, chat_id, text: str, reply_markup, kwargs: Dict):
+        self.chat_id = chat_id
+        self.text = text
+        self.reply_markup = reply_markup
+        self.kwargs = kwargs
+
+    def can_absorb(self, other: '_Pending') -> bool:
+        """Можно ли дописать other в это сообщение"""
+        if other.chat_id != self.chat_id or other.kwargs != self.kwargs:
+            return False
+        # Кнопки первого сообщения оказались бы под чужим текстом; обычную клавиатуру заменяет следующая
+        if self.reply_markup is not None and not (
+                isinstance(self.reply_markup, _REPLY_MARKUPS) and isinstance(other.reply_markup, _REPLY_MARKUPS)):
+            return False
+        return telegram_length(self.text) + 2 + telegram_length(other.text) <= TELEGRAM_MESSAGE_LIMIT
+
+    def absorb(self, other: '_Pending'):
+        self.text = f"{self.text.rstrip()}\n\n{other.text.lstrip()}"
+        self.reply_markup = other.reply_markup
+
+
+class Outbox:
+    """
+    Исходящие сообщения одного апдейта: send_message внутри collect() не уходит сразу,
+    а копится; соседние тексты одному чату склеиваются в одно сообщение, если позволяют
+    клавиатуры и лимит длины. Все уходит одним проходом в конце апдейта.
+    Пока апдейт обрабатывается, send_message возвращает None.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._local = threading.local()
+        self._send_message = None
+
+    def install(self):
+        """Оборачивает bot.send_message и методы, перед которыми нужно отправить накопленное"""
+        self._send_message = self.bot.send_message
+
+        def send_message(chat_id, text, *args, **kwargs):
+            pending: Optional[List[_Pending]] = getattr(self._local, 'pending', None)
+            if pending is None or args:
+                self.flush()
+                return self._send_message(chat_id, text, *args, **kwargs)
+            message = _Pending(chat_id, text, kwargs.pop('reply_markup', None), kwargs)
+            if pending and pending[-1].can_absorb(message):
+                pending[-1].absorb(message)
+                OUTBOX_MESSAGES.inc(outcome='merged')
+            else:
+                pending.append(message)
+            return None
+
+        self.bot.send_message = send_message
+        for name in ORDERED_METHODS:
+            method = getattr(self.bot, name, None)
+            if method is not None:
+                setattr(self.bot, name, self._flushing(method))
+
+    def _flushing(self, method):
+        def call(*args, **kwargs):
+            self.flush()
+            return method(*args, **kwargs)
+        return call
+
+    def collect(self) -> '_OutboxScope':
+        return _OutboxScope(self)
+
+    def send_now(self, chat_id, text: str, **kwargs):
+        """Отправляет сразу, а не в конце апдейта (нужен id сообщения); накопленное уходит перед ним"""
+        self.flush()
+        return self._send_message(chat_id, text, **kwargs)
+
+    def flush(self):
+        pending = getattr(self._local, 'pending', None)
+        if not pending:
+            return
+        self._local.pending = []
+        for message in pending:
+            OUTBOX_MESSAGES.inc(outcome='sent')
+            self._send_message(message.chat_id, message.text, reply_markup=message.reply_markup, **message.kwargs)
+
+
+class _OutboxScope:
+    __slots__ = ('outbox', 'outer')
+
+    def __init__(self, outbox: Outbox):
+        self.outbox = outbox
+        self.outer = False
+
+    def __enter__(self):
+        local = self.outbox._local
+        # Вложенные области (обработчик вызывает другой экран) копят в общий буфер внешней
+        self.outer = getattr(local, 'pending', None) is None
+        if self.outer:
+            local.pending = []
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.outer:
+            try:
+                self.outbox.flush()
+            finally:
+                self.outbox._local.pending = None
+        return False
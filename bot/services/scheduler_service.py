@@ -0,0 +1,118 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from .logging_service import get_logger
+from .metrics_service import TIMER_LAG, TIMERS_FIRED
+
+logger = get_logger('scheduler')
+
+# Таймер: (тип, владелец), например ('lock_attendance', chat_id); тип - метка в метриках
+TimerKey = Tuple[str, Hashable]
+
+
+class Scheduler:
+    """
+    Таймеры процесса на куче: schedule и cancel - O(log n), поток спит до ближайшего срока.
+    На ключ - один таймер: повторный schedule переносит его, а устаревшие записи кучи
+    пропускаются при извлечении. clock - время в секундах эпохи; в тестах подменяется,
+    и срабатывания вызываются напрямую через run_pending(now) без запуска потока.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self._heap: List[Tuple[float, int, TimerKey]] = []
+        # Ключ -> (срок, номер записи в куче, обработчик); запись кучи с другим номером устарела
+        self._timers: Dict[TimerKey, Tuple[float, int, Callable[[TimerKey, float], None]]] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+    def __len__(self):
+        return len(self._timers)
+
+    def schedule(self, key: TimerKey, when: float, callback: Callable[[TimerKey, float], None]):
+        """Ставит (или переносит) таймер; callback(key, when) вызывается в потоке планировщика"""
+        with self._cond:
+            seq = next(self._seq)
+            self._timers[key] = (when, seq, callback)
+            heapq.heappush(self._heap, (when, seq, key))
+            if len(self._heap) > 2 * len(self._timers) + 64:
+                # Переносов накопилось больше, чем живых таймеров - пересобираем кучу без устаревших
+                self._heap = [(when, seq, key) for key, (when, seq, _) in self._timers.items()]
+                heapq.heapify(self._heap)
+            if self._heap[0][1] == seq:
+                # Новый таймер раньше всех - поток должен проснуться раньше
+                self._cond.notify()
+
+    def cancel(self, key: TimerKey) -> bool:
+        with self._cond:
+            return self._timers.pop(key, None) is not None
+
+    def when(self, key: TimerKey) -> Optional[float]:
+        entry = self._timers.get(key)
+        return entry[0] if entry is not None else None
+
+    def next_deadline(self) -> Optional[float]:
+        with self._cond:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def _drop_stale(self):
+        heap = self._heap
+        while heap:
+            when, seq, key = heap[0]
+            entry = self._timers.get(key)
+            if entry is not None and entry[1] == seq:
+                return
+            heapq.heappop(heap)
+
+    def _pop_due(self, now: float):
+        with self._cond:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return None
+            when, seq, key = heapq.heappop(self._heap)
+            callback = self._timers.pop(key)[2]
+            return key, when, callback
+
+    def run_pending(self, now: Optional[float] = None) -> int:
+        """Вызывает таймеры со сроком не позже now; возвращает число срабатываний"""
+        now = self.clock() if now is None else now
+        fired = 0
+        while True:
+            due = self._pop_due(now)
+            if due is None:
+                return fired
+            key, when, callback = due
+            fired += 1
+            TIMER_LAG.observe(max(0.0, self.clock() - when), timer=key[0])
+            try:
+                # Обработчик может сразу поставить следующий срок того же ключа
+                callback(key, when)
+                TIMERS_FIRED.inc(timer=key[0], outcome='done')
+            except Exception as e:
+                TIMERS_FIRED.inc(timer=key[0], outcome='failed')
+                logger.exception("Ошибка таймера %s: %s", key, e)
+
+    def start(self):
+        threading.Thread(target=self._run, name='scheduler', daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                self._drop_stale()
+                timeout = self._heap[0][0] - self.clock() if self._heap else None
+                if timeout is None or timeout > 0:
+                    self._cond.wait(timeout)
+                    continue
+            self.run_pending()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
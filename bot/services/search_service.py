@@ -0,0 +1,348 @@
+import heapq
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import chain
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Окончания русских слов, которые срезаем, чтобы "задачи", "задачу" и "задаче" искались вместе.
+# Отсортированы по убыванию длины: срезается самое длинное подходящее окончание.
+_RUSSIAN_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией', 'ием', 'иях', 'ия', 'ие', 'ий',
+    'ый', 'ой', 'ая', 'яя', 'ое', 'ее', 'ую', 'юю', 'ых', 'их', 'ах', 'ях', 'ов', 'ев', 'ам', 'ям', 'ом',
+    'ем', 'ой', 'ей', 'ью', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+_MIN_STEM_LENGTH = 3
+
+_TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+_DIGITS_RE = re.compile(r"\D+")
+
+# Размер страницы результатов /find и inline-режима
+SEARCH_PAGE_SIZE = 10
+
+# Префиксный поиск по недопечатанному слову: не короче 2 символов и не больше 64 вариантов
+_MIN_PREFIX_LENGTH = 2
+_MAX_PREFIX_EXPANSION = 64
+
+# Начиная с такого числа документов postings слова держатся отсортированными по весу
+_RANKED_MIN_POSTINGS = 512
+
+
+def _stem(token: str) -> str:
+    if token.isdigit() or len(token) <= _MIN_STEM_LENGTH:
+        return token
+    for ending in _RUSSIAN_ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= _MIN_STEM_LENGTH:
+            return token[:-len(ending)]
+    return token
+
+
+def normalize_text(text: str) -> str:
+    """Приводит регистр и сворачивает ё в е"""
+    return text.lower().replace('ё', 'е')
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбивает текст на нормализованные основы слов"""
+    return [_stem(token) for token in _TOKEN_RE.findall(normalize_text(text))]
+
+
+def phone_tokens(phone: str) -> List[str]:
+    """Телефон ищется и по частям, и целиком цифрами: +7 (902) 234-23-23 -> 79022342323"""
+    digits = _DIGITS_RE.sub('', phone)
+    tokens = tokenize(phone)
+    if digits and digits not in tokens:
+        tokens.append(digits)
+    return tokens
+
+
+class SearchDocument:
+    __slots__ = ('key', 'kind', 'entity', 'owner', 'tokens', 'length')
+
+    def __init__(self, key: int, kind: str, entity, owner, tokens: List[str]):
+        self.key = key
+        self.kind = kind
+        # Ссылка на сам объект модели: текст результата берется из актуального состояния
+        self.entity = entity
+        # Объект, к которому относится запись (стройобъект для комментария и контакта)
+        self.owner = owner
+        # Уникальные основы на момент индексации - по ним документ удаляется из postings
+        self.tokens = tuple(set(tokens))
+        self.length = len(tokens)
+
+
+class SearchHit(NamedTuple):
+    score: float
+    document: SearchDocument
+
+
+class SearchIndex:
+    """
+    Инвертированный индекс одного пользователя: основа слова -> {документ: вес}.
+    Вес - частота слова в документе, деленная на корень из длины документа:
+    короткие документы с тем же совпадением релевантнее. Считается один раз при индексации.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[int, float]] = {}
+        # Для частых слов - postings, отсортированные по убыванию веса: [(-вес, -ключ), ...]
+        self._ranked: Dict[str, List[Tuple[float, int]]] = {}
+        self._vocabulary: List[str] = []
+        self._documents: Dict[int, SearchDocument] = {}
+        # (вид, id(объекта модели)) -> ключ документа
+        self._keys: Dict[Tuple[str, int], int] = {}
+        self._next_key = 0
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, kind: str, entity, tokens: List[str], owner=None):
+        """Добавляет или переиндексирует документ для объекта модели"""
+        self.remove(kind, entity)
+
+        key = self._next_key
+        self._next_key += 1
+        self._keys[(kind, id(entity))] = key
+        self._documents[key] = SearchDocument(key, kind, entity, owner, tokens)
+
+        norm = 1 / math.sqrt(len(tokens) or 1)
+        for token, tf in Counter(tokens).items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                insort(self._vocabulary, token)
+            weight = postings[key] = tf * norm
+            ranked = self._ranked.get(token)
+            if ranked is not None:
+                insort(ranked, (-weight, -key))
+
+    def remove(self, kind: str, entity) -> bool:
+        key = self._keys.pop((kind, id(entity)), None)
+        if key is None:
+            return False
+        self._drop(key)
+        return True
+
+    def remove_kind(self, kind: str):
+        for (doc_kind, entity_id), key in list(self._keys.items()):
+            if doc_kind == kind:
+                del self._keys[(doc_kind, entity_id)]
+                self._drop(key)
+
+    def remove_owned(self, owner):
+        """Удаляет все документы, принадлежащие объекту (комментарии и контакты стройобъекта)"""
+        for key, document in list(self._documents.items()):
+            if document.owner is owner:
+                self._keys.pop((document.kind, id(document.entity)), None)
+                self._drop(key)
+
+    def _drop(self, key: int):
+        document = self._documents.pop(key)
+        for token in document.tokens:
+            postings = self._postings.get(token)
+            if postings is None or key not in postings:
+                continue
+            weight = postings.pop(key)
+
+            ranked = self._ranked.get(token)
+            if ranked is not None:
+                position = bisect_left(ranked, (-weight, -key))
+                if position < len(ranked) and ranked[position] == (-weight, -key):
+                    ranked.pop(position)
+
+            if not postings:
+                del self._postings[token]
+                self._ranked.pop(token, None)
+                index = bisect_left(self._vocabulary, token)
+                if index < len(self._vocabulary) and self._vocabulary[index] == token:
+                    self._vocabulary.pop(index)
+
+    def prepare(self):
+        """Заранее сортирует postings частых слов, чтобы первый запрос не платил за сортировку"""
+        for token, postings in self._postings.items():
+            if len(postings) >= _RANKED_MIN_POSTINGS:
+                self._ranked_postings(token)
+
+    def _ranked_postings(self, token: str) -> List[Tuple[float, int]]:
+        """Отсортированные postings частого слова; строятся при первом запросе и дальше поддерживаются"""
+        ranked = self._ranked.get(token)
+        if ranked is None:
+            ranked = self._ranked[token] = sorted((-weight, -key) for key, weight in self._postings[token].items())
+        return ranked
+
+    def _expand_prefix(self, prefix: str) -> List[str]:
+        if len(prefix) < _MIN_PREFIX_LENGTH:
+            return []
+        tokens = []
+        vocabulary = self._vocabulary
+        index = bisect_left(vocabulary, prefix)
+        while index < len(vocabulary) and len(tokens) < _MAX_PREFIX_EXPANSION:
+            token = vocabulary[index]
+            if not token.startswith(prefix):
+                break
+            tokens.append(token)
+            index += 1
+        return tokens
+
+    def _term(self, raw: str, is_last: bool) -> Optional[Tuple[Dict[int, float], float, Optional[str]]]:
+        """Postings одного слова запроса, его idf и основа (None, если слово найдено по префиксу)"""
+        stem = _stem(raw)
+        postings = self._postings.get(stem)
+        if postings is None:
+            if not (raw.isdigit() or is_last):
+                return None
+            # Слово еще не допечатали (или это начало телефона) - ищем по префиксу
+            variants = [self._postings[token] for token in self._expand_prefix(raw)]
+            if not variants:
+                return None
+            if len(variants) == 1:
+                postings = variants[0]
+            else:
+                # При совпадении документа с несколькими формами берется вес более редкой
+                postings = {}
+                for variant in sorted(variants, key=len, reverse=True):
+                    postings.update(variant)
+            stem = None
+        return postings, math.log(1 + len(self._documents) / len(postings)), stem
+
+    def search(self, query: str, offset: int = 0, limit: int = SEARCH_PAGE_SIZE) -> Tuple[List[SearchHit], int]:
+        """
+        Ищет документы, содержащие все слова запроса (последнее слово - как префикс).
+        Возвращает страницу результатов и общее число найденных документов.
+        """
+        raw_tokens = _TOKEN_RE.findall(normalize_text(query))
+        if not raw_tokens or not self._documents:
+            return [], 0
+
+        terms = []
+        for position, raw in enumerate(raw_tokens):
+            term = self._term(raw, position == len(raw_tokens) - 1)
+            if term is None:
+                return [], 0
+            terms.append(term)
+
+        documents = self._documents
+        if len(terms) == 1:
+            postings, idf, stem = terms[0]
+            if stem is not None and len(postings) >= _RANKED_MIN_POSTINGS:
+                # Частое слово: страница - просто срез заранее отсортированного списка
+                ranked = self._ranked_postings(stem)[offset:offset + limit]
+                return [SearchHit(-weight * idf, documents[-key]) for weight, key in ranked], len(postings)
+            scores, scale = postings, idf
+        else:
+            # Пересечение начинаем с самого редкого слова
+            terms.sort(key=lambda term: len(term[0]))
+            keys = terms[0][0].keys()
+            for postings, _, _ in terms[1:]:
+                keys = keys & postings.keys()
+                if not keys:
+                    return [], 0
+            scores = {key: sum(postings[key] * idf for postings, idf, _ in terms) for key in keys}
+            scale = 1.0
+
+        # Кортежи (вес, ключ) сравниваются без key-функции; при равном весе выше более новые
+        top = heapq.nlargest(offset + limit, zip(scores.values(), scores.keys()))
+        page = [SearchHit(score * scale, documents[key]) for score, key in top[offset:offset + limit]]
+        return page, len(scores)
+
+
+class SearchService:
+    """
+    Индексы полнотекстового поиска по пользователям.
+    Индекс строится лениво при первом поиске, дальше обновляется обработчиками при изменениях.
+    """
+
+    def __init__(self, users_data):
+        self.users_data = users_data
+        self._indexes: Dict[int, SearchIndex] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def document_tokens(kind: str, entity) -> List[str]:
+        if kind == 'task':
+            return tokenize(entity.description)
+        if kind == 'comment':
+            return tokenize(entity.text)
+        if kind == 'expense':
+            return tokenize(f"{entity.description} {entity.category}")
+        if kind == 'object':
+            return tokenize(f"{entity.name} {entity.address}")
+        if kind == 'contact':
+            return tokenize(f"{entity.name} {entity.position}") + phone_tokens(entity.phone)
+        return []
+
+    def _add(self, index: SearchIndex, kind: str, entity, owner=None):
+        index.add(kind, entity, self.document_tokens(kind, entity), owner)
+
+    def _build(self, user_data) -> SearchIndex:
+        index = SearchIndex()
+        # Поиск идет и по архиву: при первом поиске журналы архива читаются с диска
+        running_list, manager = user_data.running_list, user_data.construction_manager
+        for task in chain(running_list.tasks, running_list.archive.records()):
+            self._add(index, 'task', task)
+        for expense in user_data.get_all_expenses():
+            self._add(index, 'expense', expense)
+        for obj in chain(manager.objects.values(), manager.archive.records()):
+            self._add(index, 'object', obj)
+            for person in obj.responsible_persons:
+                self._add(index, 'contact', person, obj)
+            for comment in obj.comment_log:
+                self._add(index, 'comment', comment, obj)
+        index.prepare()
+        return index
+
+    def get_index(self, chat_id: int) -> Optional[SearchIndex]:
+        with self._lock:
+            index = self._indexes.get(chat_id)
+            if index is None:
+                user_data = self.users_data.get(chat_id)
+                if user_data is None:
+                    return None
+                index = self._indexes[chat_id] = self._build(user_data)
+            return index
+
+    def peek_index(self, chat_id: int) -> Optional[SearchIndex]:
+        """Уже построенный индекс пользователя, без ленивой сборки"""
+        return self._indexes.get(chat_id)
+
+    def search(self, chat_id: int, query: str, offset: int = 0,
+               limit: int = SEARCH_PAGE_SIZE) -> Tuple[List[SearchHit], int]:
+        index = self.get_index(chat_id)
+        if index is None:
+            return [], 0
+        with self._lock:
+            return index.search(query, offset, limit)
+
+    # Обновление индекса при изменениях. Если индекс пользователя еще не построен,
+    # ничего не делаем: при первом поиске он соберется из актуальных данных.
+
+    def index_entity(self, chat_id: int, kind: str, entity, owner=None):
+        with self._lock:
+            index = self._indexes.get(chat_id)
+            if index is not None:
+                self._add(index, kind, entity, owner)
+
+    def remove_entity(self, chat_id: int, kind: str, entity):
+        with self._lock:
+            index = self._indexes.get(chat_id)
+            if index is not None:
+                index.remove(kind, entity)
+
+    def remove_kind(self, chat_id: int, kind: str):
+        with self._lock:
+            index = self._indexes.get(chat_id)
+            if index is not None:
+                index.remove_kind(kind)
+
+    def remove_object(self, chat_id: int, obj):
+        with self._lock:
+            index = self._indexes.get(chat_id)
+            if index is not None:
+                index.remove('object', obj)
+                index.remove_owned(obj)
+
+    def drop_user(self, chat_id: int):
+        with self._lock:
+            self._indexes.pop(chat_id, None)
@@ -0,0 +1,173 @@
+import fcntl
+import os
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from .logging_service import get_logger
+from .metrics_service import SHARD_LEASES
+
+logger = get_logger('shards')
+
+# Чужие шарды подхватываются, только если их домашний воркер не отмечается живым дольше этого
+# (при старте воркеры запускаются не одновременно, а упавший воркер супервизор сразу перезапускает)
+ORPHAN_GRACE = 3.0
+
+
+def shard_of(chat_id: int, shards: int) -> int:
+    """Шард чата: одинаковый во всех процессах (hash() строк зависит от PYTHONHASHSEED, crc32 - нет)"""
+    return zlib.crc32(str(chat_id).encode('ascii')) % shards
+
+
+def update_chat_id(update: dict) -> Optional[int]:
+    """Чат, к данным которого относится апдейт (сырой JSON из getUpdates)"""
+    message = update.get('message') or update.get('edited_message')
+    if message:
+        return message['chat']['id']
+    call = update.get('callback_query')
+    if call:
+        if call.get('message'):
+            return call['message']['chat']['id']
+        return call['from']['id']
+    query = update.get('inline_query')
+    if query:
+        # Личный чат: id чата совпадает с id пользователя
+        return query['from']['id']
+    return None
+
+
+def _lock_path(lease_dir: str, shard: int) -> str:
+    return os.path.join(lease_dir, f"shard_{shard}.lock")
+
+
+def _worker_path(lease_dir: str, worker_id: int) -> str:
+    return os.path.join(lease_dir, f"worker_{worker_id}.lock")
+
+
+def _is_locked(path: str) -> bool:
+    """Держит ли кто-то (любой процесс, в том числе этот) flock на файле"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def shard_owner(lease_dir: str, shard: int) -> Optional[str]:
+    """Адрес воркера, который сейчас держит шард; None - шард никому не принадлежит"""
+    path = _lock_path(lease_dir, shard)
+    if not _is_locked(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class ShardLeases:
+    """
+    Аренды шардов одного воркера: flock на data/shards/shard_<n>.lock.
+    Блокировку держит открытый файл, поэтому при падении процесса ядро снимает ее само,
+    и шарды подхватывают оставшиеся воркеры. В файл аренды пишется адрес владельца для диспетчера.
+    Домашние шарды воркера - shard % workers == worker_id; к ним он возвращается после перезапуска.
+    """
+
+    def __init__(self, lease_dir: str, shards: int, worker_id: int, workers: int, address: str):
+        self.lease_dir = lease_dir
+        self.shards = shards
+        self.worker_id = worker_id
+        self.workers = workers
+        self.address = address
+        self._held: Dict[int, int] = {}
+        self._dead_since: Dict[int, float] = {}
+        os.makedirs(lease_dir, exist_ok=True)
+
+        # Отметка "воркер жив": по числу занятых отметок считается справедливая доля шардов
+        self._alive_fd = os.open(_worker_path(lease_dir, worker_id), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._alive_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self._alive_fd)
+            raise RuntimeError(f"Воркер {worker_id} уже запущен")
+
+    @property
+    def held(self) -> List[int]:
+        return sorted(self._held)
+
+    def owns(self, shard: int) -> bool:
+        return shard in self._held
+
+    def owns_chat(self, chat_id: int) -> bool:
+        return shard_of(chat_id, self.shards) in self._held
+
+    def is_home(self, shard: int) -> bool:
+        return shard % self.workers == self.worker_id
+
+    def _alive(self) -> Dict[int, bool]:
+        now = time.monotonic()
+        alive = {}
+        for worker_id in range(self.workers):
+            alive[worker_id] = _is_locked(_worker_path(self.lease_dir, worker_id))
+            if alive[worker_id]:
+                self._dead_since.pop(worker_id, None)
+            else:
+                self._dead_since.setdefault(worker_id, now)
+        return alive
+
+    def _orphaned(self, shard: int) -> bool:
+        since = self._dead_since.get(shard % self.workers)
+        return since is not None and time.monotonic() - since >= ORPHAN_GRACE
+
+    def _try_lock(self, shard: int) -> bool:
+        fd = os.open(_lock_path(self.lease_dir, shard), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, self.address.encode('utf-8'), 0)
+        self._held[shard] = fd
+        SHARD_LEASES.inc(event='acquired')
+        logger.info("Шард %s получен", shard, extra={'shard': shard, 'worker': self.worker_id})
+        return True
+
+    def rebalance(self) -> Tuple[List[int], List[int]]:
+        """
+        Берет свои свободные шарды и, до справедливой доли, шарды упавших воркеров.
+        Возвращает (полученные, лишние): лишние - чужие шарды, чей домашний воркер снова жив;
+        их нужно отпустить через release(), когда обработка по ним закончится.
+        """
+        alive = self._alive()
+        target = -(-self.shards // max(sum(alive.values()), 1))
+        acquired = []
+        for shard in range(self.shards):
+            if shard in self._held:
+                continue
+            if self.is_home(shard) or (len(self._held) < target and self._orphaned(shard)):
+                if self._try_lock(shard):
+                    acquired.append(shard)
+
+        surplus = [shard for shard in self.held if not self.is_home(shard) and alive[shard % self.workers]]
+        return acquired, surplus
+
+    def release(self, shard: int):
+        fd = self._held.pop(shard, None)
+        if fd is None:
+            return
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+        SHARD_LEASES.inc(event='released')
+        logger.info("Шард %s отпущен", shard, extra={'shard': shard, 'worker': self.worker_id})
+
+    def close(self):
+        for shard in self.held:
+            self.release(shard)
+        os.close(self._alive_fd)
@@ -0,0 +1,293 @@
+import gzip
+import json
+import lzma
+import struct
+from typing import Dict, List, Optional, Tuple
+
+# Строки короче этого попадают в таблицу строк бинарного кодека: даты, категории и ключи
+# повторяются тысячи раз, а длинные описания почти всегда уникальны
+_INTERN_MAX = 40
+
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _REF, _LIST, _DICT, _TABLE, _RAW = range(11)
+# Столбцы таблицы: значения одного типа пишутся без байта-тега и читаются без разбора тегов
+_COL_ANY, _COL_BOOL, _COL_INT, _COL_STR = range(4)
+_DOUBLE = struct.Struct('<d')
+
+
+class Codec:
+    """Формат файла пользователя. magic - первые байты файла, по ним формат определяется при чтении"""
+    name = ''
+    magic = b''
+
+    def encode(self, data: dict) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, raw: bytes) -> dict:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """Компактный JSON без отступов; читаются и старые файлы с indent=2"""
+    name = 'json'
+
+    def encode(self, data: dict) -> bytes:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, raw: bytes) -> dict:
+        return json.loads(raw)
+
+
+class GzipCodec(JsonCodec):
+    name = 'gzip'
+    magic = b'\x1f\x8b'
+
+    def encode(self, data: dict) -> bytes:
+        # mtime=0: одинаковые данные - одинаковые байты
+        return gzip.compress(super().encode(data), compresslevel=6, mtime=0)
+
+    def decode(self, raw: bytes) -> dict:
+        return super().decode(gzip.decompress(raw))
+
+
+class LzmaCodec(JsonCodec):
+    name = 'lzma'
+    magic = b'\xfd7zXZ\x00'
+
+    def encode(self, data: dict) -> bytes:
+        return lzma.compress(super().encode(data), preset=6)
+
+    def decode(self, raw: bytes) -> dict:
+        return super().decode(lzma.decompress(raw))
+
+
+class BinaryCodec(Codec):
+    """
+    Двоичная запись JSON-совместимых значений: байт-тег, целые - zigzag varint, float - 8 байт.
+    Короткие строки пишутся один раз и дальше ссылкой на номер в таблице строк.
+    Список словарей с одинаковыми ключами (расходы, отметки табеля, задачи) пишется таблицей
+    по столбцам: ключи один раз, потом значения каждого столбца подряд.
+    """
+    name = 'binary'
+    magic = b'TVKB\x01'
+
+    def encode(self, data: dict) -> bytes:
+        out = bytearray(self.magic)
+        strings: Dict[str, int] = {}
+        append = out.append
+
+        def varint(n: int):
+            while n > 0x7f:
+                append((n & 0x7f) | 0x80)
+                n >>= 7
+            append(n)
+
+        def string(value: str):
+            index = strings.get(value)
+            if index is not None:
+                append(_REF)
+                varint(index)
+                return
+            encoded = value.encode('utf-8')
+            if len(value) <= _INTERN_MAX:
+                strings[value] = len(strings)
+                append(_STR)
+            else:
+                append(_RAW)
+            varint(len(encoded))
+            out.extend(encoded)
+
+        def value(item):
+            kind = type(item)
+            if kind is str:
+                string(item)
+            elif kind is bool:
+                append(_TRUE if item else _FALSE)
+            elif kind is int:
+                append(_INT)
+                varint(item << 1 if item >= 0 else (-item << 1) - 1)
+            elif kind is float:
+                append(_FLOAT)
+                out.extend(_DOUBLE.pack(item))
+            elif item is None:
+                append(_NONE)
+            elif kind is dict:
+                append(_DICT)
+                varint(len(item))
+                for key, nested in item.items():
+                    string(key)
+                    value(nested)
+            elif kind is list or kind is tuple:
+                keys = _table_keys(item)
+                if keys is None:
+                    append(_LIST)
+                    varint(len(item))
+                    for nested in item:
+                        value(nested)
+                else:
+                    append(_TABLE)
+                    varint(len(keys))
+                    for key in keys:
+                        string(key)
+                    varint(len(item))
+                    for key in keys:
+                        column(key, [row[key] for row in item])
+            else:
+                raise TypeError(f"Тип {kind.__name__} не поддерживается двоичным кодеком")
+
+        def column(key: str, values: list):
+            kinds = {type(item) for item in values}
+            if kinds == {bool}:
+                append(_COL_BOOL)
+                out.extend(bytes(values))
+            elif kinds == {int}:
+                append(_COL_INT)
+                for item in values:
+                    varint(item << 1 if item >= 0 else (-item << 1) - 1)
+            elif kinds == {str}:
+                append(_COL_STR)
+                for item in values:
+                    string(item)
+            else:
+                append(_COL_ANY)
+                for item in values:
+                    value(item)
+
+        value(data)
+        return bytes(out)
+
+    def decode(self, raw: bytes) -> dict:
+        if not raw.startswith(self.magic):
+            raise ValueError("Не двоичный файл пользователя")
+        strings: List[str] = []
+        pos = len(self.magic)
+
+        def varint() -> int:
+            nonlocal pos
+            result = shift = 0
+            while True:
+                byte = raw[pos]
+                pos += 1
+                result |= (byte & 0x7f) << shift
+                if byte < 0x80:
+                    return result
+                shift += 7
+
+        def value():
+            nonlocal pos
+            tag = raw[pos]
+            pos += 1
+            if tag == _REF:
+                # Однобайтовый номер - без вызова varint(): ссылок в таблицах больше всего
+                index = raw[pos]
+                if index < 0x80:
+                    pos += 1
+                    return strings[index]
+                return strings[varint()]
+            if tag == _STR or tag == _RAW:
+                length = varint()
+                text = raw[pos:pos + length].decode('utf-8')
+                pos += length
+                if tag == _STR:
+                    strings.append(text)
+                return text
+            if tag == _INT:
+                n = raw[pos]
+                if n < 0x80:
+                    pos += 1
+                else:
+                    n = varint()
+                return -((n + 1) >> 1) if n & 1 else n >> 1
+            if tag == _TRUE:
+                return True
+            if tag == _FALSE:
+                return False
+            if tag == _NONE:
+                return None
+            if tag == _FLOAT:
+                pos += 8
+                return _DOUBLE.unpack_from(raw, pos - 8)[0]
+            if tag == _DICT:
+                return {value(): value() for _ in range(varint())}
+            if tag == _LIST:
+                return [value() for _ in range(varint())]
+            if tag == _TABLE:
+                keys = tuple(value() for _ in range(varint()))
+                rows = varint()
+                columns = [column(rows) for _ in keys]
+                return [dict(zip(keys, row)) for row in zip(*columns)]
+            raise ValueError(f"Неизвестный тег {tag} в позиции {pos - 1}")
+
+        def column(rows: int) -> list:
+            nonlocal pos
+            kind = raw[pos]
+            pos += 1
+            if kind == _COL_BOOL:
+                pos += rows
+                return list(map(bool, raw[pos - rows:pos]))
+            values = []
+            add = values.append
+            if kind == _COL_INT:
+                for _ in range(rows):
+                    n = raw[pos]
+                    if n < 0x80:
+                        pos += 1
+                    else:
+                        n = varint()
+                    add(-((n + 1) >> 1) if n & 1 else n >> 1)
+            elif kind == _COL_STR:
+                for _ in range(rows):
+                    if raw[pos] != _REF:
+                        add(value())
+                        continue
+                    # Номера до 16383 (1-2 байта) разбираются на месте
+                    index = raw[pos + 1]
+                    if index < 0x80:
+                        pos += 2
+                    elif raw[pos + 2] < 0x80:
+                        index = (index & 0x7f) | (raw[pos + 2] << 7)
+                        pos += 3
+                    else:
+                        pos += 1
+                        index = varint()
+                    add(strings[index])
+            else:
+                for _ in range(rows):
+                    add(value())
+            return values
+
+        return value()
+
+
+def _table_keys(items) -> Optional[Tuple[str, ...]]:
+    """Ключи, общие для всех словарей списка в одном порядке; None - список не таблица"""
+    if len(items) < 2 or type(items[0]) is not dict:
+        return None
+    keys = tuple(items[0])
+    if not keys:
+        return None
+    for item in items:
+        if type(item) is not dict or len(item) != len(keys) or tuple(item) != keys:
+            return None
+    return keys
+
+
+CODECS: Dict[str, Codec] = {codec.name: codec for codec in (JsonCodec(), GzipCodec(), LzmaCodec(), BinaryCodec())}
+
+
+def get_codec(name: str) -> Codec:
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный формат хранения {name!r}, доступны: {', '.join(CODECS)}") from None
+
+
+def detect_codec(raw: bytes) -> Codec:
+    """Формат по первым байтам файла: файлы разных форматов могут лежать вперемешку"""
+    for codec in CODECS.values():
+        if codec.magic and raw.startswith(codec.magic):
+            return codec
+    return CODECS['json']
+
+
+def decode(raw: bytes) -> dict:
+    return detect_codec(raw).decode(raw)
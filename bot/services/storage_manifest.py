@@ -0,0 +1,147 @@
+import fcntl
+import json
+import os
+import time
+import zlib
+from typing import Dict, Optional
+
+from .logging_service import get_logger
+
+logger = get_logger('manifest')
+
+MANIFEST_VERSION = 1
+# Журнал сворачивается в снимок, когда вырастает больше этого (байт)
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+
+
+def user_prefix(chat_id: int) -> str:
+    """Подпапка пользователя: 256 папок по младшему байту crc32 - равномерно и одинаково во всех процессах"""
+    return format(zlib.crc32(str(chat_id).encode('ascii')) & 0xff, '02x')
+
+
+class UserManifest:
+    """
+    Список пользователей хранилища: путь к файлу, размер, номер версии и время изменения.
+    manifest.json - снимок, manifest.jsonl - журнал записей после снимка (одна строка на сохранение).
+    Дописывание в журнал - под общей блокировкой, сворачивание журнала в снимок - под исключительной,
+    поэтому несколько процессов (bot/cluster.py) могут вести один манифест.
+    """
+
+    def __init__(self, storage_dir: str):
+        self.storage_dir = storage_dir
+        self.snapshot_path = os.path.join(storage_dir, 'manifest.json')
+        self.journal_path = os.path.join(storage_dir, 'manifest.jsonl')
+        self._lock_path = os.path.join(storage_dir, 'manifest.lock')
+        # Последняя известная версия файла каждого пользователя (владелец пользователя - один процесс)
+        self._versions: Dict[int, int] = {}
+
+    def exists(self) -> bool:
+        return os.path.exists(self.snapshot_path) or os.path.exists(self.journal_path)
+
+    def _locked(self, operation: int):
+        os.makedirs(self.storage_dir, exist_ok=True)
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, operation)
+        return fd
+
+    @staticmethod
+    def _unlock(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def version(self, chat_id: int) -> int:
+        """Последняя известная этому процессу версия файла пользователя (0 - неизвестна)"""
+        return self._versions.get(chat_id, 0)
+
+    def record(self, chat_id: int, path: str, size: int, version: Optional[int] = None) -> int:
+        """Отмечает запись файла пользователя; возвращает новую версию"""
+        if version is None:
+            version = self._versions.get(chat_id, 0) + 1
+        self._versions[chat_id] = version
+        line = json.dumps({
+            'chat_id': chat_id, 'path': os.path.relpath(path, self.storage_dir), 'size': size,
+            'version': version, 'mtime': round(time.time(), 3),
+        }, separators=(',', ':')) + '\n'
+
+        fd = self._locked(fcntl.LOCK_SH)
+        try:
+            # O_APPEND + одна запись на строку: строки разных процессов не перемешиваются
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                journal_size = f.tell()
+        finally:
+            self._unlock(fd)
+        if journal_size > JOURNAL_COMPACT_BYTES:
+            self.compact()
+        return version
+
+    def _read(self) -> Dict[int, Dict]:
+        users: Dict[int, Dict] = {}
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            users = {int(chat_id): entry for chat_id, entry in snapshot.get('users', {}).items()}
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.error("Манифест поврежден, используется только журнал: %s", e)
+
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Недописанная строка после аварии
+                        continue
+                    users[entry.pop('chat_id')] = entry
+        except FileNotFoundError:
+            pass
+        return users
+
+    def users(self) -> Dict[int, Dict]:
+        """chat_id -> {path, size, version, mtime}: снимок плюс журнал, без обхода папок"""
+        fd = self._locked(fcntl.LOCK_SH)
+        try:
+            users = self._read()
+        finally:
+            self._unlock(fd)
+        for chat_id, entry in users.items():
+            if entry['version'] > self._versions.get(chat_id, 0):
+                self._versions[chat_id] = entry['version']
+        return users
+
+    def compact(self):
+        """Сворачивает журнал в снимок"""
+        fd = self._locked(fcntl.LOCK_EX)
+        try:
+            users = self._read()
+            tmp = self.snapshot_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'version': MANIFEST_VERSION, 'users': {str(chat_id): entry for chat_id, entry in users.items()}},
+                          f, separators=(',', ':'))
+            os.replace(tmp, self.snapshot_path)
+            # Журнал очищается только после того, как снимок с его записями на месте
+            open(self.journal_path, 'w').close()
+        finally:
+            self._unlock(fd)
+        logger.info("Манифест свернут: %s пользователей", len(users))
+
+    def rebuild(self, users_dir: str) -> int:
+        """Восстанавливает манифест обходом папки пользователей (если манифест потерян)"""
+        found = 0
+        for prefix in sorted(os.listdir(users_dir)) if os.path.isdir(users_dir) else ():
+            prefix_dir = os.path.join(users_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for filename in os.listdir(prefix_dir):
+                if filename.startswith('user_') and filename.endswith('.json'):
+                    try:
+                        chat_id = int(filename[5:-5])
+                    except ValueError:
+                        continue
+                    path = os.path.join(prefix_dir, filename)
+                    self.record(chat_id, path, os.path.getsize(path))
+                    found += 1
+        self.compact()
+        return found
@@ -0,0 +1,157 @@
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from ..models.construction import ConstructionObject
+from ..models.running_list import RunningTask
+from ..models.schema import compile_model
+from ..models.timesheet import AttendanceRecord
+from ..models.user_data import Expense, UserData
+
+# Версия формата файла пользователя. Файлы без поля version - версия 0 (до описаний полей в моделях)
+SCHEMA_VERSION = 3
+
+# Переход с версии N на N + 1: функция меняет разобранный словарь файла на месте
+MIGRATIONS: Dict[int, Callable[[dict], None]] = {}
+
+_USER = compile_model(UserData)
+
+
+def migration(from_version: int):
+    def register(func: Callable[[dict], None]):
+        MIGRATIONS[from_version] = func
+        return func
+    return register
+
+
+@migration(0)
+def _legacy_ids(data: dict):
+    """Строковые id-таймстемпы старых файлов -> монотонные int в порядке создания; поле state больше не хранится"""
+    data.pop('state', None)
+    timesheet = data.get('timesheet', {})
+    entities = (timesheet.get('employees', []) + data.get('construction_manager', {}).get('objects', []) +
+                data.get('running_list', {}).get('tasks', []))
+
+    last_id = data.get('last_id') or 0
+    legacy_ids = set()
+    for entity in entities:
+        entity_id = entity.get('id')
+        if isinstance(entity_id, int):
+            last_id = max(last_id, entity_id)
+        elif entity_id is not None:
+            legacy_ids.add(entity_id)
+
+    def creation_order(legacy_id: str):
+        try:
+            return 0, float(legacy_id), legacy_id
+        except ValueError:
+            return 1, 0.0, legacy_id
+
+    id_map = {}
+    for legacy_id in sorted(legacy_ids, key=creation_order):
+        last_id += 1
+        id_map[legacy_id] = last_id
+    data['last_id'] = last_id
+    if not id_map:
+        return
+    for entity in entities:
+        entity['id'] = id_map.get(entity.get('id'), entity.get('id'))
+    for record in timesheet.get('attendance_records', []):
+        record['employee_id'] = id_map.get(record['employee_id'], record['employee_id'])
+
+
+@migration(1)
+def _archive(data: dict):
+    """С версии 2 холодные записи лежат в журналах архива; старые файлы переносят их туда при первом сохранении"""
+
+
+@migration(2)
+def _segments(data: dict):
+    """С версии 3 разделы хранятся отдельными файлами: раздел старого файла - словарь под своим именем"""
+    data['expenses'] = {'expenses': data.pop('expenses', []), 'archive': data.pop('expense_archive', {})}
+    data['construction'] = data.pop('construction_manager', {})
+    data.setdefault('timesheet', {})
+    data.setdefault('running_list', {})
+
+
+def upgrade(data: dict) -> int:
+    """Доводит словарь файла до SCHEMA_VERSION; возвращает исходную версию файла"""
+    version = data.get('version', 0)
+    if version > SCHEMA_VERSION:
+        raise ValueError(f"Файл версии {version} записан более новой версией бота (поддерживается {SCHEMA_VERSION})")
+    for step in range(version, SCHEMA_VERSION):
+        MIGRATIONS[step](data)
+    data['version'] = SCHEMA_VERSION
+    return version
+
+
+def encode_user(user_data, inline: bool = False) -> dict:
+    """
+    Заголовок файла пользователя: id, счетчик, сроки таймеров и версии разделов.
+    inline - вместе со всеми разделами в одном словаре (для бенчмарков; decode_user читает и такой)
+    """
+    data = _USER.encode(user_data)
+    data['version'] = SCHEMA_VERSION
+    data['last_updated'] = datetime.now().isoformat()
+    data['segments'] = dict(user_data.segment_versions)
+    if inline:
+        for name in UserData.SEGMENTS:
+            data[name] = encode_segment(user_data.segment(name))
+    return data
+
+
+def encode_segment(segment, version: int = 0) -> dict:
+    """Раздел в JSON-совместимом виде (без комментариев - они в журналах объектов)"""
+    data = compile_model(type(segment)).encode(segment)
+    data['version'] = version
+    return data
+
+
+def snapshot_segment(segment):
+    """
+    Копия раздела для фоновой задачи (job_service.py): изменения оригинала в нее не попадают.
+    Архив копируется списком записей (Archive.snapshot), сами записи общие
+    """
+    copy = type(segment)(segment.chat_id)
+    fill_segment(copy, encode_segment(segment))
+    copy.archive = segment.archive.snapshot()
+    return copy
+
+
+def fill_segment(segment, data: dict):
+    compile_model(type(segment)).fill(segment, data)
+
+
+def decode_user(chat_id: int, data: dict, segment_loader=None) -> Tuple[UserData, int]:
+    """
+    Пользователь из словаря файла любой поддерживаемой версии; вторым значением - исходная версия файла.
+    Разделы, лежащие прямо в словаре (файлы до версии 3), читаются сразу и помечаются измененными,
+    чтобы при следующем сохранении уйти в свои файлы; остальные загрузит segment_loader при обращении
+    """
+    version = upgrade(data)
+    user_data = UserData(chat_id, segment_loader)
+    _USER.fill(user_data, data)
+    user_data.segment_versions = dict(data.get('segments', {}))
+    for name in UserData.SEGMENTS:
+        if name in data:
+            segment = user_data.create_segment(name)
+            fill_segment(segment, data[name])
+            segment.touch()
+            user_data.set_segment(name, segment)
+    return user_data, version
+
+
+# Архив раздела (bot/models/archive.py): раздел -> имя журнала и модель записей
+ARCHIVES: Dict[str, Tuple[str, type]] = {
+    'expenses': ('expenses', Expense),
+    'timesheet': ('attendance', AttendanceRecord),
+    'construction': ('objects', ConstructionObject),
+    'running_list': ('tasks', RunningTask),
+}
+
+
+def encode_records(model: type, records) -> List[dict]:
+    return compile_model(model).encode_list(records)
+
+
+def decode_records(model: type, items: List[dict]) -> list:
+    return compile_model(model).decode_list(items)
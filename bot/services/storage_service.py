@@ -1,249 +1,573 @@
 import json
 import os
+import threading
+import time
 from datetime import datetime
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional
+
+from .metrics_service import STORAGE_ARCHIVED, STORAGE_BYTES, STORAGE_DURATION, STORAGE_ERRORS, STORAGE_MIGRATED
+from .storage_codecs import decode, get_codec
+from .storage_manifest import UserManifest, user_prefix
+from .storage_schema import (ARCHIVES, SCHEMA_VERSION, decode_records, decode_user, encode_records, encode_segment,
+                             encode_user, fill_segment)
+from .tracing_service import TRACER
+from .logging_service import get_logger
+
+logger = get_logger('storage')
+
+# Число блокировок, между которыми распределяются пользователи
+USER_LOCK_STRIPES = 64
+
+# Папка данных версий, которые при запуске переходили в рабочую папку temp/
+LEGACY_DATA_DIR = os.path.join('temp', 'data')
+
+
+def move_legacy_data(storage_dir: str, legacy_dir: str = LEGACY_DATA_DIR) -> int:
+    """
+    Переносит файлы пользователей из legacy_dir в storage_dir (дальше их разложит по папкам
+    JSONStorageService, как любые файлы плоской раскладки); возвращает число перенесенных файлов.
+    Пользователь, у которого в storage_dir уже есть файл, не переносится - старый файл остается на месте
+    """
+    storage_dir = os.path.abspath(storage_dir)
+    legacy_dir = os.path.abspath(legacy_dir)
+    if legacy_dir == storage_dir or not os.path.isdir(legacy_dir):
+        return 0
+    moved = 0
+    for filename in sorted(os.listdir(legacy_dir)):
+        if not (filename.startswith("user_") and filename.endswith(".json")):
+            continue
+        try:
+            chat_id = int(filename[5:-5])
+        except ValueError:
+            continue
+        target = os.path.join(storage_dir, filename)
+        if os.path.exists(target) or os.path.exists(os.path.join(storage_dir, 'users', user_prefix(chat_id), filename)):
+            logger.warning("Файл %s уже есть в %s, оставлен в %s", filename, storage_dir, legacy_dir,
+                           extra={'chat_id': chat_id})
+            continue
+        os.makedirs(storage_dir, exist_ok=True)
+        os.replace(os.path.join(legacy_dir, filename), target)
+        moved += 1
+    if moved:
+        logger.warning("Перенесены файлы пользователей из %s в %s: %s", legacy_dir, storage_dir, moved)
+    return moved
 
 
 class JSONStorageService:
-    def __init__(self, storage_dir: str = "data"):
-        self.storage_dir = storage_dir
-        if not os.path.exists(storage_dir):
-            os.makedirs(storage_dir)
+    """
+    Данные пользователей в JSON: data/users/<xx>/user_<chat_id>.json, где xx - префикс из хэша chat_id
+    (в одной папке не набирается тысяч файлов), журналы комментариев - рядом, в <xx>/comments/.
+    Список пользователей с размерами и версиями файлов ведет манифест (storage_manifest.py),
+    поэтому загрузке и админским инструментам не нужно обходить папки.
+    Файлы старой плоской раскладки (data/user_<chat_id>.json) переносятся на новое место
+    при первом чтении или записи пользователя.
+    Формат файла задает codec (storage_codecs.py); при чтении он определяется по содержимому,
+    поэтому смена формата не требует конвертации - файлы переписываются при следующем сохранении.
+    Холодные записи (bot/models/archive.py) при каждом сохранении уходят в журналы <xx>/archive/:
+    туда только дописываются новые, а с диска журнал читается, когда его запросит экран.
+    Разделы (расходы, табель, объекты, running list) лежат своими файлами в <xx>/segments/
+    с номером версии: пишутся только измененные, читаются при первом обращении к разделу.
+    В файле пользователя остается заголовок: счетчик id и версии разделов.
+    """
+
+    def __init__(self, storage_dir: str = "data", codec: str = 'json'):
+        # Абсолютный путь: разделы и архивы читаются лениво, уже после запуска, от смены рабочей папки не зависят
+        self.storage_dir = os.path.abspath(storage_dir)
+        self.codec = get_codec(codec)
+        self.users_dir = os.path.join(self.storage_dir, 'users')
+        if not os.path.exists(self.storage_dir):
+            os.makedirs(self.storage_dir)
+        self.manifest = UserManifest(self.storage_dir)
+        self._migrate_lock = threading.Lock()
+        # Запись файлов пользователя и их чтение для снимка (backup_service.py) не пересекаются
+        self._user_locks = [threading.Lock() for _ in range(USER_LOCK_STRIPES)]
+        # Вызывается с chat_id перед перезаписью файлов пользователя (пока идет снимок)
+        self.before_write: Optional[Callable[[int], None]] = None
+        self._legacy = self._scan_legacy()
+        if not self.manifest.exists() and os.path.isdir(self.users_dir):
+            logger.warning("Манифест не найден, восстанавливаем по папке %s", self.users_dir)
+            self.manifest.rebuild(self.users_dir)
+
+    def _user_dir(self, chat_id: int) -> str:
+        return os.path.join(self.users_dir, user_prefix(chat_id))
+
+    def _user_file(self, chat_id: int) -> str:
+        return os.path.join(self._user_dir(chat_id), f"user_{chat_id}.json")
+
+    def _scan_legacy(self) -> Dict[int, List[str]]:
+        """Файлы плоской раскладки: chat_id -> пути файла пользователя и его журналов комментариев"""
+        legacy: Dict[int, List[str]] = {}
+        for filename in os.listdir(self.storage_dir):
+            if filename.startswith("user_") and filename.endswith(".json"):
+                try:
+                    legacy[int(filename[5:-5])] = [os.path.join(self.storage_dir, filename)]
+                except ValueError:
+                    continue
+
+        comments_dir = os.path.join(self.storage_dir, 'comments')
+        if legacy and os.path.isdir(comments_dir):
+            for filename in os.listdir(comments_dir):
+                # user_<chat_id>_object_<object_id>.jsonl
+                chat_id, _, _ = filename[5:].partition('_object_')
+                try:
+                    paths = legacy.get(int(chat_id))
+                except ValueError:
+                    continue
+                if paths is not None:
+                    paths.append(os.path.join(comments_dir, filename))
+        if legacy:
+            logger.info("Файлов пользователей в старой раскладке: %s", len(legacy))
+        return legacy
+
+    def _migrate_user(self, chat_id: int):
+        """Переносит файлы пользователя из плоской раскладки в его подпапку"""
+        if chat_id not in self._legacy:
+            return
+        with self._migrate_lock:
+            paths = self._legacy.pop(chat_id, None)
+            if paths is None:
+                return
+            user_dir = self._user_dir(chat_id)
+            for src in paths:
+                name = os.path.basename(src)
+                dst = os.path.join(user_dir, name) if name.endswith('.json') else os.path.join(user_dir, 'comments', name)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                try:
+                    # link + unlink, а не rename: файл, уже записанный на новом месте, не затирается
+                    os.link(src, dst)
+                except FileExistsError:
+                    pass
+                except FileNotFoundError:
+                    # Перенес другой процесс (кластер: шард сменил владельца)
+                    continue
+                os.unlink(src)
+
+            filename = self._user_file(chat_id)
+            if os.path.exists(filename):
+                self.manifest.record(chat_id, filename, os.path.getsize(filename))
+            STORAGE_MIGRATED.inc()
+            logger.info("Файлы пользователя %s перенесены в %s", chat_id, user_dir, extra={'chat_id': chat_id})
+
+    def user_lock(self, chat_id: int) -> threading.Lock:
+        return self._user_locks[chat_id % USER_LOCK_STRIPES]
+
+    def user_files(self, chat_id: int) -> List[str]:
+        """Файлы пользователя на диске: заголовок, разделы, журналы архива и журналы комментариев объектов"""
+        self._migrate_user(chat_id)
+        files = []
+        filename = self._user_file(chat_id)
+        if os.path.exists(filename):
+            files.append(filename)
+        for subdir, prefix in (('segments', f"user_{chat_id}_"), ('archive', f"user_{chat_id}_"),
+                               ('comments', f"user_{chat_id}_object_")):
+            path = os.path.join(self._user_dir(chat_id), subdir)
+            if os.path.isdir(path):
+                files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.startswith(prefix))
+        return files
 
     def save_user_data(self, user_data):
         """Сохраняет данные пользователя в JSON файл"""
+        start = time.perf_counter()
+        chat_id = user_data.chat_id
+        with self.user_lock(chat_id):
+            self._migrate_user(chat_id)
+            before_write = self.before_write
+            if before_write is not None:
+                before_write(chat_id)
+            with TRACER.span('storage.save', 'storage', chat_id=chat_id):
+                self._archive_cold(user_data)
+                written = self._write_user_data(user_data)
+            if written is not None:
+                self.manifest.record(chat_id, self._user_file(chat_id), self._stored_size(user_data))
+                STORAGE_BYTES.observe(written, operation='save')
+            else:
+                STORAGE_ERRORS.inc(operation='save')
+        STORAGE_DURATION.observe(time.perf_counter() - start, operation='save')
+
+    def _segment_file(self, chat_id: int, name: str) -> str:
+        return os.path.join(self._user_dir(chat_id), 'segments', f"user_{chat_id}_{name}.json")
+
+    def _stored_size(self, user_data) -> int:
+        """Размер пользователя на диске: заголовок и файлы разделов"""
+        chat_id = user_data.chat_id
+        size = os.path.getsize(self._user_file(chat_id))
+        for name in user_data.segment_versions:
+            path = self._segment_file(chat_id, name)
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+
+    def _write_file(self, path: str, payload: bytes) -> int:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Через временный файл: на диске всегда целый файл, старый или новый
+        with open(path + ".tmp", 'wb') as f:
+            f.write(payload)
+        os.replace(path + ".tmp", path)
+        return len(payload)
+
+    def _write_user_data(self, user_data) -> Optional[int]:
+        """Пишет измененные разделы и заголовок; возвращает число записанных байт (None - ошибка)"""
+        chat_id = user_data.chat_id
         try:
-            filename = os.path.join(self.storage_dir, f"user_{user_data.chat_id}.json")
-
-            # Преобразуем данные в JSON-совместимый формат
-            data = {
-                'chat_id': user_data.chat_id,
-                'state': user_data.state,
-                'expenses': [
-                    {
-                        'date': exp.date.isoformat(),
-                        'category': exp.category,
-                        'amount': exp.amount,
-                        'description': exp.description,
-                        'type': exp.type
-                    } for exp in user_data.expenses
-                ],
-                'timesheet': {
-                    'employees': [
-                        {
-                            'id': emp.id,
-                            'name': emp.name,
-                            'daily_salary': emp.daily_salary,
-                            'created_date': emp.created_date.isoformat()
-                        } for emp in user_data.timesheet.employees.values()
-                    ],
-                    'attendance_records': [
-                        {
-                            'employee_id': rec.employee_id,
-                            'work_date': rec.work_date.isoformat(),
-                            'is_present': rec.is_present,
-                            'is_locked': rec.is_locked
-                        } for rec in user_data.timesheet.attendance_records
-                    ]
-                },
-                'construction_manager': {
-                    'objects': [
-                        {
-                            'id': obj.id,
-                            'name': obj.name,
-                            'address': obj.address,
-                            'created_date': obj.created_date.isoformat(),
-                            'current_stage': obj.current_stage.name,
-                            'responsible_persons': [
-                                {
-                                    'name': person.name,
-                                    'position': person.position,
-                                    'phone': person.phone,
-                                    'email': person.email
-                                } for person in obj.responsible_persons
-                            ],
-                            'comments': {
-                                stage.name: comments for stage, comments in obj.comments.items()
-                            },
-                            'is_completed': obj.is_completed,
-                            'completion_date': obj.completion_date.isoformat() if obj.completion_date else None
-                        } for obj in user_data.construction_manager.objects.values()
-                    ]
-                },
-                # ДОБАВЛЯЕМ RUNNING LIST ДАННЫЕ
-                'running_list': {
-                    'tasks': [
-                        {
-                            'id': task.id,
-                            'description': task.description,
-                            'priority': task.priority.name,
-                            'created_date': task.created_date.isoformat(),
-                            'is_completed': task.is_completed,
-                            'completed_date': task.completed_date.isoformat() if task.completed_date else None,
-                            'due_date': task.due_date.isoformat() if task.due_date else None
-                        } for task in user_data.running_list.tasks
-                    ]
-                },
-                'last_updated': datetime.now().isoformat()
-            }
-
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-
-            print(f"✅ Данные пользователя {user_data.chat_id} сохранены")
+            segments = user_data.loaded_segments()
+            # Объекты в памяти, включая только что перенесенные в архив (до того, как архив их сохранит)
+            manager = segments.get('construction')
+            objects = list(manager.objects.values()) + manager.archive.resident() if manager is not None else []
+
+            # Порядок: журналы архива, разделы, заголовок. При сбое между ними записи остаются в рабочих данных,
+            # а лишний хвост журнала отбрасывается при чтении (Archive.records)
+            for name, segment in segments.items():
+                journal, model = ARCHIVES[name]
+                self._save_archive(chat_id, journal, model, segment.archive)
+                if segment.archive.loader is None:
+                    # Раздел нового пользователя: архив теперь на диске, читать его - оттуда
+                    self._attach_archive(chat_id, name, segment)
+
+            written = 0
+            for name, segment in segments.items():
+                if not segment.dirty:
+                    continue
+                revision = segment.revision
+                version = user_data.segment_versions.get(name, 0) + 1
+                payload = self.codec.encode(encode_segment(segment, version))
+                written += self._write_file(self._segment_file(chat_id, name), payload)
+                user_data.segment_versions[name] = version
+                segment.saved_revision = revision
+
+            for obj in objects:
+                self._save_comment_log(chat_id, obj)
+
+            # Заголовок пишется всегда: в нем счетчик id и версии разделов
+            written += self._write_file(self._user_file(chat_id), self.codec.encode(encode_user(user_data)))
+            logger.debug("Данные пользователя %s сохранены", chat_id, extra={'chat_id': chat_id})
+            return written
 
         except Exception as e:
-            print(f"❌ Ошибка сохранения данных пользователя {user_data.chat_id}: {e}")
+            logger.exception("Ошибка сохранения данных пользователя %s: %s", chat_id, e, extra={'chat_id': chat_id})
+            return None
 
     def load_user_data(self, chat_id: int):
-        """Загружает данные пользователя из JSON файла"""
-        filename = os.path.join(self.storage_dir, f"user_{chat_id}.json")
-
+        """Загружает заголовок пользователя; разделы загружаются при первом обращении к ним"""
+        self._migrate_user(chat_id)
+        filename = self._user_file(chat_id)
         if not os.path.exists(filename):
-            print(f"Файл данных для пользователя {chat_id} не найден, создаем новый")
-            # Импортируем здесь, чтобы избежать циклических импортов
-            from ..models.user_data import UserData
-            return UserData(chat_id)
+            return self._read_user_data(chat_id, filename)
 
+        start = time.perf_counter()
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            # Импортируем здесь, чтобы избежать циклических импортов
-            from ..models.user_data import UserData, Expense
-            from ..models.timesheet import Employee, AttendanceRecord, Timesheet
-            from ..models.construction import ConstructionStage, ResponsiblePerson, ConstructionObject, \
-                ConstructionManager
-            from ..models.running_list import RunningTask, TaskPriority, RunningList
-
-            user_data = UserData(chat_id)
-            user_data.state = data.get('state', 'main_menu')
-
-            # Восстанавливаем расходы
-            for exp_data in data.get('expenses', []):
-                expense = Expense(
-                    category=exp_data['category'],
-                    amount=exp_data['amount'],
-                    description=exp_data['description'],
-                    expense_type=exp_data['type'],
-                    date=datetime.fromisoformat(exp_data['date'])
-                )
-                user_data.expenses.append(expense)
-
-            # Восстанавливаем табель
-            timesheet = user_data.timesheet
-
-            # Восстанавливаем сотрудников
-            for emp_data in data.get('timesheet', {}).get('employees', []):
-                employee = Employee(
-                    name=emp_data['name'],
-                    daily_salary=emp_data['daily_salary'],
-                    employee_id=emp_data['id']
-                )
-                employee.created_date = datetime.fromisoformat(emp_data['created_date'])
-                timesheet.employees[employee.id] = employee
-
-            # Восстанавливаем записи посещаемости
-            for rec_data in data.get('timesheet', {}).get('attendance_records', []):
-                record = AttendanceRecord(
-                    employee_id=rec_data['employee_id'],
-                    work_date=datetime.fromisoformat(rec_data['work_date']).date(),
-                    is_present=rec_data['is_present']
-                )
-                record.is_locked = rec_data['is_locked']
-                timesheet.attendance_records.append(record)
-
-            # Восстанавливаем строительные объекты
-            construction_manager = user_data.construction_manager
-
-            for obj_data in data.get('construction_manager', {}).get('objects', []):
-                obj = ConstructionObject(
-                    name=obj_data['name'],
-                    address=obj_data['address'],
-                    object_id=obj_data['id']
-                )
-                obj.created_date = datetime.fromisoformat(obj_data['created_date'])
-                obj.current_stage = ConstructionStage[obj_data['current_stage']]
-                obj.is_completed = obj_data['is_completed']
-
-                if obj_data['completion_date']:
-                    obj.completion_date = datetime.fromisoformat(obj_data['completion_date'])
-
-                # Восстанавливаем ответственных лиц
-                for person_data in obj_data.get('responsible_persons', []):
-                    person = ResponsiblePerson(
-                        name=person_data['name'],
-                        position=person_data['position'],
-                        phone=person_data['phone'],
-                        email=person_data.get('email', '')
-                    )
-                    obj.responsible_persons.append(person)
-
-                # Восстанавливаем комментарии
-                for stage_name, comments in obj_data.get('comments', {}).items():
-                    stage = ConstructionStage[stage_name]
-                    obj.comments[stage] = comments
-
-                construction_manager.objects[obj.id] = obj
-
-            # ВОССТАНАВЛИВАЕМ RUNNING LIST ДАННЫЕ
-            running_list = user_data.running_list
-
-            for task_data in data.get('running_list', {}).get('tasks', []):
-                try:
-                    task = RunningTask(
-                        description=task_data['description'],
-                        priority=TaskPriority[task_data['priority']],
-                        task_id=task_data['id']
-                    )
-                    task.created_date = datetime.fromisoformat(task_data['created_date'])
-                    task.is_completed = task_data['is_completed']
-
-                    if task_data['completed_date']:
-                        task.completed_date = datetime.fromisoformat(task_data['completed_date'])
+            with TRACER.span('storage.load', 'storage', chat_id=chat_id):
+                return self._read_user_data(chat_id, filename)
+        finally:
+            STORAGE_BYTES.observe(os.path.getsize(filename), operation='load')
+            STORAGE_DURATION.observe(time.perf_counter() - start, operation='load')
 
-                    if task_data['due_date']:
-                        task.due_date = datetime.fromisoformat(task_data['due_date'])
+    def _read_user_data(self, chat_id: int, filename: str):
+        # Импортируем здесь, чтобы избежать циклических импортов
+        from ..models.user_data import UserData
 
-                    running_list.tasks.append(task)
-
-                except KeyError as e:
-                    print(f"Ошибка загрузки задачи running list: {e}")
-                    continue
+        if not os.path.exists(filename):
+            logger.info("Файл данных для пользователя %s не найден, создаем новый", chat_id, extra={'chat_id': chat_id})
+            return UserData(chat_id)
 
-            print(f"✅ Данные пользователя {chat_id} загружены")
+        try:
+            with open(filename, 'rb') as f:
+                data = decode(f.read())
+
+            user_data, version = decode_user(chat_id, data, self._load_segment)
+            if version < SCHEMA_VERSION:
+                logger.info("Файл пользователя %s версии %s прочитан с миграцией до %s", chat_id, version,
+                            SCHEMA_VERSION, extra={'chat_id': chat_id})
+
+            # Разделы, которые лежали прямо в файле пользователя (до версии 3), уже прочитаны
+            segments = user_data.loaded_segments()
+            for name, segment in segments.items():
+                self._prepare_segment(chat_id, name, segment, data[name])
+            if segments:
+                # и сразу отдают холодные записи: в памяти остается только рабочее
+                self._archive_cold(user_data)
+            logger.debug("Данные пользователя %s загружены", chat_id, extra={'chat_id': chat_id})
             return user_data
 
         except Exception as e:
-            print(f"❌ Ошибка загрузки данных для пользователя {chat_id}: {e}")
-            from ..models.user_data import UserData
+            logger.exception("Ошибка загрузки данных для пользователя %s: %s", chat_id, e, extra={'chat_id': chat_id})
+            STORAGE_ERRORS.inc(operation='load')
             return UserData(chat_id)
 
+    def _load_segment(self, user_data, name: str):
+        """Загружает раздел пользователя при первом обращении к нему (UserData.segment_loader)"""
+        chat_id = user_data.chat_id
+        start = time.perf_counter()
+        with self.user_lock(chat_id):
+            segment = user_data.loaded(name)
+            if segment is not None:
+                # Раздел уже загрузил другой поток
+                return segment
+            segment = user_data.create_segment(name)
+            data = {}
+            expected = user_data.segment_versions.get(name)
+            if expected:
+                path = self._segment_file(chat_id, name)
+                try:
+                    with TRACER.span('storage.load_segment', 'storage', chat_id=chat_id):
+                        with open(path, 'rb') as f:
+                            raw = f.read()
+                        data = decode(raw)
+                        fill_segment(segment, data)
+                    STORAGE_BYTES.observe(len(raw), operation='load_segment')
+                    if data.get('version', 0) < expected:
+                        logger.warning("Раздел %s пользователя %s старее заголовка: версия %s вместо %s", name,
+                                       chat_id, data.get('version', 0), expected, extra={'chat_id': chat_id})
+                except Exception as e:
+                    logger.exception("Ошибка загрузки раздела %s пользователя %s: %s", name, chat_id, e,
+                                     extra={'chat_id': chat_id})
+                    STORAGE_ERRORS.inc(operation='load_segment')
+                    segment, data = user_data.create_segment(name), {}
+            self._prepare_segment(chat_id, name, segment, data)
+            user_data.set_segment(name, segment)
+        STORAGE_DURATION.observe(time.perf_counter() - start, operation='load_segment')
+        logger.debug("Раздел %s пользователя %s загружен", name, chat_id, extra={'chat_id': chat_id})
+        return segment
+
+    def _prepare_segment(self, chat_id: int, name: str, segment, data: dict):
+        """Подключает к прочитанному разделу его архив и журналы комментариев объектов"""
+        self._attach_archive(chat_id, name, segment)
+        if name != 'construction':
+            return
+
+        from ..models.construction import ConstructionStage, Comment
+        for obj_data in data.get('objects', []):
+            obj = segment.objects[obj_data['id']]
+            if 'comments' in obj_data:
+                # Старый формат: готовые строки "дд.мм.гггг чч:мм: текст" прямо в файле пользователя
+                for stage_name, comments in obj_data['comments'].items():
+                    stage = ConstructionStage[stage_name]
+                    for line in comments:
+                        obj.comment_log.append(Comment.from_legacy(line, stage, chat_id, obj.created_date))
+                obj.comment_log.needs_rewrite = True
+            else:
+                self._load_comment_log(chat_id, obj)
+
+    def _attach_archive(self, chat_id: int, name: str, segment):
+        journal, model = ARCHIVES[name]
+        # Путь фиксируется сразу (storage_dir абсолютный): журнал читается позже, из любого потока
+        path = self._archive_path(chat_id, journal)
+        segment.archive.loader = lambda: self._load_archive(chat_id, path, journal, model)
+
+    def _archive_path(self, chat_id: int, name: str) -> str:
+        return os.path.join(self._user_dir(chat_id), 'archive', f"user_{chat_id}_{name}.jsonl")
+
+    def _archive_cold(self, user_data):
+        segments = user_data.loaded_segments()
+        counts = {name: len(segment.archive) for name, segment in segments.items()}
+        if not user_data.archive_cold():
+            return
+        for name, segment in segments.items():
+            if len(segment.archive) > counts[name]:
+                STORAGE_ARCHIVED.inc(len(segment.archive) - counts[name], segment=name)
+        logger.debug("Холодные записи пользователя %s перенесены в архив", user_data.chat_id,
+                     extra={'chat_id': user_data.chat_id})
+
+    def _save_archive(self, chat_id: int, name: str, model: type, archive):
+        """Дописывает в журнал архива новые записи одной строкой-списком; после удалений переписывает журнал"""
+        pending = archive.unpersisted()
+        if not archive.needs_rewrite and not pending:
+            return
+
+        path = self._archive_path(chat_id, name)
+        # Журнал без сохраненных записей (новый пользователь или потерянный файл пользователя) пишется заново
+        if archive.needs_rewrite or len(pending) == archive.count:
+            records = archive.resident()
+            if records:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + ".tmp", 'w', encoding='utf-8') as f:
+                    f.write(self._archive_line(model, records))
+                os.replace(path + ".tmp", path)
+            elif os.path.exists(path):
+                os.remove(path)
+        else:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(self._archive_line(model, pending))
+        archive.mark_persisted()
+
+    @staticmethod
+    def _archive_line(model: type, records: list) -> str:
+        return json.dumps(encode_records(model, records), ensure_ascii=False, separators=(',', ':')) + '\n'
+
+    def _load_archive(self, chat_id: int, path: str, name: str, model: type) -> Optional[list]:
+        """Записи журнала архива; None - журнала нет на диске (архив не переписывается по пустому списку)"""
+        start = time.perf_counter()
+        records = []
+        # Под блокировкой пользователя: журнал не дописывается, пока его читают
+        with self.user_lock(chat_id), TRACER.span('storage.load_archive', 'storage', chat_id=chat_id):
+            if not os.path.exists(path):
+                logger.error("Журнал архива не найден: %s", path, extra={'chat_id': chat_id})
+                STORAGE_ERRORS.inc(operation='load_archive')
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        records.extend(decode_records(model, json.loads(line)))
+                    except (ValueError, KeyError, TypeError) as e:
+                        # Недописанная последняя строка после аварийного завершения
+                        logger.warning("Пропущена запись архива %s: %s", path, e)
+            if name == 'objects':
+                for obj in records:
+                    self._load_comment_log(chat_id, obj)
+            STORAGE_BYTES.observe(os.path.getsize(path), operation='load_archive')
+        STORAGE_DURATION.observe(time.perf_counter() - start, operation='load_archive')
+        logger.debug("Архив %s пользователя %s загружен: %s записей", name, chat_id, len(records),
+                     extra={'chat_id': chat_id})
+        return records
+
+    def _comment_log_path(self, chat_id: int, object_id: int) -> str:
+        return os.path.join(self._user_dir(chat_id), 'comments', f"user_{chat_id}_object_{object_id}.jsonl")
+
+    def _save_comment_log(self, chat_id: int, obj):
+        """Дописывает в журнал объекта только новые комментарии"""
+        log = obj.comment_log
+        if not log.needs_rewrite and not log.unpersisted():
+            return
+
+        path = self._comment_log_path(chat_id, obj.id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        mode = 'w' if log.needs_rewrite else 'a'
+        entries = list(log) if log.needs_rewrite else log.unpersisted()
+        with open(path, mode, encoding='utf-8') as f:
+            for comment in entries:
+                f.write(json.dumps({
+                    'ts': comment.timestamp.isoformat(),
+                    'author': comment.author_chat_id,
+                    'stage': comment.stage.name,
+                    'text': comment.text
+                }, ensure_ascii=False))
+                f.write('\n')
+        log.mark_persisted()
+
+    def _load_comment_log(self, chat_id: int, obj):
+        from ..models.construction import ConstructionStage, Comment
+
+        path = self._comment_log_path(chat_id, obj.id)
+        if not os.path.exists(path):
+            return
+
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    obj.comment_log.append(Comment(
+                        timestamp=datetime.fromisoformat(record['ts']),
+                        author_chat_id=record['author'],
+                        stage=ConstructionStage[record['stage']],
+                        text=record['text']
+                    ))
+                except (ValueError, KeyError) as e:
+                    # Недописанная последняя строка после аварийного завершения
+                    logger.warning("Пропущена запись журнала комментариев %s: %s", path, e)
+                    obj.comment_log.needs_rewrite = True
+        if not obj.comment_log.needs_rewrite:
+            obj.comment_log.mark_persisted()
+
+    def _bot_state_file(self) -> str:
+        return os.path.join(self.storage_dir, "bot_state.json")
+
+    def save_bot_state(self, state: dict):
+        """Сохраняет состояние бота (последний обработанный update_id)"""
+        filename = self._bot_state_file()
+        try:
+            # Через временный файл: при аварии остается либо старое, либо новое состояние
+            with open(filename + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(filename + ".tmp", filename)
+        except OSError as e:
+            logger.error("Ошибка сохранения состояния бота: %s", e)
+
+    def load_bot_state(self) -> dict:
+        """Загружает состояние бота; пустое, если файла нет или он поврежден"""
+        try:
+            with open(self._bot_state_file(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("Ошибка загрузки состояния бота: %s", e)
+            return {}
+
+    def _conversations_file(self, name: str) -> str:
+        return os.path.join(self.storage_dir, f"{name}.json")
+
+    def save_conversations(self, name: str, conversations: dict):
+        """Сохраняет состояния диалогов в data/<name>.json"""
+        filename = self._conversations_file(name)
+        start = time.perf_counter()
+        try:
+            os.makedirs(self.storage_dir, exist_ok=True)
+            with open(filename + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(conversations, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(filename + ".tmp", filename)
+            STORAGE_BYTES.observe(os.path.getsize(filename), operation='save_conversations')
+        except OSError as e:
+            STORAGE_ERRORS.inc(operation='save_conversations')
+            logger.error("Ошибка сохранения состояний диалогов: %s", e)
+        STORAGE_DURATION.observe(time.perf_counter() - start, operation='save_conversations')
+
+    def load_conversations(self) -> Dict[str, list]:
+        """Состояния диалогов из всех файлов data/conversations*.json; при повторе берется более свежая запись"""
+        merged: Dict[str, list] = {}
+        if not os.path.exists(self.storage_dir):
+            return merged
+        for filename in os.listdir(self.storage_dir):
+            if not (filename.startswith("conversations") and filename.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(self.storage_dir, filename), 'r', encoding='utf-8') as f:
+                    conversations = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning("Ошибка загрузки состояний диалогов из %s: %s", filename, e)
+                continue
+            for chat_id, data in conversations.items():
+                # data = [state, touched_at, flows]
+                if chat_id not in merged or data[1] > merged[chat_id][1]:
+                    merged[chat_id] = data
+        return merged
+
+    def list_users(self) -> Dict[int, dict]:
+        """chat_id -> {path, size, version, mtime} по манифесту; еще не перенесенные - с версией 0"""
+        users = self.manifest.users()
+        for chat_id, paths in list(self._legacy.items()):
+            try:
+                stat = os.stat(paths[0])
+            except FileNotFoundError:
+                continue
+            users.setdefault(chat_id, {
+                'path': os.path.relpath(paths[0], self.storage_dir), 'size': stat.st_size,
+                'version': 0, 'mtime': round(stat.st_mtime, 3),
+            })
+        return users
+
     def save_all_data(self, users_data: Dict[int, object]):
         """Сохраняет данные всех пользователей"""
-        print(f"💾 Сохранение данных {len(users_data)} пользователей...")
+        logger.info("Сохранение данных %s пользователей...", len(users_data))
         for user_data in users_data.values():
             self.save_user_data(user_data)
-        print("✅ Все данные сохранены!")
+        self.manifest.compact()
+        logger.info("Все данные сохранены!")
 
-    def load_all_data(self) -> Dict[int, object]:
-        """Загружает данные всех пользователей"""
+    def load_all_data(self, owned: Optional[Callable[[int], bool]] = None) -> Dict[int, object]:
+        """Загружает данные всех пользователей (owned - только чатов, для которых owned(chat_id) истинно)"""
         users_data = {}
 
-        if not os.path.exists(self.storage_dir):
-            print("📁 Папка данных не существует, создаем новую")
-            return users_data
-
-        print("🔄 Загрузка данных пользователей...")
-        for filename in os.listdir(self.storage_dir):
-            if filename.startswith("user_") and filename.endswith(".json"):
-                try:
-                    chat_id = int(filename[5:-5])  # извлекаем chat_id из "user_12345.json"
-                    user_data = self.load_user_data(chat_id)
-                    users_data[chat_id] = user_data
-                except ValueError as e:
-                    print(f"✗ Ошибка обработки файла {filename}: {e}")
-                    continue
+        logger.info("Загрузка данных пользователей...")
+        # Список - из манифеста и старой раскладки, без обхода папок
+        chat_ids = set(self.manifest.users()) | set(self._legacy)
+        for chat_id in sorted(chat_ids):
+            if owned is not None and not owned(chat_id):
+                continue
+            users_data[chat_id] = self.load_user_data(chat_id)
 
-        print(f"✅ Загружены данные {len(users_data)} пользователей")
-        return users_data
\ No newline at end of file
+        logger.info("Загружены данные %s пользователей", len(users_data))
+        return users_data
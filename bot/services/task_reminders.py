@@ -0,0 +1,92 @@
+from typing import Callable, Dict, Iterable, List, Optional
+
+from ..models.running_list import RunningTask
+from .logging_service import get_logger
+from .scheduler_service import Scheduler, TimerKey
+from .update_service import UserLocks
+
+logger = get_logger('task_reminders')
+
+TASK_DUE = 'task_due'
+
+
+class TaskReminders:
+    """
+    Напоминания о сроках задач Running List на общей куче Scheduler. У пользователя один таймер -
+    ближайший срок среди его невыполненных задач: куча растет с числом пользователей, а не задач,
+    и срок хранится в заголовке файла (UserData.timers), поэтому при запуске куча собирается без чтения списков задач.
+    Выполнение и удаление задач кучу не трогают: при срабатывании список задач пользователя
+    проверяется заново, выполненные и удаленные пропускаются, таймер переносится на следующий срок.
+    Срабатывание держит блокировку пользователя (user_locks - общие с обработкой апдейтов, add вызывается под ней).
+    """
+
+    def __init__(self, scheduler: Scheduler, users_data: Dict[int, object], storage_service,
+                 notify: Callable[[int, List[RunningTask]], None], user_locks: Optional[UserLocks] = None):
+        self.scheduler = scheduler
+        self.users_data = users_data
+        self.storage_service = storage_service
+        self.notify = notify
+        self.user_locks = user_locks if user_locks is not None else UserLocks()
+
+    def restore(self, users: Iterable) -> int:
+        """Ставит таймеры загруженных пользователей по сохраненным срокам; возвращает число таймеров"""
+        count = 0
+        for user_data in users:
+            when = (user_data.timers or {}).get(TASK_DUE)
+            if when is not None:
+                self.scheduler.schedule((TASK_DUE, user_data.chat_id), when, self._fire)
+                count += 1
+        logger.info("Напоминания о сроках задач восстановлены: %s", count)
+        return count
+
+    def add(self, user_data, task: RunningTask) -> bool:
+        """
+        Учитывает срок задачи (новой или открытой снова); True - таймер пользователя перенесен на него.
+        Вызывающий сохраняет пользователя
+        """
+        if task.due_date is None or task.is_completed:
+            return False
+        due = task.due_date.timestamp()
+        if due <= self.scheduler.clock():
+            return False
+        with self.user_locks(user_data.chat_id):
+            current = (user_data.timers or {}).get(TASK_DUE)
+            if current is not None and current <= due:
+                # Таймер сработает раньше и при срабатывании найдет этот срок сам
+                return False
+            user_data.set_timer(TASK_DUE, due)
+            self.scheduler.schedule((TASK_DUE, user_data.chat_id), due, self._fire)
+        return True
+
+    def _fire(self, key: TimerKey, when: float):
+        _, chat_id = key
+        user_data = self.users_data.get(chat_id)
+        if user_data is None:
+            # Пользователь ушел с шардом другому воркеру - таймер заведет новый владелец
+            return
+        now = max(when, self.scheduler.clock())
+        due: List[RunningTask] = []
+        upcoming: Optional[float] = None
+        # Апдейт того же пользователя не меняет задачи посреди срабатывания и не сохраняет их наполовину
+        with self.user_locks(chat_id):
+            if self.users_data.get(chat_id) is not user_data:
+                # Пока ждали блокировку, шард передали другому воркеру
+                return
+            for task in user_data.running_list.get_active_tasks():
+                if task.due_date is None:
+                    continue
+                at = task.due_date.timestamp()
+                # Сроки раньше when напомнили прошлые срабатывания
+                if when <= at <= now:
+                    due.append(task)
+                elif at > now and (upcoming is None or at < upcoming):
+                    upcoming = at
+            if upcoming is None:
+                user_data.drop_timer(TASK_DUE)
+            else:
+                user_data.set_timer(TASK_DUE, upcoming)
+                self.scheduler.schedule(key, upcoming, self._fire)
+            if due:
+                self.notify(chat_id, due)
+                logger.debug("Напоминания о сроках: %s", len(due), extra={'chat_id': chat_id})
+            self.storage_service.save_user_data(user_data)
@@ -0,0 +1,115 @@
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Callable, Dict, Iterable, Optional
+
+from ..models.timesheet import payroll_period
+from .logging_service import get_logger
+from .scheduler_service import Scheduler, TimerKey
+from .update_service import UserLocks
+
+logger = get_logger('timesheet_timers')
+
+# Конец рабочего дня: отметки дня блокируются, последний день периода закрывает период
+LOCK_TIME = dtime(23, 0)
+
+LOCK_ATTENDANCE = 'lock_attendance'
+CLOSE_PERIOD = 'close_period'
+
+
+class TimesheetTimers:
+    """
+    Таймеры табеля на Scheduler: каждый день в lock_time блокируются отметки присутствия
+    (и забытые дни до него), в lock_time последнего дня периода (15-е и конец месяца) период
+    закрывается и пользователю уходит расчет зарплаты за него (on_period_closed).
+    Сроки хранятся в заголовке файла пользователя (UserData.timers): после перезапуска таймеры
+    ставятся заново без чтения табелей, пропущенные за время простоя срабатывают сразу.
+    Таймеры заводятся только пользователям с работниками и снимаются, когда работников не осталось.
+    Срабатывание держит блокировку пользователя (user_locks - общие с обработкой апдейтов).
+    """
+
+    def __init__(self, scheduler: Scheduler, users_data: Dict[int, object], storage_service,
+                 on_period_closed: Callable[[int, object, date, date], None], lock_time: dtime = LOCK_TIME,
+                 user_locks: Optional[UserLocks] = None):
+        self.scheduler = scheduler
+        self.users_data = users_data
+        self.storage_service = storage_service
+        self.user_locks = user_locks if user_locks is not None else UserLocks()
+        self.on_period_closed = on_period_closed
+        self.lock_time = lock_time
+        self._handlers = {LOCK_ATTENDANCE: self._lock_attendance, CLOSE_PERIOD: self._close_period}
+
+    def _at(self, day: date) -> float:
+        return datetime.combine(day, self.lock_time).timestamp()
+
+    def _next_lock(self, now: float) -> float:
+        day = datetime.fromtimestamp(now).date()
+        when = self._at(day)
+        return when if when > now else self._at(day + timedelta(days=1))
+
+    def _next_close(self, now: float) -> float:
+        day = datetime.fromtimestamp(now).date()
+        when = self._at(payroll_period(day)[1])
+        if when > now:
+            return when
+        return self._at(payroll_period(day + timedelta(days=1))[1])
+
+    def restore(self, users: Iterable) -> int:
+        """Ставит таймеры загруженных пользователей по сохраненным срокам; возвращает число таймеров"""
+        count = 0
+        for user_data in users:
+            if user_data.timers is None:
+                # Файл до таймеров: работники могут быть - первое срабатывание проверит
+                self._start(user_data)
+            for name, when in user_data.timers.items():
+                # В том же словаре - таймеры других служб (TaskReminders)
+                if name in self._handlers:
+                    self.scheduler.schedule((name, user_data.chat_id), when, self._fire)
+                    count += 1
+        logger.info("Таймеры табеля восстановлены: %s", count)
+        return count
+
+    def ensure(self, user_data):
+        """Заводит таймеры пользователю, у которого их нет (например, добавлен первый работник)"""
+        if LOCK_ATTENDANCE not in (user_data.timers or {}):
+            self._start(user_data)
+            for name in self._handlers:
+                self.scheduler.schedule((name, user_data.chat_id), user_data.timers[name], self._fire)
+
+    def _start(self, user_data):
+        now = self.scheduler.clock()
+        user_data.set_timer(LOCK_ATTENDANCE, self._next_lock(now))
+        user_data.set_timer(CLOSE_PERIOD, self._next_close(now))
+
+    def _fire(self, key: TimerKey, when: float):
+        name, chat_id = key
+        user_data = self.users_data.get(chat_id)
+        if user_data is None:
+            # Пользователь ушел с шардом другому воркеру - таймер заведет новый владелец
+            return
+        # Апдейт того же пользователя не правит табель посреди срабатывания и не сохраняет его наполовину
+        with self.user_locks(chat_id):
+            if self.users_data.get(chat_id) is not user_data:
+                # Пока ждали блокировку, шард передали другому воркеру
+                return
+            timesheet = user_data.timesheet
+            if not timesheet.employees:
+                user_data.drop_timer(name)
+            else:
+                next_when = self._handlers[name](user_data, timesheet, when)
+                user_data.set_timer(name, next_when)
+                self.scheduler.schedule(key, next_when, self._fire)
+            self.storage_service.save_user_data(user_data)
+
+    def _lock_attendance(self, user_data, timesheet, when: float) -> float:
+        day = datetime.fromtimestamp(when).date()
+        locked = timesheet.lock_attendance_until(day)
+        logger.debug("Отметки по %s заблокированы: %s", day, locked, extra={'chat_id': user_data.chat_id})
+        # Следующий - ближайший будущий, а не каждый пропущенный день: он заблокирует и дни простоя
+        return self._next_lock(max(when, self.scheduler.clock()))
+
+    def _close_period(self, user_data, timesheet, when: float) -> float:
+        start_date, end_date = payroll_period(datetime.fromtimestamp(when).date())
+        timesheet.lock_attendance_until(end_date)
+        self.on_period_closed(user_data.chat_id, timesheet, start_date, end_date)
+        logger.info("Период %s - %s закрыт", start_date, end_date, extra={'chat_id': user_data.chat_id})
+        # Следующий - конец следующего периода, даже если он уже прошел: каждый пропущенный период получит расчет
+        return self._next_close(when)
@@ -0,0 +1,227 @@
+import functools
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+# Доля апдейтов, для которых пишутся спаны (0 - трассировка выключена)
+DEFAULT_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0') or 0)
+DEFAULT_TRACE_DIR = os.getenv('TRACE_DIR', 'traces')
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+DEFAULT_BACKUPS = 3
+# Сколько последних трасс держим в памяти для выгрузки через Flask
+DEFAULT_KEEP_LAST = 200
+
+TRACE_FILE = 'trace.json'
+
+# logging_service сам зависит от трассировщика, поэтому логгер берем напрямую
+logger = logging.getLogger('bot.tracing')
+
+
+def chat_id_of(target) -> Optional[int]:
+    """chat_id из Message, CallbackQuery или самого числа"""
+    if isinstance(target, int):
+        return target
+    # CallbackQuery - берем чат из сообщения с кнопками
+    message = target.message if hasattr(target, 'data') and hasattr(target, 'message') else target
+    chat = getattr(message, 'chat', None)
+    return getattr(chat, 'id', None)
+
+
+class _NoopContext:
+    """Контекст для невыбранных апдейтов: ничего не делает"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopContext()
+
+
+class _Trace:
+    __slots__ = ('correlation_id', 'sampled', 'events')
+
+    def __init__(self, correlation_id: str, sampled: bool):
+        self.correlation_id = correlation_id
+        self.sampled = sampled
+        self.events: List[Dict] = []
+
+
+class _SpanContext:
+    __slots__ = ('tracer', 'trace', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer: 'Tracer', trace: _Trace, name: str, category: str, args: Dict):
+        self.tracer = tracer
+        self.trace = trace
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        args = self.args
+        args['cid'] = self.trace.correlation_id
+        if exc_type is not None:
+            args['error'] = exc_type.__name__
+        self.trace.events.append({
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': self.tracer._timestamp(self.start),
+            'dur': round((end - self.start) * 1e6, 1),
+            'pid': self.tracer.pid,
+            'tid': threading.get_ident(),
+            'args': args,
+        })
+        return False
+
+
+class _TraceContext:
+    __slots__ = ('tracer', 'trace', 'span', 'previous')
+
+    def __init__(self, tracer: 'Tracer', trace: _Trace, span: Optional[_SpanContext]):
+        self.tracer = tracer
+        self.trace = trace
+        self.span = span
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = getattr(self.tracer._local, 'trace', None)
+        self.tracer._local.trace = self.trace
+        if self.span is not None:
+            self.span.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self.span is not None:
+                self.span.__exit__(exc_type, exc, tb)
+                self.tracer._finish(self.trace)
+        finally:
+            self.tracer._local.trace = self.previous
+        return False
+
+
+class Tracer:
+    """
+    Спаны обработки апдейтов в формате Chrome trace (открывается в Perfetto и chrome://tracing).
+    У каждого апдейта есть correlation id; спаны пишутся только для выбранной доли апдейтов.
+    """
+
+    def __init__(self, sample_rate: float = DEFAULT_SAMPLE_RATE, directory: str = DEFAULT_TRACE_DIR,
+                 max_bytes: int = DEFAULT_MAX_BYTES, backups: int = DEFAULT_BACKUPS,
+                 keep_last: int = DEFAULT_KEEP_LAST):
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.pid = os.getpid()
+        self._recent = deque(maxlen=keep_last)
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # perf_counter -> микросекунды от эпохи
+        self._epoch_offset = time.time() - time.perf_counter()
+
+    def _timestamp(self, perf: float) -> float:
+        return round((perf + self._epoch_offset) * 1e6, 1)
+
+    def configure(self, sample_rate: Optional[float] = None, directory: Optional[str] = None):
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if directory is not None:
+            self.directory = directory
+
+    def trace(self, name: str, category: str = 'update', **args) -> _TraceContext:
+        """Корневой спан апдейта: назначает correlation id и решает, пишется ли трасса"""
+        correlation_id = f"{self.pid:x}-{next(self._ids):x}"
+        sampled = bool(self.sample_rate) and random.random() < self.sample_rate
+        trace = _Trace(correlation_id, sampled)
+        span = _SpanContext(self, trace, name, category, args) if sampled else None
+        return _TraceContext(self, trace, span)
+
+    def span(self, name: str, category: str = '', **args):
+        trace = getattr(self._local, 'trace', None)
+        if trace is None or not trace.sampled:
+            return _NOOP
+        return _SpanContext(self, trace, name, category, args)
+
+    def correlation_id(self) -> Optional[str]:
+        trace = getattr(self._local, 'trace', None)
+        return trace.correlation_id if trace is not None else None
+
+    # Хранение и выгрузка
+
+    def _finish(self, trace: _Trace):
+        # Chrome ждет события в порядке начала; корневой спан закрывается последним
+        events = sorted(trace.events, key=lambda event: event['ts'])
+        with self._lock:
+            self._recent.append(events)
+            try:
+                self._write(events)
+            except OSError as e:
+                logger.warning("Ошибка записи трассы: %s", e)
+
+    def _write(self, events: List[Dict]):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, TRACE_FILE)
+        if os.path.exists(path) and os.path.getsize(path) >= self.max_bytes:
+            self._rotate(path)
+
+        # Формат JSON-массива: закрывающая скобка не обязательна, поэтому файл можно дописывать
+        new_file = not os.path.exists(path)
+        with open(path, 'a', encoding='utf-8') as f:
+            if new_file:
+                f.write("[\n")
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False))
+                f.write(",\n")
+
+    def _rotate(self, path: str):
+        base, ext = os.path.splitext(path)
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{base}.{index}{ext}"
+            if os.path.exists(older):
+                os.replace(older, f"{base}.{index + 1}{ext}")
+        if self.backups > 0:
+            os.replace(path, f"{base}.1{ext}")
+        else:
+            os.remove(path)
+
+    def export(self, last: int = 20) -> Dict:
+        """Последние трассы одним документом Chrome trace"""
+        with self._lock:
+            traces = list(self._recent)[-last:] if last > 0 else []
+        return {
+            'traceEvents': [event for events in traces for event in events],
+            'displayTimeUnit': 'ms',
+        }
+
+
+# Общий трассировщик процесса
+TRACER = Tracer()
+
+
+def traced_update(kind: str):
+    """Декоратор точки входа апдейта: корневой спан и correlation id"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(self, update, *args, **kwargs):
+            with TRACER.trace(kind, chat_id=chat_id_of(update)):
+                return func(self, update, *args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional
+
+from .metrics_service import UPDATES_SKIPPED
+
+# Типы апдейтов, которые обрабатывает бот; остальные Telegram не присылает вовсе
+ALLOWED_UPDATES = ['message', 'callback_query', 'inline_query']
+
+# Сколько последних id апдейтов и callback-запросов помним для отсева повторов
+DEDUP_WINDOW = 2048
+# Повторное нажатие той же кнопки того же сообщения в течение этого времени считается двойным
+DOUBLE_TAP_SECONDS = 1.0
+# Полос блокировок пользователей (UserLocks): чаты одной полосы изменяются по очереди
+USER_LOCK_STRIPES = 256
+
+
+class RecentKeys:
+    """Ограниченное множество последних ключей: старые вытесняются новыми"""
+
+    def __init__(self, maxlen: int = DEDUP_WINDOW):
+        self.maxlen = maxlen
+        self._keys: 'OrderedDict[Hashable, float]' = OrderedDict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def seen(self, key: Hashable, now: float, within: Optional[float] = None) -> bool:
+        """Был ли ключ недавно (within - не дольше стольких секунд назад); запоминает его"""
+        previous = self._keys.get(key)
+        repeated = previous is not None and (within is None or now - previous < within)
+        if not repeated:
+            self._keys[key] = now
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.maxlen:
+                self._keys.popitem(last=False)
+        return repeated
+
+
+class UserLocks:
+    """
+    Блокировки изменения данных пользователя: апдейт держит блокировку своего чата всю обработку,
+    таймеры (timesheet_timers.py, task_reminders.py) - все срабатывание вместе с сохранением.
+    Реентерабельные: экран вызывает другой экран того же пользователя
+    """
+
+    def __init__(self, stripes: int = USER_LOCK_STRIPES):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def __call__(self, chat_id: int) -> threading.RLock:
+        return self._locks[chat_id % len(self._locks)]
+
+
+class UpdateFilter:
+    """
+    Отсев повторных апдейтов перед обработкой: повторная доставка (тот же update_id или id
+    callback-запроса) и двойное нажатие inline-кнопки. Хранит последний принятый update_id,
+    который сохраняется вместе с данными пользователей; после перезапуска апдейты не новее него отбрасываются.
+    """
+
+    def __init__(self, last_update_id: int = 0, window: int = DEDUP_WINDOW,
+                 double_tap_seconds: float = DOUBLE_TAP_SECONDS):
+        self.last_update_id = last_update_id
+        # Апдейты до сохраненного update_id обработаны до перезапуска; окно RecentKeys их уже не помнит
+        self._restored_update_id = last_update_id
+        self.double_tap_seconds = double_tap_seconds
+        self._updates = RecentKeys(window)
+        self._callbacks = RecentKeys(window)
+        self._taps = RecentKeys(window)
+        self._lock = threading.Lock()
+
+    def _skip_reason(self, update, now: float) -> Optional[str]:
+        if update.update_id <= self._restored_update_id or self._updates.seen(update.update_id, now):
+            return 'duplicate_update'
+        call = update.callback_query
+        if call is not None:
+            if self._callbacks.seen(call.id, now):
+                return 'duplicate_callback'
+            if call.message is not None:
+                tap = (call.message.chat.id, call.message.message_id, call.data)
+                if self._taps.seen(tap, now, self.double_tap_seconds):
+                    return 'double_tap'
+        return None
+
+    def filter(self, updates: List, on_double_tap: Optional[Callable] = None) -> List:
+        """
+        Новые апдейты из пачки; last_update_id сдвигается и за отброшенными.
+        on_double_tap(call) получает отброшенные двойные нажатия: это отдельные запросы, на них нужно ответить.
+        """
+        now = time.monotonic()
+        fresh, double_taps = [], []
+        with self._lock:
+            for update in updates:
+                if update.update_id > self.last_update_id:
+                    self.last_update_id = update.update_id
+                reason = self._skip_reason(update, now)
+                if reason is None:
+                    fresh.append(update)
+                    continue
+                UPDATES_SKIPPED.inc(reason=reason)
+                if reason == 'double_tap':
+                    double_taps.append(update.callback_query)
+        if on_double_tap is not None:
+            for call in double_taps:
+                on_double_tap(call)
+        return fresh
@@ -1,14 +1,64 @@
 import os
+import sys
+import hmac
+import json
 import threading
-from flask import Flask
+from datetime import datetime
+from flask import Flask, Response, abort, jsonify, request
 from bot.bot import FinanceBot
+from bot.cluster import ShardWorker, UpdateDispatcher, WorkerSupervisor, lease_dir
+from bot.services.backup_service import BackupService
+from bot.services.shard_service import ShardLeases
+from bot.services.storage_service import JSONStorageService, move_legacy_data
+from bot.services.metrics_service import CONTENT_TYPE, METRICS
+from bot.services.tracing_service import TRACER
+from bot.services.logging_service import get_logger, setup_logging
 
 # Получаем токен из переменных окружения
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 
+# Адрес Bot API, если нужен не api.telegram.org (например, локальный стенд для нагрузочных тестов)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
+# Токен для отладочных маршрутов /debug/*; без него маршруты выключены
+DEBUG_TOKEN = os.getenv('DEBUG_TOKEN')
+
+# Несколько процессов (bot/cluster.py): WORKERS воркеров, SHARDS шардов (по умолчанию по шарду на воркер).
+# WORKERS=0 - как раньше, один процесс. BOT_ROLE=worker и WORKER_ID выставляет сам диспетчер
+WORKERS = int(os.getenv('WORKERS', '0'))
+SHARDS = int(os.getenv('SHARDS', '0')) or WORKERS
+BOT_ROLE = os.getenv('BOT_ROLE', '')
+WORKER_ID = int(os.getenv('WORKER_ID', '0'))
+# Папка данных пользователей. Без DATA_DIR - ./data; файлы прежней папки temp/data переносятся туда при запуске
+DATA_DIR = os.path.abspath(os.getenv('DATA_DIR', 'data'))
+
+# Формат файлов пользователей: json, gzip, lzma или binary (см. bot/services/storage_codecs.py).
+# Читаются файлы любого формата, поэтому менять можно на работающих данных
+STORAGE_CODEC = os.getenv('STORAGE_CODEC', 'json')
+
+# Резервные копии (bot/services/backup_service.py): раз в BACKUP_INTERVAL секунд, 0 - выключены.
+# Восстановление: python -m bot.backup restore
+BACKUP_DIR = os.path.abspath(os.getenv('BACKUP_DIR', 'backups'))
+BACKUP_INTERVAL = float(os.getenv('BACKUP_INTERVAL', '0'))
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '14'))
+
+# Потоки фоновых задач (bot/services/job_service.py): отчеты и расчет зарплаты
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+
+# Конец рабочего дня (ЧЧ:ММ, время сервера): отметки присутствия блокируются, в последний день
+# периода (15-е и конец месяца) период закрывается и приходит расчет зарплаты (bot/services/timesheet_timers.py)
+ATTENDANCE_LOCK_TIME = datetime.strptime(os.getenv('ATTENDANCE_LOCK_TIME', '23:00'), '%H:%M').time()
+
 # Простой HTTP сервер для здоровья приложения
 app = Flask(__name__)
 
+# Экземпляр бота для отладочных маршрутов; создается в __main__
+finance_bot = None
+# Воркер шарда (BOT_ROLE=worker): принимает апдейты от диспетчера
+shard_worker = None
+# Резервные копии; только в режиме одного процесса
+backup_service = None
+
 
 @app.route('/')
 def home():
@@ -20,18 +70,165 @@ def health():
     return "OK"
 
 
-def run_flask():
+@app.route('/metrics')
+def metrics():
+    return Response(METRICS.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/traces')
+def traces():
+    # Последние N трасс в формате Chrome trace: открыть в ui.perfetto.dev или chrome://tracing.
+    # В трассах chat_id и данные обработчиков - доступ как у /debug/*; трассы есть у процесса любой роли
+    _require_debug_access(needs_bot=False)
+    last = request.args.get('last', default=20, type=int)
+    return Response(
+        json.dumps(TRACER.export(last), ensure_ascii=False),
+        mimetype='application/json',
+        headers={'Content-Disposition': 'attachment; filename=traces.json'}
+    )
+
+
+def _require_debug_access(needs_bot: bool = True):
+    if not DEBUG_TOKEN:
+        abort(404)
+    token = request.headers.get('X-Debug-Token') or request.args.get('token', '')
+    if not hmac.compare_digest(token.encode('utf-8'), DEBUG_TOKEN.encode('utf-8')):
+        abort(403)
+    if needs_bot and finance_bot is None:
+        abort(503)
+
+
+@app.route('/debug/memory')
+def debug_memory():
+    # Размер данных по пользователям и подсистемам; пересчитываются только изменившиеся пользователи
+    _require_debug_access()
+    top = request.args.get('top', default=10, type=int)
+    budget = request.args.get('budget', default=200, type=int)
+    return jsonify(finance_bot.memory_service.report(top=top, budget=budget))
+
+
+@app.route('/debug/memory/tracemalloc')
+def debug_tracemalloc():
+    # action=start, затем action=snapshot (разница с предыдущим снимком), action=stop
+    _require_debug_access()
+    action = request.args.get('action', default='snapshot')
+    limit = request.args.get('limit', default=20, type=int)
+    try:
+        return jsonify(finance_bot.memory_service.tracemalloc_diff(action, limit))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/debug/storage')
+def debug_storage():
+    # Файлы пользователей по манифесту хранилища: сколько, общий размер, самые большие
+    _require_debug_access()
+    top = request.args.get('top', default=10, type=int)
+    users = finance_bot.storage_service.list_users()
+    largest = sorted(users.items(), key=lambda item: item[1]['size'], reverse=True)[:top]
+    return jsonify({
+        'users': len(users),
+        'bytes': sum(entry['size'] for entry in users.values()),
+        'not_migrated': sum(1 for entry in users.values() if entry['version'] == 0),
+        'largest': [dict(entry, chat_id=chat_id) for chat_id, entry in largest],
+    })
+
+
+@app.route('/debug/backup', methods=['POST'])
+def debug_backup():
+    # Внеочередная резервная копия
+    _require_debug_access()
+    if backup_service is None:
+        return jsonify({'error': 'backups disabled'}), 404
+    stats = backup_service.create()
+    if stats is None:
+        return jsonify({'error': 'backup in progress'}), 409
+    return jsonify(stats)
+
+
+@app.route('/shard/updates', methods=['POST'])
+def shard_updates():
+    # Апдейты одного шарда от диспетчера; 409 - шард у другого воркера, диспетчер найдет владельца заново
+    if shard_worker is None:
+        abort(404)
+    payload = request.get_json()
+    if not shard_worker.handle(payload['shard'], payload['updates']):
+        return jsonify({'error': 'not owner'}), 409
+    return jsonify({'ok': True})
+
+
+def run_flask(host: str = '0.0.0.0'):
+    port = int(os.getenv('PORT', 5000))
+    app.run(host=host, port=port)
+
+
+def run_worker():
+    global finance_bot, shard_worker
     port = int(os.getenv('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    leases = ShardLeases(lease_dir(DATA_DIR), SHARDS, WORKER_ID, WORKERS, f"http://127.0.0.1:{port}")
+    shard_worker = ShardWorker(BOT_TOKEN, leases, JSONStorageService(DATA_DIR, codec=STORAGE_CODEC),
+                               api_url=TELEGRAM_API_URL, job_workers=JOB_WORKERS, lock_time=ATTENDANCE_LOCK_TIME)
+    finance_bot = shard_worker.finance_bot
+    shard_worker.start()
+    logger.info("Воркер %s запущен, шарды: %s", WORKER_ID, leases.held)
+    try:
+        # Воркер слушает только локальный адрес: апдейты приходят от диспетчера на этой же машине
+        run_flask(host='127.0.0.1')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shard_worker.stop()
+
+
+def run_dispatcher():
+    flask_thread = threading.Thread(target=run_flask)
+    flask_thread.daemon = True
+    flask_thread.start()
+
+    dispatcher = UpdateDispatcher(BOT_TOKEN, JSONStorageService(DATA_DIR, codec=STORAGE_CODEC), lease_dir(DATA_DIR),
+                                  SHARDS, api_url=TELEGRAM_API_URL)
+    # Воркеры - на следующих портах после порта диспетчера
+    supervisor = WorkerSupervisor([sys.executable, os.path.abspath(__file__)], WORKERS,
+                                  int(os.getenv('PORT', 5000)) + 1,
+                                  env=dict(os.environ, DATA_DIR=DATA_DIR, SHARDS=str(SHARDS)))
+    stop = threading.Event()
+    supervisor.start()
+    threading.Thread(target=supervisor.watch, args=(stop,), daemon=True).start()
+    logger.info("Диспетчер запущен: воркеров %s, шардов %s", WORKERS, SHARDS)
+    try:
+        if not dispatcher.wait_for_owners(stop):
+            logger.warning("Не все шарды получили владельца, опрос начат без них")
+        dispatcher.poll(stop)
+    except KeyboardInterrupt:
+        logger.info("Бот остановлен пользователем")
+    finally:
+        stop.set()
+        supervisor.stop()
 
 
 if __name__ == '__main__':
+    # JSON-логи в stdout через фоновый поток: уровень LOG_LEVEL, выборка DEBUG по чатам LOG_DEBUG_SAMPLE_RATE
+    setup_logging()
+    logger = get_logger('main')
+
     if not BOT_TOKEN:
-        print("❌ Ошибка: BOT_TOKEN не установлен!")
-        print("💡 Установите переменную окружения BOT_TOKEN на Railway")
+        logger.error("BOT_TOKEN не установлен! Установите переменную окружения BOT_TOKEN на Railway")
         exit(1)
 
-    print(f"✅ BOT_TOKEN получен, запуск бота...")
+    logger.info("BOT_TOKEN получен, запуск бота...")
+
+    if BOT_ROLE == 'worker':
+        run_worker()
+        sys.exit(0)
+    if 'DATA_DIR' not in os.environ:
+        # Прежние версии работали из папки temp/ и хранили пользователей в temp/data - забираем их до загрузки.
+        # Воркерам DATA_DIR передает диспетчер, перенос делает он
+        move_legacy_data(DATA_DIR)
+    if WORKERS > 0:
+        if BACKUP_INTERVAL:
+            logger.warning("Резервные копии на лету есть только в режиме одного процесса, BACKUP_INTERVAL не учтен")
+        run_dispatcher()
+        sys.exit(0)
 
     # Запускаем Flask в отдельном потоке для Railway
     flask_thread = threading.Thread(target=run_flask)
@@ -39,5 +236,9 @@ if __name__ == '__main__':
     flask_thread.start()
 
     # Запускаем бота
-    bot = FinanceBot(BOT_TOKEN)
-    bot.run()
\ No newline at end of file
+    finance_bot = FinanceBot(BOT_TOKEN, storage_service=JSONStorageService(DATA_DIR, codec=STORAGE_CODEC),
+                             api_url=TELEGRAM_API_URL, job_workers=JOB_WORKERS, lock_time=ATTENDANCE_LOCK_TIME)
+    backup_service = BackupService(finance_bot.storage_service, BACKUP_DIR, keep=BACKUP_KEEP)
+    if BACKUP_INTERVAL:
+        backup_service.start(BACKUP_INTERVAL)
+    finance_bot.run()
\ No newline at end of file
@@ -0,0 +1,31 @@
+import os
+
+from bot.models.conversation import TaskDraft
+from bot.models.user_data import UserData
+from bot.services.conversation_service import ConversationStore
+from bot.services.storage_service import JSONStorageService
+
+
+def test_conversations_survive_restart_after_chdir(tmp_path, monkeypatch):
+    # Бот запускается из корня приложения, а рабочая папка потом может смениться
+    monkeypatch.chdir(tmp_path)
+    storage = JSONStorageService()
+    store = ConversationStore(storage)
+    user_data = store.adopt(UserData(42))
+    user_data.state = 'waiting_task_priority'
+    user_data.conversation.put(TaskDraft('купить кабель'))
+
+    elsewhere = tmp_path / 'elsewhere'
+    elsewhere.mkdir()
+    monkeypatch.chdir(elsewhere)
+    store.stop()
+    storage.save_bot_state({'last_update_id': 7})
+
+    assert not os.path.exists(elsewhere / 'data')
+
+    monkeypatch.chdir(tmp_path)
+    restarted = JSONStorageService()
+    restored = ConversationStore(restarted).adopt(UserData(42))
+    assert restored.state == 'waiting_task_priority'
+    assert restored.conversation.get(TaskDraft) == TaskDraft('купить кабель')
+    assert restarted.load_bot_state() == {'last_update_id': 7}
@@ -0,0 +1,20 @@
+import os
+import shutil
+
+from bot.services.storage_service import JSONStorageService, move_legacy_data
+
+# Файл пользователя в формате первых версий, лежит в репозитории там же, где их хранил бот
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), '..', 'temp', 'data', 'user_1320620131.json')
+
+
+def test_users_from_temp_data_are_kept(tmp_path, monkeypatch):
+    legacy = tmp_path / 'temp' / 'data'
+    legacy.mkdir(parents=True)
+    shutil.copy(BASELINE_FILE, legacy)
+    monkeypatch.chdir(tmp_path)
+
+    assert move_legacy_data('data') == 1
+    assert move_legacy_data('data') == 0
+    users = JSONStorageService('data').load_all_data()
+    assert list(users) == [1320620131]
+    assert not list(legacy.iterdir())